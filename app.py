@@ -1,34 +1,40 @@
 from flask import Flask, Response, render_template, request
 import threading
 import time
-import queue
 import redis_rl_cache_simulation as sim
+from broadcast import BroadcastHub, sse_stream
+from metrics import SimulationMetrics, render
 
 app = Flask(__name__)
 
-# Queues for streaming logs and plot data to frontend
-log_queue_cache = queue.Queue()
-log_queue_nocache = queue.Queue()
-plot_queue = queue.Queue()
+# Hubs for streaming logs and plot data to frontend. Every viewer gets
+# its own bounded buffer, so extra tabs don't steal events and nothing
+# piles up while nobody is watching.
+log_hub_cache = BroadcastHub()
+log_hub_nocache = BroadcastHub()
+plot_hub = BroadcastHub()
 
 # Shared state for simulation   
 sim_running = False
 
-# In app.py, add a new queue for the summary
-summary_queue = queue.Queue()
+# Keeps the last summary for viewers that connect after both runs finish
+summary_hub = BroadcastHub(retain=1)
+
+# Histograms and counters of the latest run of each simulation, for /metrics
+run_metrics = {'cache': SimulationMetrics('cache'), 'nocache': SimulationMetrics('nocache')}
 
 # Helper to run the RL cache simulation
-def run_cache_sim():
+def run_cache_sim(seed):
     global cache_summary
-    cache_summary = sim.run_simulation(with_cache=True, log_queue=log_queue_cache, plot_queue=plot_queue)
-    log_queue_cache.put({'type': 'done', 'results': cache_summary})
+    cache_summary = sim.run_simulation(with_cache=True, log_queue=log_hub_cache, plot_queue=plot_hub, seed=seed,
+                                       metrics=run_metrics['cache'], snapshot_path=sim.SNAPSHOT_PATH)
     maybe_send_summary()
 
 # Helper to run the no-cache simulation
-def run_nocache_sim():
+def run_nocache_sim(seed):
     global nocache_summary
-    nocache_summary = sim.run_simulation(with_cache=False, log_queue=log_queue_nocache, plot_queue=plot_queue)
-    log_queue_nocache.put({'type': 'done', 'results': nocache_summary})
+    nocache_summary = sim.run_simulation(with_cache=False, log_queue=log_hub_nocache, plot_queue=plot_hub, seed=seed,
+                                         metrics=run_metrics['nocache'])
     maybe_send_summary()
 
 def maybe_send_summary():
@@ -36,7 +42,7 @@ def maybe_send_summary():
     if 'cache_summary' in globals() and 'nocache_summary' in globals():
         summary_str = sim.format_simulation_summary(cache_summary, nocache_summary)
         summary_str_global = summary_str  # Store for later GET
-        summary_queue.put(summary_str)
+        summary_hub.put({'type': 'summary', 'text': summary_str})
         sim_running = False  # Reset the flag when both simulations are done
 
 @app.route('/start', methods=['POST'])
@@ -45,57 +51,52 @@ def start_simulation():
     if sim_running:
         return 'Simulation already running', 400
     sim_running = True
-    # Start both simulations in parallel
-    threading.Thread(target=run_cache_sim, daemon=True).start()
-    threading.Thread(target=run_nocache_sim, daemon=True).start()
+    # Both runs replay the same seeded request stream (?seed=N to pick it)
+    seed = request.args.get('seed', default=time.time_ns(), type=int)
+    run_metrics.update(cache=SimulationMetrics('cache'), nocache=SimulationMetrics('nocache'))
+    for name in ('cache_summary', 'nocache_summary'):
+        globals().pop(name, None)
+    summary_hub.reset()
+    threading.Thread(target=run_cache_sim, args=(seed,), daemon=True).start()
+    threading.Thread(target=run_nocache_sim, args=(seed,), daemon=True).start()
     return 'Started', 200
 
+def _is_done(event):
+    return event.get('type') == 'done'
+
+def _sse(hub, until=None):
+    # Each response holds one subscription and sends a JSON array of the
+    # events from every batch window
+    return Response(sse_stream(hub, until), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/stream/cache')
 def stream_cache():
-    def event_stream():
-        while True:
-            msg = log_queue_cache.get()
-            if isinstance(msg, dict) and msg.get('type') == 'done':
-                break
-            if isinstance(msg, str) and msg == '__done__':
-                break
-            yield f'data: {msg}\n\n'
-    return Response(event_stream(), mimetype='text/event-stream')
+    return _sse(log_hub_cache, _is_done)
 
 @app.route('/stream/nocache')
 def stream_nocache():
-    def event_stream():
-        while True:
-            msg = log_queue_nocache.get()
-            if isinstance(msg, dict) and msg.get('type') == 'done':
-                break
-            if isinstance(msg, str) and msg == '__done__':
-                break
-            yield f'data: {msg}\n\n'
-    return Response(event_stream(), mimetype='text/event-stream')
+    return _sse(log_hub_nocache, _is_done)
 
 @app.route('/stream/plot')
 def stream_plot():
-    def event_stream():
-        while True:
-            msg = plot_queue.get()
-            yield f'data: {msg}\n\n'
-    return Response(event_stream(), mimetype='text/event-stream')
+    return _sse(plot_hub)
 
 @app.route('/stream/summary')
 def stream_summary():
-    def event_stream():
-        while True:
-            msg = summary_queue.get()
-            yield f'data: {msg}\n\n'
-            break
-    return Response(event_stream(), mimetype='text/event-stream')
+    return _sse(summary_hub, lambda event: event.get('type') == 'summary')
 
 @app.route('/summary')
 def get_summary():
     global summary_str_global
     return summary_str_global, 200, {'Content-Type': 'text/plain; charset=utf-8'}
 
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition: latency percentiles per template and
+    # tier, hit ratios, evictions and policy-table size
+    return render(*run_metrics.values()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -103,4 +104,6 @@ def index():
 summary_str_global = ""
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
+    # Threaded, so every open stream waits in its own thread instead of
+    # holding up other requests
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
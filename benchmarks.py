@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+import psycopg2
+import redis
+
+from db_executor import DB_CONFIG, AsyncQueryExecutor, QueryExecutor
+from load_driver import StubExecutor, percentile, summarize
+from redis_rl_cache_simulation import (MEMORY_CACHE_SIZE, MultiLevelRLCache, queries, serve_query,
+                                       synthetic_query_distribution)
+from result_codec import PickleCodec, RowCodec
+
+# === Memory-Tier Put Latency vs Capacity ===
+
+def bench_memory_put(capacities=(50, 500, 5000, 50000, 100000), puts=20000):
+    # Fill the memory tier, then time puts of fresh keys so every put evicts.
+    # promote_from_redis=True keeps the Redis tier out of the measurement.
+    results = {}
+    for capacity in capacities:
+        cache = MultiLevelRLCache(capacity, 0, redis_client=None)
+        for i in range(capacity):
+            key = ("bench", i)
+            cache.put(key, i, promote_from_redis=True)
+            cache.update_q_value(key, "cache", i % 7)
+        start = time.perf_counter()
+        for i in range(capacity, capacity + puts):
+            key = ("bench", i)
+            cache.put(key, i, promote_from_redis=True)
+            cache.decay_q_table()
+        elapsed = time.perf_counter() - start
+        results[capacity] = elapsed / puts * 1e6
+    return results
+
+# === Result Codec Throughput and Size ===
+
+CATEGORIES = ['Laptops', 'Mobiles', 'Tablets', 'Accessories', 'Desktops', 'Wearables']
+BRANDS = ['Apple', 'Samsung', 'Dell', 'HP', 'Lenovo', 'Asus', 'Sony', 'Acer']
+STATUSES = ['delivered', 'pending', 'cancelled']
+
+def sample_result(q_name, rng):
+    # Rows shaped like what psycopg2 returns for each template
+    day = date(2024, 7, 1)
+    price = lambda: Decimal(f"{rng.uniform(100, 2000):.2f}")
+    rating = lambda: Decimal(f"{rng.uniform(2.5, 5.0):.2f}")
+    if q_name == "daily_sales_product":
+        return [(day + timedelta(days=i), rng.randint(1, 60)) for i in range(30)]
+    if q_name == "avg_order_value_user":
+        return [(Decimal(rng.uniform(100, 6000)).quantize(Decimal('1.0000000000000000')),)]
+    if q_name == "users_also_bought":
+        return [(rng.randint(1, 1000),) for _ in range(5)]
+    if q_name == "running_total_sales_product":
+        total = 0
+        rows = []
+        for i in range(30):
+            total += rng.randint(1, 60)
+            rows.append((day + timedelta(days=i), total))
+        return rows
+    if q_name == "top_rated_products_category":
+        return [(f"Product_{rng.randint(1, 1000)}", rating()) for _ in range(5)]
+    if q_name == "reviewed_and_bought":
+        return [(uid, f"User_{uid}") for uid in rng.sample(range(1, 5001), 12)]
+    if q_name == "products_on_promotion_season":
+        return [(pid, f"Product_{pid}", rng.choice(CATEGORIES), price(), rng.choice(BRANDS), rating())
+                for pid in rng.sample(range(1, 100001), 2000)]
+    if q_name == "orders_by_city_in_season":
+        return [(oid, rng.randint(1, 5000), rng.randint(1, 1000), day + timedelta(days=rng.randint(0, 62)),
+                 rng.choice(STATUSES), rng.randint(1, 5)) for oid in range(1, 5001)]
+    raise KeyError(q_name)
+
+def _ops_per_sec(fn, arg, min_time=0.2):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        fn(arg)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return runs / elapsed
+
+def bench_codecs(codecs=(PickleCodec(), RowCodec())):
+    # Decode is timed through len() plus a full scan so lazy decoding is
+    # charged for materializing the rows, like a real consumer would.
+    rng = random.Random(0)
+    results = {}
+    for q_name, _, _ in queries:
+        rows = sample_result(q_name, rng)
+        for codec in codecs:
+            payload = codec.encode(rows)
+            assert list(codec.decode(payload)) == rows
+            results[(q_name, codec.name)] = {
+                'bytes': len(payload),
+                'encode_per_sec': _ops_per_sec(codec.encode, rows),
+                'decode_per_sec': _ops_per_sec(lambda p: sum(1 for _ in codec.decode(p)), payload),
+            }
+    return results
+
+# === Metadata Memory per Tracked Key ===
+
+def deep_sizeof(obj, seen=None):
+    # Bytes reachable from obj, counting shared objects once
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def metadata_trace(requests, key_space, rng):
+    # Long-tail key stream: a hot head plus a uniform tail of one-off keys
+    templates = [q[0] for q in queries]
+    for _ in range(requests):
+        if rng.random() < 0.6:
+            key_id = int(rng.paretovariate(1.2)) % 200
+        else:
+            key_id = rng.randrange(key_space)
+        yield (templates[key_id % len(templates)], key_id)
+
+def _legacy_metadata(keys):
+    # The per-key layout MultiLevelRLCache used before CacheEntry: five
+    # maps plus a nested defaultdict Q-table, none of them ever pruned.
+    q_table = defaultdict(lambda: defaultdict(float))
+    q_epoch, freshness, costs, sizes, values = {}, {}, {}, {}, defaultdict(int)
+    for i, key in enumerate(keys):
+        values[key] += 1
+        freshness[key] = time.time()
+        q_table[key]["cache"] += 0.5
+        q_table[key]["evict"] -= 0.5
+        q_epoch[key] = i
+        costs[key] = 12.5
+        sizes[key] = 512
+    return [q_table, q_epoch, freshness, costs, sizes, values]
+
+def bench_metadata_memory(requests=10_000_000, key_space=2_000_000, legacy_sample=200_000):
+    rng = random.Random(0)
+    cache = MultiLevelRLCache(MEMORY_CACHE_SIZE, 0, redis_client=None, epsilon=0.0)
+    seen = bytearray(key_space)
+    for i, key in enumerate(metadata_trace(requests, key_space, rng)):
+        seen[key[1]] = 1
+        value, _ = cache.get(key)
+        if value is None:
+            cache.put(key, i, promote_from_redis=True, cost=12.5, size=512)
+            cache.update_q_value(key, "evict", -3)
+        else:
+            cache.update_q_value(key, "cache", 7)
+        cache.decay_q_table()
+    distinct = sum(seen)
+    tracked = len(cache.entries) + len(cache.ghosts)
+    after = deep_sizeof([cache.entries, cache.ghosts, cache.memory_heap.priority, cache.memory_heap.position,
+                         cache.memory_heap.heap])
+    # The legacy layout grows by the same amount for every key, so its
+    # bytes/key are measured on a sample rather than on every distinct key.
+    sample = list(dict.fromkeys(metadata_trace(legacy_sample, key_space, random.Random(1))))
+    before_per_key = deep_sizeof(_legacy_metadata(sample)) / len(sample)
+    return {
+        'requests': requests,
+        'distinct_keys': distinct,
+        'before_tracked': distinct,
+        'before_bytes_per_key': before_per_key,
+        'before_total_bytes': before_per_key * distinct,
+        'after_tracked': tracked,
+        'after_bytes_per_key': after / tracked,
+        'after_total_bytes': after,
+    }
+
+# === DB Miss Path: per-call execute vs pooled prepared statements ===
+
+def bench_db_miss_path(requests=2000, concurrency=8, seed=0):
+    # Needs a reachable Postgres with the schema loaded (PG* env vars).
+    random.seed(seed)
+    trace = [(q, param) for q, param in (synthetic_query_distribution() for _ in range(requests))]
+    results = {}
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    latencies = []
+    start = time.perf_counter()
+    for (_, q_text, _), param in trace:
+        t = time.perf_counter()
+        cur.execute(q_text, param)
+        cur.fetchall()
+        latencies.append((time.perf_counter() - t) * 1000)
+    results['raw execute, 1 connection'] = summarize(latencies, time.perf_counter() - start)
+    cur.close()
+    conn.close()
+
+    executor = QueryExecutor(queries, maxconn=1)
+    latencies = []
+    start = time.perf_counter()
+    for (q_name, _, _), param in trace:
+        t = time.perf_counter()
+        executor.execute(q_name, param)
+        latencies.append((time.perf_counter() - t) * 1000)
+    results['prepared, 1 connection'] = summarize(latencies, time.perf_counter() - start)
+    executor.close()
+
+    async def run_async():
+        executor = AsyncQueryExecutor(queries, maxconn=concurrency)
+        latencies = []
+
+        async def one(q_name, param):
+            t = time.perf_counter()
+            await executor.execute(q_name, param)
+            latencies.append((time.perf_counter() - t) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(q[0], param) for q, param in trace))
+        wall = time.perf_counter() - start
+        executor.close()
+        return summarize(latencies, wall)
+
+    results[f'prepared async, {concurrency} in flight'] = asyncio.run(run_async())
+    return results
+
+# === Cache Hot Paths: get / put / update_q_value / decay ===
+
+HOT_PATH_CAPACITIES = (50, 1000, 10000)
+HOT_PATH_CARDINALITIES = (100, 10_000, 1_000_000)
+HOT_PATH_ZIPF = 0.9  # popularity of the rank-r key is proportional to 1 / r**HOT_PATH_ZIPF
+BASELINE_PATH = 'benchmark_baseline.json'
+REGRESSION_THRESHOLD = 0.15  # fractional slowdown that counts as a regression
+
+def make_redis(redis_url=None):
+    # A local redis-server when given a URL, otherwise in-process fakeredis
+    if redis_url:
+        return redis.StrictRedis.from_url(redis_url)
+    import fakeredis
+    return fakeredis.FakeStrictRedis()
+
+def _latency_stats(latencies_ns):
+    ordered = sorted(latencies_ns)
+    total = sum(ordered)
+    return {
+        'ops': len(ordered),
+        'ops_per_sec': len(ordered) / (total / 1e9) if total else 0.0,
+        'p50_us': percentile(ordered, 50) / 1000,
+        'p99_us': percentile(ordered, 99) / 1000,
+    }
+
+def _time_each(fn, calls):
+    latencies = []
+    clock = time.perf_counter_ns
+    for args in calls:
+        t = clock()
+        fn(*args)
+        latencies.append(clock() - t)
+    return latencies
+
+def _zipf_keys(rng, ops, cardinality, zipf_s=HOT_PATH_ZIPF):
+    # Zipf over ranks 1..cardinality (as in workload.SkewedWorkload), so the
+    # stream really spans the key space instead of a few hundred head keys
+    cumulative = list(itertools.accumulate(1 / r ** zipf_s for r in range(1, cardinality + 1)))
+    total = cumulative[-1]
+    return [("daily_sales_product", min(bisect.bisect_left(cumulative, rng.random() * total), cardinality - 1))
+            for _ in range(ops)]
+
+def bench_hot_paths(capacities=HOT_PATH_CAPACITIES, cardinalities=HOT_PATH_CARDINALITIES, ops=20000,
+                    redis_url=None, db_latency_ms=0.0, seed=0):
+    """Per-call latency of the cache's public operations. Redis is a local
+    server or fakeredis, the DB a StubExecutor; the key stream is seeded
+    and Zipf-skewed over the whole cardinality, so every run replays the
+    same operations. Each result also reports the stream's distinct keys."""
+    results = {}
+    for capacity in capacities:
+        for cardinality in cardinalities:
+            random.seed(seed)
+            keys = _zipf_keys(random.Random(seed), ops, cardinality)
+            executor = StubExecutor(db_latency_ms, rows=30)
+            values = {key: executor.execute(key[0], key[1:]) for key in dict.fromkeys(keys)}
+            cache = MultiLevelRLCache(capacity, 2 * capacity, make_redis(redis_url), epsilon=0.0,
+                                      namespace=f'bench:{capacity}:{cardinality}')
+            cache.redis_tier.clear()
+            label = f'cap={capacity}/keys={cardinality}'
+            results[f'put/{label}'] = _latency_stats(_time_each(cache.put, [(k, values[k]) for k in keys]))
+            results[f'get/{label}'] = _latency_stats(_time_each(cache.get, [(k,) for k in keys]))
+            results[f'update_q_value/{label}'] = _latency_stats(
+                _time_each(cache.update_q_value, [(k, "cache", 7) for k in keys]))
+            results[f'decay_q_table/{label}'] = _latency_stats(_time_each(cache.decay_q_table, [()] * ops))
+            cache.redis_tier.clear()
+            results[f'serve_query/{label}'] = _latency_stats(
+                _time_each(serve_query, [(cache, executor, k[0], k[1:]) for k in keys]))
+            cache.redis_tier.clear()
+            cache.close()
+            for op in ('put', 'get', 'update_q_value', 'decay_q_table', 'serve_query'):
+                results[f'{op}/{label}']['distinct_keys'] = len(values)
+    return results
+
+def save_baseline(results, path=BASELINE_PATH, **meta):
+    meta.update(python=platform.python_version(), machine=platform.machine(), created=time.strftime('%Y-%m-%d %H:%M:%S'))
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+
+def compare_to_baseline(results, path=BASELINE_PATH, threshold=REGRESSION_THRESHOLD):
+    """Returns (name, metric, baseline, current) for every benchmark whose
+    throughput fell, or whose p99 rose, by more than threshold."""
+    with open(path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if current['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            regressions.append((name, 'ops_per_sec', before['ops_per_sec'], current['ops_per_sec']))
+        if current['p99_us'] > before['p99_us'] * (1 + threshold):
+            regressions.append((name, 'p99_us', before['p99_us'], current['p99_us']))
+    return regressions
+
+def _print_memory_put():
+    print("--- Memory-tier put latency (full tier, every put evicts) ---")
+    for capacity, usec in bench_memory_put().items():
+        print(f"  capacity {capacity:>7}: {usec:.2f} us/put")
+
+def _print_codecs():
+    print("--- Result codecs: size and throughput per query template ---")
+    for (q_name, codec_name), r in bench_codecs().items():
+        print(f"  {q_name:<30} {codec_name:<7} {r['bytes']:>8} B"
+              f"  enc {r['encode_per_sec']:>10.0f}/s  dec {r['decode_per_sec']:>10.0f}/s")
+
+def _print_metadata():
+    r = bench_metadata_memory()
+    print(f"--- Cache metadata after {r['requests']:,} requests ({r['distinct_keys']:,} distinct keys) ---")
+    print(f"  before: {r['before_tracked']:>10,} keys tracked, {r['before_bytes_per_key']:.0f} B/key,"
+          f" {r['before_total_bytes'] / 2**20:.1f} MiB")
+    print(f"  after:  {r['after_tracked']:>10,} keys tracked, {r['after_bytes_per_key']:.0f} B/key,"
+          f" {r['after_total_bytes'] / 2**20:.1f} MiB")
+
+def _print_db():
+    print("--- DB miss path (needs local Postgres) ---")
+    for name, r in bench_db_miss_path().items():
+        print(f"  {name:<30} {r['per_sec']:>8.0f} q/s  mean {r['mean_ms']:.2f} ms"
+              f"  p50 {r['p50_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms")
+
+def _print_hot_paths(args):
+    results = bench_hot_paths(ops=args.ops, redis_url=args.redis_url, db_latency_ms=args.db_latency_ms)
+    print(f"--- Cache hot paths ({args.redis_url or 'fakeredis'}, stub DB {args.db_latency_ms} ms) ---")
+    for name, r in results.items():
+        print(f"  {name:<42} {r['ops_per_sec']:>10.0f} ops/s  p50 {r['p50_us']:>8.1f} us  p99 {r['p99_us']:>8.1f} us"
+              f"  {r['distinct_keys']:>7} keys")
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline, ops=args.ops, redis=args.redis_url or 'fakeredis',
+                      db_latency_ms=args.db_latency_ms)
+        print(f"  baseline saved to {args.save_baseline}")
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f"  REGRESSION {name} {metric}: {before:.1f} -> {after:.1f}")
+        if regressions:
+            return 1
+        print(f"  no regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+BENCHMARKS = {
+    'memory_put': _print_memory_put,
+    'codecs': _print_codecs,
+    'metadata': _print_metadata,
+    'db': _print_db,
+    'hot_paths': _print_hot_paths,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache micro-benchmarks')
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--ops', type=int, default=20000, help='hot_paths: operations per measurement')
+    parser.add_argument('--redis-url', help='hot_paths: local redis-server to use instead of fakeredis')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='hot_paths: stub DB latency per miss')
+    parser.add_argument('--save-baseline', metavar='PATH', help='hot_paths: write results as the new baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='hot_paths: flag regressions against this baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    status = 0
+    for name in args.names or BENCHMARKS:
+        if name == 'hot_paths':
+            status |= _print_hot_paths(args)
+        else:
+            BENCHMARKS[name]()
+    return status
+
+if __name__ == '__main__':
+    # python benchmarks.py [name ...]; runs everything by default
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import collections
+import json
+import threading
+import time
+
+# === Broadcast Hub ===
+#
+# One publisher, any number of subscribers. Every subscriber gets its own
+# bounded ring buffer, so a slow or idle dashboard tab only loses its own
+# oldest events and never blocks the simulation thread or holds memory
+# for the others. Publishing with nobody subscribed keeps only the last
+# `retain` events, which new subscribers see first.
+
+SUBSCRIBER_BUFFER = 256
+BATCH_WINDOW_S = 0.1
+KEEPALIVE_S = 15.0
+
+class Subscription:
+    """A subscriber's view of a hub: a drop-oldest ring buffer drained in
+    time-windowed batches."""
+
+    def __init__(self, hub, maxlen, backlog=()):
+        self.hub = hub
+        self.buffer = collections.deque(backlog, maxlen=maxlen)
+        self.ready = threading.Condition(hub.lock)
+        self.dropped = 0
+        self.closed = False
+
+    def _push(self, event):
+        # Called with hub.lock held
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(event)
+        self.ready.notify()
+
+    def get_batch(self, window=BATCH_WINDOW_S, timeout=KEEPALIVE_S):
+        """Waits up to timeout for an event, then keeps collecting for
+        window seconds and returns everything buffered (an empty list on
+        timeout, None once closed). Overflow since the last batch shows up
+        as a leading {'type': 'dropped', 'count': n} event."""
+        with self.ready:
+            if not self.buffer and not self.closed:
+                self.ready.wait(timeout)
+            if self.closed and not self.buffer:
+                return None
+            if not self.buffer:
+                return []
+        if window:
+            time.sleep(window)
+        with self.ready:
+            batch = list(self.buffer)
+            self.buffer.clear()
+            if self.dropped:
+                batch.insert(0, {'type': 'dropped', 'count': self.dropped})
+                self.dropped = 0
+        return batch
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class BroadcastHub:
+    """Fan-out of JSON-serialisable events. put() never blocks, so the hub
+    can stand in for the queue.Queue that run_simulation writes to."""
+
+    def __init__(self, maxlen=SUBSCRIBER_BUFFER, retain=0):
+        self.maxlen = maxlen
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.history = collections.deque(maxlen=retain)
+        self.published = 0
+
+    def put(self, event):
+        with self.lock:
+            self.published += 1
+            self.history.append(event)
+            for subscription in self.subscribers:
+                subscription._push(event)
+
+    publish = put
+
+    def subscribe(self):
+        with self.lock:
+            subscription = Subscription(self, self.maxlen, self.history)
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+            subscription.closed = True
+            subscription.ready.notify_all()
+
+    def reset(self):
+        # Forget retained events before a new run
+        with self.lock:
+            self.history.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'subscribers': len(self.subscribers), 'published': self.published,
+                    'dropped': sum(s.dropped for s in self.subscribers)}
+
+def sse_stream(hub, until=None, window=BATCH_WINDOW_S, keepalive=KEEPALIVE_S):
+    """Server-sent events for a new subscription to hub: one `data:` line
+    per batch holding a JSON array of events. Ends after an event for
+    which until(event) is true, or when the client disconnects (the server
+    closes the generator, which unsubscribes)."""
+    with hub.subscribe() as subscription:
+        while True:
+            batch = subscription.get_batch(window, keepalive)
+            if batch is None:
+                return
+            if not batch:
+                yield ': keepalive\n\n'
+                continue
+            yield f'data: {json.dumps(batch)}\n\n'
+            if until is not None and any(until(event) for event in batch):
+                return
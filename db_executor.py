@@ -0,0 +1,117 @@
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# === PostgreSQL Connection Settings ===
+# Taken from the standard libpq environment variables so credentials never
+# live in the source tree.
+DB_CONFIG = {
+    'dbname': os.environ.get('PGDATABASE', 'postgres'),
+    'user': os.environ.get('PGUSER', 'postgres'),
+    'password': os.environ.get('PGPASSWORD', ''),
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'port': int(os.environ.get('PGPORT', 5432)),
+}
+DB_POOL_MAX = 8
+
+_PLACEHOLDER = re.compile(r'%s')
+
+def to_prepared_sql(q_text):
+    # psycopg2's %s placeholders become PREPARE's positional $1, $2, ...
+    counter = iter(range(1, 1000))
+    return _PLACEHOLDER.sub(lambda _: f'${next(counter)}', q_text.strip().rstrip(';'))
+
+# === Pooled Executor with Server-Side Prepared Statements ===
+
+class QueryExecutor:
+    """Runs the named query templates on pooled connections. Each template
+    is PREPAREd the first time a connection runs it and EXECUTEd by name
+    from then on, so Postgres parses and plans it once per connection
+    instead of on every miss. Safe to share between threads: callers block
+    until one of the maxconn connections is free. The pool keeps minconn
+    connections open between calls (maxconn by default): psycopg2 closes
+    any connection handed back beyond that, prepared statements and all."""
+
+    def __init__(self, templates, minconn=None, maxconn=DB_POOL_MAX, **db_config):
+        self.templates = {q_name: to_prepared_sql(q_text) for q_name, q_text, _ in templates}
+        minconn = maxconn if minconn is None else minconn
+        self.pool = ThreadedConnectionPool(minconn, maxconn, **(db_config or DB_CONFIG))
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.maxconn = maxconn
+        self.prepared = {}  # connection -> names prepared on it
+        self.lock = threading.Lock()
+
+    def _checkout(self):
+        self.slots.acquire()
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            if conn not in self.prepared:
+                # Read-only templates: autocommit keeps a failed query from
+                # leaving the pooled connection in an aborted transaction.
+                conn.autocommit = True
+                self.prepared[conn] = set()
+            return conn, self.prepared[conn]
+
+    def _checkin(self, conn, broken=False):
+        self.pool.putconn(conn, close=broken)
+        if conn.closed:
+            # Broken, or surplus to minconn: its statements went with it
+            with self.lock:
+                self.prepared.pop(conn, None)
+        self.slots.release()
+
+    def execute(self, q_name, params):
+        conn, prepared = self._checkout()
+        broken = False
+        try:
+            with conn.cursor() as cur:
+                if q_name not in prepared:
+                    cur.execute(f'PREPARE {q_name} AS {self.templates[q_name]}')
+                    prepared.add(q_name)
+                if params:
+                    cur.execute(f'EXECUTE {q_name} ({", ".join(["%s"] * len(params))})', params)
+                else:
+                    cur.execute(f'EXECUTE {q_name}')
+                return cur.fetchall()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(conn, broken)
+
+    def close(self):
+        self.pool.closeall()
+        with self.lock:
+            self.prepared.clear()
+
+# === asyncio Front End ===
+
+class AsyncQueryExecutor:
+    """asyncio variant of QueryExecutor. psycopg2 is blocking, so each
+    execute() runs on a worker thread that holds one pooled connection;
+    a single event loop can then keep up to maxconn misses in flight."""
+
+    def __init__(self, templates, minconn=None, maxconn=DB_POOL_MAX, **db_config):
+        self.executor = QueryExecutor(templates, minconn, maxconn, **db_config)
+        self.threads = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix='db')
+
+    async def execute(self, q_name, params):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.threads, self.executor.execute, q_name, params)
+
+    async def execute_many(self, requests):
+        # requests: iterable of (q_name, params); results keep their order
+        return await asyncio.gather(*(self.execute(q_name, params) for q_name, params in requests))
+
+    def close(self):
+        self.threads.shutdown(wait=True)
+        self.executor.close()
@@ -0,0 +1,108 @@
+import math
+import threading
+
+import numpy as np
+
+# === Feature-Based Q-Value Approximation ===
+#
+# A drop-in alternative to the per-key Q-table: Q(key, action) is a linear
+# function of a few features of the key, so keys that were never seen
+# (or seen once) get an estimate learned from similar keys, and the
+# model is the same size however many distinct keys the workload has.
+#
+# Features, all roughly in [0, 2]:
+#   one-hot template    first TEMPLATE_SLOTS - 1 templates seen, then a shared slot
+#   bias
+#   frequency           log1p(hits)
+#   recency             log1p(requests since the key's previous access)
+#   cost                log1p(measured DB ms), plus a "cost unknown" flag
+#   size                log1p(encoded bytes)
+
+TEMPLATE_SLOTS = 16
+N_FEATURES = TEMPLATE_SLOTS + 6
+ACTIONS = ('cache', 'evict')
+
+class LinearQLearner:
+    """Linear Q-values for the cache's two actions, trained by mini-batch
+    SGD on the same (action, reward) updates the Q-table gets, with each
+    miss also counted as zero reward for caching. Samples
+    accumulate in preallocated arrays and are applied batch_size at a
+    time, so learning costs one small matrix product per batch. Safe to
+    share between the shards of a ShardedRLCache."""
+
+    def __init__(self, learning_rate=0.2, batch_size=32):
+        self.learning_rate = learning_rate
+        self.batch_size = int(batch_size)
+        self.weights = np.zeros((len(ACTIONS), N_FEATURES))
+        self.templates = {}
+        self.lock = threading.Lock()
+        self.batch_x = np.zeros((self.batch_size, N_FEATURES))
+        self.batch_action = np.zeros(self.batch_size, dtype=np.intp)
+        self.batch_reward = np.zeros(self.batch_size)
+        self.pending = 0
+        self.updates = 0
+
+    def _template_slot(self, key):
+        template = key[0] if type(key) is tuple and key else None
+        slot = self.templates.get(template)
+        if slot is not None:
+            return slot
+        # Shards call features() under their own locks, so claiming a new
+        # template's slot needs the learner's
+        with self.lock:
+            slot = self.templates.get(template)
+            if slot is None:
+                slot = min(len(self.templates), TEMPLATE_SLOTS - 1)
+                if len(self.templates) < TEMPLATE_SLOTS - 1:
+                    self.templates[template] = slot
+        return slot
+
+    def features(self, key, meta, epoch):
+        """Feature vector for key from its CacheEntry, at decay epoch
+        `epoch` (one epoch per request)."""
+        x = np.zeros(N_FEATURES)
+        x[self._template_slot(key)] = 1.0
+        base = TEMPLATE_SLOTS
+        x[base] = 1.0
+        x[base + 1] = math.log1p(meta.hits) / 4
+        x[base + 2] = math.log1p(max(epoch - meta.epoch, 0)) / 8
+        if meta.cost is None:
+            x[base + 4] = 1.0
+        else:
+            x[base + 3] = math.log1p(meta.cost) / 4
+        x[base + 5] = math.log1p(meta.size or 0) / 12
+        return x
+
+    def predict(self, x):
+        """(Q(cache), Q(evict)) for feature vector x."""
+        q_cache, q_evict = self.weights @ x
+        return float(q_cache), float(q_evict)
+
+    def observe(self, x, action, reward):
+        with self.lock:
+            self._record(x, ACTIONS.index(action), reward)
+            if action == 'evict':
+                # A miss is also a zero-reward sample for Q(cache): the cache
+                # had nothing for this key when it was asked for
+                self._record(x, 0, 0.0)
+
+    def _record(self, x, action, reward):
+        i = self.pending
+        self.batch_x[i] = x
+        self.batch_action[i] = action
+        self.batch_reward[i] = reward
+        self.pending += 1
+        if self.pending == self.batch_size:
+            self._train()
+
+    def _train(self):
+        # One gradient step on the squared error of each action's samples
+        for a in range(len(ACTIONS)):
+            mask = self.batch_action == a
+            n = np.count_nonzero(mask)
+            if n:
+                x = self.batch_x[mask]
+                error = self.batch_reward[mask] - x @ self.weights[a]
+                self.weights[a] += self.learning_rate * (error @ x) / n
+        self.pending = 0
+        self.updates += 1
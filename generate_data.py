@@ -1,82 +1,290 @@
-import csv
-import random
-from datetime import datetime, timedelta
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from functools import lru_cache
+from types import SimpleNamespace
+
+import numpy as np
+import psycopg2
+
+from db_executor import DB_CONFIG
 
 # === Configurable Parameters ===
+# Row counts at --scale 1; every table but seasons grows linearly with the
+# scale, so --scale 1000 loads 50M orders.
 TOTAL_USERS = 5000
 TOTAL_PRODUCTS = 1000
 TOTAL_ORDERS = 50000
 TOTAL_REVIEWS = 10000
+TOTAL_PROMOTIONS = 100
+
+CHUNK_ROWS = 250_000
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'psql_database_creation.txt')
 
-# === Generate CSV for Users ===
-with open('users.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['name', 'age', 'city', 'signup_date'])  # Header
-    for i in range(1, TOTAL_USERS + 1):
-        name = f'User_{i}'
-        age = random.randint(18, 60)
-        city = random.choice(['New York', 'London', 'Tokyo', 'Delhi', 'Berlin'])
-        signup_date = datetime(2020, 1, 1) + timedelta(days=random.randint(0, 1500))
-        writer.writerow([name, age, city, signup_date])
-
-# === Generate CSV for Products ===
-categories = ['Laptops', 'Mobiles', 'Tablets', 'Accessories', 'Desktops', 'Wearables']
-brands = ['Apple', 'Samsung', 'Dell', 'HP', 'Lenovo', 'Asus', 'Sony', 'Acer']
-with open('products.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['name', 'category', 'price', 'brand', 'rating'])  # Header
-    for i in range(1, TOTAL_PRODUCTS + 1):
-        name = f'Product_{i}'
-        category = random.choice(categories)
-        price = round(random.uniform(100, 2000), 2)
-        brand = random.choice(brands)
-        rating = round(random.uniform(2.5, 5.0), 2)
-        writer.writerow([name, category, price, brand, rating])
-
-# === Generate CSV for Seasons ===
-seasons = [
+CITIES = ['New York', 'London', 'Tokyo', 'Delhi', 'Berlin']
+CATEGORIES = ['Laptops', 'Mobiles', 'Tablets', 'Accessories', 'Desktops', 'Wearables']
+BRANDS = ['Apple', 'Samsung', 'Dell', 'HP', 'Lenovo', 'Asus', 'Sony', 'Acer']
+STATUSES = ['delivered', 'pending', 'cancelled']
+DISCOUNTS = [10, 15, 20, 25, 30]
+SEASONS = [
     ('College Start', '2024-07-01', '2024-09-01'),
     ('Holiday Sale', '2024-12-01', '2024-12-31'),
     ('Back to School', '2024-08-01', '2024-09-15'),
     ('Summer Sale', '2024-06-01', '2024-06-30'),
     ('New Year', '2025-01-01', '2025-01-10'),
 ]
-with open('seasons.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['name', 'start_date', 'end_date'])  # Header
-    for name, start, end in seasons:
-        writer.writerow([name, start, end])
-
-# === Generate CSV for Promotions ===
-with open('promotions.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['product_id', 'season_id', 'discount_percent'])  # Header
-    for _ in range(100):
-        product_id = random.randint(1, TOTAL_PRODUCTS)
-        season_id = random.randint(1, len(seasons))
-        discount = random.choice([10, 15, 20, 25, 30])
-        writer.writerow([product_id, season_id, discount])
-
-# === Generate CSV for Orders ===
-with open('orders.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['user_id', 'product_id', 'order_date', 'status', 'quantity'])  # Header
-    for i in range(TOTAL_ORDERS):
-        user_id = random.randint(1, TOTAL_USERS)
-        product_id = random.randint(1, TOTAL_PRODUCTS)
-        order_date = datetime(2022, 1, 1) + timedelta(days=random.randint(0, 900))
-        status = random.choice(['delivered', 'pending', 'cancelled'])
-        quantity = random.randint(1, 5)
-        writer.writerow([user_id, product_id, order_date, status, quantity])
-
-# === Generate CSV for Reviews ===
-with open('reviews.csv', 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['user_id', 'product_id', 'rating', 'review_date', 'text'])  # Header
-    for i in range(TOTAL_REVIEWS):
-        user_id = random.randint(1, TOTAL_USERS)
-        product_id = random.randint(1, TOTAL_PRODUCTS)  # Ensure this matches the range in products
-        rating = round(random.uniform(2.5, 5.0), 2)
-        review_date = datetime(2022, 1, 1) + timedelta(days=random.randint(0, 900))
-        text = f"Review {i} for product {product_id}"
-        writer.writerow([user_id, product_id, rating, review_date, text])
+SIGNUP_START, SIGNUP_DAYS = date(2020, 1, 1), 1501
+ORDER_START, ORDER_DAYS = date(2022, 1, 1), 901
+
+# Built once the data is in, for the filters and joins of the templates in
+# redis_rl_cache_simulation.queries
+INDEXES = [
+    # daily_sales_product, running_total_sales_product, users_also_bought (o1),
+    # reviewed_and_bought
+    'CREATE INDEX orders_product_date_idx ON orders (product_id, order_date) INCLUDE (quantity, user_id)',
+    # avg_order_value_user, users_also_bought (o2)
+    'CREATE INDEX orders_user_product_idx ON orders (user_id, product_id) INCLUDE (quantity)',
+    # orders_by_city_in_season
+    'CREATE INDEX orders_date_idx ON orders (order_date)',
+    'CREATE INDEX users_city_idx ON users (city)',
+    # reviewed_and_bought
+    'CREATE INDEX reviews_product_user_idx ON reviews (product_id, user_id)',
+    # top_rated_products_category
+    'CREATE INDEX products_category_rating_idx ON products (category, rating DESC)',
+    # products_on_promotion_season
+    'CREATE INDEX promotions_season_idx ON promotions (season_id, product_id)',
+    'CREATE INDEX seasons_name_idx ON seasons (name)',
+]
+
+# === Vectorized Row Generators ===
+#
+# Each generator builds one chunk of rows from its own RNG, seeded by
+# (seed, table, first id), so the data depends only on --seed, the sizes
+# and --chunk-rows, never on the number of processes or the order the
+# chunks finish in. Ids are written explicitly for the same reason.
+
+def _dates(start, days):
+    return np.array([(start + timedelta(days=d)).isoformat() for d in range(days)])
+
+_SIGNUP_DATES = _dates(SIGNUP_START, SIGNUP_DAYS)
+_ORDER_DATES = _dates(ORDER_START, ORDER_DAYS)
+
+@lru_cache(maxsize=None)
+def _zipf_table(n, s, seed, salt):
+    # Cumulative popularity by rank, and a seeded rank -> id shuffle so the
+    # hottest ids are spread over the range rather than being 1, 2, 3...
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    cumulative = np.cumsum(weights)
+    cumulative /= cumulative[-1]
+    return cumulative, np.random.default_rng([seed, salt]).permutation(n) + 1
+
+def _ids(rng, n, s, size, seed, salt):
+    """size ids in 1..n, uniform for s <= 0, otherwise Zipf(s) distributed."""
+    if s <= 0:
+        return rng.integers(1, n + 1, size)
+    cumulative, ids = _zipf_table(n, s, seed, salt)
+    return ids[np.minimum(np.searchsorted(cumulative, rng.random(size)), n - 1)]
+
+def _users(rng, ids, cfg):
+    n = len(ids)
+    return (ids, [f'User_{i}' for i in ids.tolist()], rng.integers(18, 61, n),
+            np.array(CITIES)[rng.integers(0, len(CITIES), n)],
+            _SIGNUP_DATES[rng.integers(0, SIGNUP_DAYS, n)])
+
+def _products(rng, ids, cfg):
+    n = len(ids)
+    return (ids, [f'Product_{i}' for i in ids.tolist()],
+            np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), n)],
+            np.round(rng.uniform(100, 2000, n), 2), np.array(BRANDS)[rng.integers(0, len(BRANDS), n)],
+            np.round(rng.uniform(2.5, 5.0, n), 2))
+
+def _seasons(rng, ids, cfg):
+    rows = [SEASONS[i - 1] for i in ids.tolist()]
+    return (ids,) + tuple(zip(*rows))
+
+def _promotions(rng, ids, cfg):
+    n = len(ids)
+    return (ids, rng.integers(1, cfg.products + 1, n), rng.integers(1, len(SEASONS) + 1, n),
+            np.array(DISCOUNTS)[rng.integers(0, len(DISCOUNTS), n)])
+
+def _orders(rng, ids, cfg):
+    n = len(ids)
+    return (ids, _ids(rng, cfg.users, cfg.user_zipf, n, cfg.seed, 0),
+            _ids(rng, cfg.products, cfg.product_zipf, n, cfg.seed, 1),
+            _ORDER_DATES[rng.integers(0, ORDER_DAYS, n)], np.array(STATUSES)[rng.integers(0, len(STATUSES), n)],
+            rng.integers(1, 6, n))
+
+def _reviews(rng, ids, cfg):
+    n = len(ids)
+    product_ids = _ids(rng, cfg.products, cfg.product_zipf, n, cfg.seed, 1)
+    return (ids, _ids(rng, cfg.users, cfg.user_zipf, n, cfg.seed, 0), product_ids,
+            np.round(rng.uniform(2.5, 5.0, n), 2), _ORDER_DATES[rng.integers(0, ORDER_DAYS, n)],
+            [f'Review {i - 1} for product {p}' for i, p in zip(ids.tolist(), product_ids.tolist())])
+
+# table -> (columns, generator, row count for a config), in load order
+TABLES = {
+    'users': (('id', 'name', 'age', 'city', 'signup_date'), _users, lambda cfg: cfg.users),
+    'products': (('id', 'name', 'category', 'price', 'brand', 'rating'), _products, lambda cfg: cfg.products),
+    'seasons': (('id', 'name', 'start_date', 'end_date'), _seasons, lambda cfg: len(SEASONS)),
+    'promotions': (('id', 'product_id', 'season_id', 'discount_percent'), _promotions, lambda cfg: cfg.promotions),
+    'orders': (('id', 'user_id', 'product_id', 'order_date', 'status', 'quantity'), _orders, lambda cfg: cfg.orders),
+    'reviews': (('id', 'user_id', 'product_id', 'rating', 'review_date', 'text'), _reviews, lambda cfg: cfg.reviews),
+}
+_TABLE_SALT = {table: 100 + i for i, table in enumerate(TABLES)}
+
+def generate_chunk(cfg, table, start, count, sep='\t'):
+    """Rows start..start+count-1 of table as delimited text (COPY's text
+    format for sep='\\t'). None of the generated values contain the
+    delimiter, a quote or a backslash, so no escaping is needed."""
+    columns, generator, _ = TABLES[table]
+    rng = np.random.default_rng([cfg.seed, _TABLE_SALT[table], start])
+    values = generator(rng, np.arange(start, start + count), cfg)
+    row = sep.join(['%s'] * len(columns)) + '\n'
+    # Formatting from Python lists is several times faster than numpy's
+    # string ufuncs
+    return ''.join(map(row.__mod__, zip(*(v.tolist() if isinstance(v, np.ndarray) else v for v in values)))).encode()
+
+def chunk_tasks(cfg, chunk_rows=CHUNK_ROWS):
+    tasks = []
+    for table, (_, _, rows) in TABLES.items():
+        for start in range(1, rows(cfg) + 1, chunk_rows):
+            tasks.append((table, start, min(chunk_rows, rows(cfg) - start + 1)))
+    return tasks
+
+# === Parallel COPY Loading ===
+
+_worker = SimpleNamespace(cfg=None, conn=None)
+
+def _init_worker(cfg, load):
+    _worker.cfg = cfg
+    if load:
+        _worker.conn = psycopg2.connect(**DB_CONFIG)
+
+def _copy_chunk(table, start, count):
+    # Each worker streams its chunks over its own connection, straight
+    # from memory
+    data = generate_chunk(_worker.cfg, table, start, count)
+    with _worker.conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(TABLES[table][0])}) FROM STDIN", io.BytesIO(data))
+    _worker.conn.commit()
+    return table, count
+
+def _csv_chunk(table, start, count):
+    return generate_chunk(_worker.cfg, table, start, count, sep=',')
+
+def _drop_foreign_keys(cur):
+    # Checking every row against users/products would dominate the load;
+    # the constraints are added back (and validated in one pass) afterwards
+    cur.execute("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE contype = 'f' AND conrelid::regclass::text = ANY(%s)
+    """, (list(TABLES),))
+    foreign_keys = cur.fetchall()
+    for table, name, _ in foreign_keys:
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+    return foreign_keys
+
+def _run_ddl(statement):
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(statement)
+    finally:
+        conn.close()
+
+def load(cfg, processes, chunk_rows=CHUNK_ROWS):
+    """Recreates the schema and loads every table with COPY FROM STDIN from
+    processes workers, then builds INDEXES, restores the foreign keys and
+    runs ANALYZE."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn, conn.cursor() as cur:
+            with open(SCHEMA_FILE) as f:
+                cur.execute(f.read())
+            foreign_keys = _drop_foreign_keys(cur)
+        started = time.perf_counter()
+        loaded = dict.fromkeys(TABLES, 0)
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(cfg, True)) as pool:
+            futures = [pool.submit(_copy_chunk, *task) for task in chunk_tasks(cfg, chunk_rows)]
+            for future in as_completed(futures):
+                table, count = future.result()
+                loaded[table] += count
+                total = sum(loaded.values())
+                print(f"\r{total:,} rows ({total / (time.perf_counter() - started):,.0f}/s)", end='', flush=True)
+        print(f"\nloaded {', '.join(f'{t} {n:,}' for t, n in loaded.items())} "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        with conn, conn.cursor() as cur:
+            for table in TABLES:
+                cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), {loaded[table] or 1}, "
+                            f"{bool(loaded[table])})")
+        # Index builds run side by side, one connection each; the foreign
+        # keys follow, since their validation locks would queue behind them
+        with ThreadPoolExecutor(processes) as pool:
+            list(pool.map(_run_ddl, INDEXES))
+            list(pool.map(_run_ddl, [f'ALTER TABLE {t} ADD CONSTRAINT {n} {d}' for t, n, d in foreign_keys]))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute('ANALYZE')
+        print(f"built {len(INDEXES)} indexes and {len(foreign_keys)} foreign keys "
+              f"in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+def write_csv(cfg, directory, processes, chunk_rows=CHUNK_ROWS):
+    # The manual-import path: one <table>.csv per table with a header row
+    os.makedirs(directory, exist_ok=True)
+    tasks = chunk_tasks(cfg, chunk_rows)
+    files = {}
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(cfg, False)) as pool:
+        # A few chunks in flight per worker keeps memory flat at any scale
+        window = 2 * processes
+        for i in range(0, len(tasks), window):
+            batch = tasks[i:i + window]
+            for (table, _, _), data in zip(batch, pool.map(_csv_chunk, *zip(*batch))):
+                if table not in files:
+                    files[table] = open(os.path.join(directory, f'{table}.csv'), 'wb')
+                    files[table].write((','.join(TABLES[table][0]) + '\n').encode())
+                files[table].write(data)
+    for f in files.values():
+        f.close()
+    print(f"wrote {', '.join(f'{t}.csv' for t in files)} to {directory}")
+
+# === CLI ===
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the e-commerce dataset and bulk-load it into Postgres')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help=f'row-count multiplier (1 = {TOTAL_ORDERS:,} orders, 1000 = {TOTAL_ORDERS * 1000:,})')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--product-zipf', type=float, default=0.0,
+                        help='Zipf exponent of product popularity in orders and reviews (0 = uniform)')
+    parser.add_argument('--user-zipf', type=float, default=0.0,
+                        help='Zipf exponent of user activity in orders and reviews (0 = uniform)')
+    for table, base in (('users', TOTAL_USERS), ('products', TOTAL_PRODUCTS), ('orders', TOTAL_ORDERS),
+                        ('reviews', TOTAL_REVIEWS), ('promotions', TOTAL_PROMOTIONS)):
+        parser.add_argument(f'--{table}', type=int, help=f'override the {table} row count ({base:,} x scale)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--csv', metavar='DIR', help='write CSV files to DIR instead of loading the database')
+    args = parser.parse_args()
+
+    cfg = SimpleNamespace(
+        seed=args.seed, product_zipf=args.product_zipf, user_zipf=args.user_zipf,
+        users=args.users or max(1, round(TOTAL_USERS * args.scale)),
+        products=args.products or max(1, round(TOTAL_PRODUCTS * args.scale)),
+        orders=args.orders if args.orders is not None else round(TOTAL_ORDERS * args.scale),
+        reviews=args.reviews if args.reviews is not None else round(TOTAL_REVIEWS * args.scale),
+        promotions=args.promotions if args.promotions is not None else round(TOTAL_PROMOTIONS * args.scale),
+    )
+    if args.csv:
+        write_csv(cfg, args.csv, args.processes, args.chunk_rows)
+    else:
+        load(cfg, args.processes, args.chunk_rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import json
+import re
+import select
+import threading
+
+import psycopg2
+
+from db_executor import DB_CONFIG
+
+# === Query -> Table Dependencies ===
+#
+# A template's dependencies map each table it reads to how its cached
+# entries can be narrowed when that table changes:
+#   (column, param_index)  every reference to the table is filtered by
+#                          column = the param_index-th parameter, so a write
+#                          only affects entries whose parameter equals the
+#                          written row's column value
+#   None                   any write to the table may change every entry
+#
+# e.g. daily_sales_product -> {'orders': ('product_id', 0)}
+
+INVALIDATION_CHANNEL = 'rlcache_invalidate'
+
+_SQL_KEYWORDS = {'where', 'join', 'on', 'group', 'order', 'limit', 'inner', 'left', 'right', 'full', 'cross',
+                 'union', 'having'}
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_PARAM_FILTER = re.compile(r'(?:(\w+)\.)?(\w+)\s*=\s*%s', re.IGNORECASE)
+
+def derive_dependencies(q_text):
+    """Tables (and parameter columns) a template reads, from its SQL. Only
+    `[alias.]column = %s` filters narrow a table; a table referenced more
+    than once (self-joins) narrows only if every reference is filtered by
+    the same parameter, so the result errs towards invalidating more."""
+    refs = []  # (table, alias, position)
+    for m in _TABLE_REF.finditer(q_text):
+        table, alias = m.group(1).lower(), m.group(2)
+        if alias is None or alias.lower() in _SQL_KEYWORDS:
+            alias = table
+        refs.append((table, alias.lower(), m.start()))
+    keyed = {}  # ref index -> (column, param_index)
+    for m in _PARAM_FILTER.finditer(q_text):
+        param_index = q_text.count('%s', 0, m.end() - 2)
+        qualifier = m.group(1)
+        candidates = [i for i, (_, alias, pos) in enumerate(refs)
+                      if pos < m.start() and (qualifier is None or alias == qualifier.lower())]
+        if candidates:
+            keyed[candidates[-1]] = (m.group(2).lower(), param_index)
+    dependencies = {}
+    for table in dict.fromkeys(table for table, _, _ in refs):
+        narrowing = {keyed.get(i) for i, ref in enumerate(refs) if ref[0] == table}
+        dependencies[table] = narrowing.pop() if len(narrowing) == 1 else None
+    return dependencies
+
+def keyed_columns(table, dependencies):
+    return sorted({keyed[0] for deps in dependencies.values()
+                   for t, keyed in deps.items() if t == table and keyed is not None})
+
+# === Invalidation Tags ===
+#
+# Every cached entry carries tags derived from its key; a write to a table
+# maps to the tags it must drop:
+#   'orders.*'             every entry that reads orders at all
+#   'orders'               entries that read orders without a narrowing filter
+#   'orders.product_id=5'  entries filtered on orders.product_id = 5
+
+def entry_tags(key, dependencies):
+    deps = dependencies.get(key[0]) if type(key) is tuple and key else None
+    if not deps:
+        return ()
+    tags = []
+    for table, keyed in deps.items():
+        tags.append(f'{table}.*')
+        if keyed is None:
+            tags.append(table)
+        else:
+            column, index = keyed
+            tags.append(f'{table}.{column}={key[1 + index]!r}')
+    return tags
+
+def write_tags(table, row, dependencies):
+    """Tags to drop for a write to table. row maps column names to the
+    written row's values (pass both old and new rows for an UPDATE that
+    changes a filtered column); without the filtered columns every entry
+    that reads the table is dropped."""
+    columns = keyed_columns(table, dependencies)
+    if row is None or any(column not in row for column in columns):
+        return [f'{table}.*']
+    return [table] + [f'{table}.{column}={row[column]!r}' for column in columns]
+
+# === Postgres LISTEN/NOTIFY ===
+
+def trigger_sql(table, dependencies, channel=INVALIDATION_CHANNEL):
+    """DDL for a trigger that NOTIFYs channel on every write to table. The
+    payload only carries the columns the cache filters on, which keeps it
+    far below NOTIFY's 8000-byte limit; TRUNCATE sends a null row."""
+    def row(record):
+        fields = ', '.join(f"'{column}', {record}.{column}" for column in keyed_columns(table, dependencies))
+        return f"json_build_object({fields})"
+    function = f'{channel}_{table}'
+    return f"""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                PERFORM pg_notify('{channel}', json_build_object('table', '{table}', 'row', NULL)::text);
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify('{channel}', json_build_object('table', '{table}', 'row', {row('OLD')})::text);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('{channel}', json_build_object('table', '{table}', 'row', {row('NEW')})::text);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS {function} ON {table};
+        CREATE TRIGGER {function} AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {function}();
+        DROP TRIGGER IF EXISTS {function}_truncate ON {table};
+        CREATE TRIGGER {function}_truncate AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+    """
+
+def install_triggers(dependencies, channel=INVALIDATION_CHANNEL, **db_config):
+    tables = dict.fromkeys(table for deps in dependencies.values() for table in deps)
+    conn = psycopg2.connect(**(db_config or DB_CONFIG))
+    try:
+        with conn, conn.cursor() as cur:
+            for table in tables:
+                cur.execute(trigger_sql(table, dependencies, channel))
+    finally:
+        conn.close()
+    return list(tables)
+
+class InvalidationListener:
+    """Background thread that LISTENs on channel and forwards each
+    notification to cache.invalidate(table, row). Every process runs its
+    own listener, since each one holds its own memory tier."""
+
+    def __init__(self, cache, channel=INVALIDATION_CHANNEL, poll_interval=1.0, **db_config):
+        self.cache = cache
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.conn = psycopg2.connect(**(db_config or DB_CONFIG))
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute(f'LISTEN {channel}')
+        self.received = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            if select.select([self.conn], [], [], self.poll_interval) == ([], [], []):
+                continue
+            self.conn.poll()
+            while self.conn.notifies:
+                notify = self.conn.notifies.pop(0)
+                message = json.loads(notify.payload)
+                self.cache.invalidate(message['table'], message['row'])
+                self.received += 1
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.conn.close()
@@ -0,0 +1,173 @@
+import argparse
+import multiprocessing
+import threading
+import time
+from collections import Counter
+
+import redis
+
+import redis_rl_cache_simulation as sim
+from db_executor import DB_POOL_MAX
+
+# === DB Stand-in ===
+
+class StubExecutor:
+    """Deterministic stand-in for QueryExecutor: sleeps latency_ms per call
+    (per-template overrides in template_latency_ms) and returns one row
+    echoing the request, so cache behaviour can be load-tested without
+    Postgres."""
+
+    def __init__(self, latency_ms=5.0, template_latency_ms=None, rows=1):
+        self.latency_ms = latency_ms
+        self.template_latency_ms = template_latency_ms or {}
+        self.rows = rows
+        self.calls = 0
+
+    def execute(self, q_name, params):
+        self.calls += 1
+        latency = self.template_latency_ms.get(q_name, self.latency_ms)
+        if latency:
+            time.sleep(latency / 1000)
+        return [(q_name, i) + tuple(params) for i in range(self.rows)]
+
+    def close(self):
+        pass
+
+# === Latency Summaries ===
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+def summarize(latencies_ms, wall_seconds):
+    ordered = sorted(latencies_ms)
+    return {
+        'requests': len(ordered),
+        'per_sec': len(ordered) / wall_seconds if wall_seconds else 0.0,
+        'mean_ms': sum(ordered) / len(ordered) if ordered else 0.0,
+        'p50_ms': percentile(ordered, 50),
+        'p95_ms': percentile(ordered, 95),
+        'p99_ms': percentile(ordered, 99),
+        'max_ms': ordered[-1] if ordered else 0.0,
+    }
+
+# === Workers ===
+
+def _worker_loop(cache, executor, requests, start_barrier=None):
+    latencies = []
+    levels = Counter()
+    if start_barrier is not None:
+        start_barrier.wait()
+    for _ in range(requests):
+        q, param = sim.synthetic_query_distribution()
+        t = time.perf_counter()
+        _, level = sim.serve_query(cache, executor, q[0], param)
+        latencies.append((time.perf_counter() - t) * 1000)
+        levels[level] += 1
+    return latencies, levels
+
+def run_threads(cache, executor, workers, requests_per_worker):
+    """N threads sharing one cache and one executor."""
+    barrier = threading.Barrier(workers + 1)
+    outputs = [None] * workers
+
+    def work(i):
+        outputs[i] = _worker_loop(cache, executor, requests_per_worker, barrier)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return outputs, time.perf_counter() - start
+
+def _process_worker(args):
+    # Each process builds its own memory tier; Redis is the shared tier.
+    config, requests = args
+    cache, executor = build(**config)
+    try:
+        latencies, levels = _worker_loop(cache, executor, requests)
+        return latencies, levels, cache.coalescing_stats()
+    finally:
+        cache.close()
+        executor.close()
+
+def run_processes(config, workers, requests_per_worker):
+    """N processes, each with its own cache instance over the shared Redis."""
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers) as pool:
+        start = time.perf_counter()
+        outputs = pool.map(_process_worker, [(config, requests_per_worker)] * workers)
+        return outputs, time.perf_counter() - start
+
+def build(shards=16, db='stub', latency_ms=5.0, write_behind=True, redis_url='redis://localhost:6379/0',
+          maxconn=DB_POOL_MAX, lease_coalescing=False):
+    client = redis.StrictRedis.from_url(redis_url)
+    if shards > 1:
+        cache = sim.ShardedRLCache(sim.MEMORY_CACHE_SIZE, sim.REDIS_CACHE_SIZE, client, shards=shards,
+                                   write_behind=write_behind, mem_budget_bytes=sim.MEMORY_CACHE_BYTES,
+                                   redis_budget_bytes=sim.REDIS_CACHE_BYTES, eviction_policy=sim.EVICTION_POLICY,
+                                   lease_coalescing=lease_coalescing)
+    else:
+        cache = sim.MultiLevelRLCache(sim.MEMORY_CACHE_SIZE, sim.REDIS_CACHE_SIZE, client,
+                                      write_behind=write_behind, mem_budget_bytes=sim.MEMORY_CACHE_BYTES,
+                                      redis_budget_bytes=sim.REDIS_CACHE_BYTES, eviction_policy=sim.EVICTION_POLICY,
+                                      lease_coalescing=lease_coalescing)
+    if db == 'stub':
+        executor = StubExecutor(latency_ms)
+    else:
+        executor = sim.QueryExecutor(sim.queries, maxconn=maxconn)
+    return cache, executor
+
+def run_load(workers, requests_per_worker, mode='thread', **config):
+    """Drive `workers` concurrent clients and return throughput, tail
+    latency and the hit-level mix."""
+    # Every level starts from a cold Redis tier
+    cache, executor = build(**config)
+    for shard in getattr(cache, 'shards', [cache]):
+        shard.redis_tier.clear()
+    if mode == 'thread':
+        try:
+            outputs, wall = run_threads(cache, executor, workers, requests_per_worker)
+            coalescing = [cache.coalescing_stats()]
+        finally:
+            cache.close()
+            executor.close()
+    else:
+        cache.close()
+        executor.close()
+        outputs, wall = run_processes(config, workers, requests_per_worker)
+        coalescing = [stats for _, _, stats in outputs]
+    latencies = [ms for output in outputs for ms in output[0]]
+    levels = sum((output[1] for output in outputs), Counter())
+    summary = summarize(latencies, wall)
+    summary['workers'] = workers
+    summary['levels'] = dict(levels)
+    summary['db_calls_saved'] = sum(stats['db_calls_saved'] for stats in coalescing)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load driver for the RL cache')
+    parser.add_argument('--workers', default='1,2,4,8,16,32,64', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per worker')
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--shards', type=int, default=16, help='lock stripes (1 = single MultiLevelRLCache)')
+    parser.add_argument('--db', choices=['stub', 'postgres'], default='stub')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='stub DB latency per miss')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--lease', action='store_true', help='coalesce misses across processes via Redis leases')
+    args = parser.parse_args()
+    config = dict(shards=args.shards, db=args.db, latency_ms=args.latency_ms, redis_url=args.redis_url,
+                  lease_coalescing=args.lease)
+    print(f"--- {args.mode} workers, {args.requests} requests each, {args.shards} shard(s), {args.db} DB ---")
+    for workers in (int(w) for w in args.workers.split(',')):
+        r = run_load(workers, args.requests, args.mode, **config)
+        print(f"  {workers:>4} workers: {r['per_sec']:>9.0f} req/s  p50 {r['p50_ms']:.2f} ms"
+              f"  p95 {r['p95_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms  max {r['max_ms']:.2f} ms  {r['levels']}"
+              f"  saved {r['db_calls_saved']} DB calls")
+
+if __name__ == '__main__':
+    main()
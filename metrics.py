@@ -0,0 +1,198 @@
+import math
+import threading
+from array import array
+
+# === Log-Bucketed Latency Histograms ===
+#
+# HDR-style layout over integer microseconds: values below 2**SUB_BITS get
+# one bucket each, and every power of two above that is split into
+# 2**SUB_BITS linear sub-buckets. Any recorded value is reproduced within
+# 1 / 2**SUB_BITS (about 3%), and memory is fixed no matter how many values
+# are recorded.
+
+SUB_BITS = 5
+MAX_VALUE_BITS = 36  # 2**36 us, about 19 hours; larger values land in the last bucket
+_SUB = 1 << SUB_BITS
+_BUCKETS = (MAX_VALUE_BITS - SUB_BITS + 1) * _SUB
+
+def _bucket(value_us):
+    if value_us < _SUB:
+        return value_us
+    e = value_us.bit_length() - SUB_BITS
+    return min(e * _SUB + (value_us >> (e - 1)) - _SUB, _BUCKETS - 1)
+
+def _bucket_value(index):
+    # Midpoint of the values that share the bucket
+    if index < _SUB:
+        return float(index)
+    e, m = divmod(index, _SUB)
+    width = 1 << (e - 1)
+    return ((m + _SUB) << (e - 1)) + (width - 1) / 2
+
+class LatencyHistogram:
+    """Fixed-memory latency distribution, recorded in milliseconds."""
+
+    __slots__ = ('counts', 'count', 'total_ms', 'min_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * _BUCKETS))
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = math.inf
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.counts[_bucket(max(0, int(ms * 1000)))] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms < self.min_ms:
+            self.min_ms = ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def merge(self, other):
+        for index, n in enumerate(other.counts):
+            if n:
+                self.counts[index] += n
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                # Exact extremes beat bucket midpoints at the edges
+                return min(max(_bucket_value(index) / 1000, self.min_ms), self.max_ms)
+        return self.max_ms
+
+    def percentiles(self, pcts=(50, 90, 99, 99.9)):
+        return {pct: self.percentile(pct) for pct in pcts}
+
+# === Simulation Metrics ===
+
+TIERS = ('memory', 'redis', 'derived', 'db', 'coalesced')
+QUANTILES = (50, 90, 99, 99.9)
+
+class SimulationMetrics:
+    """Latency histograms per query template and per tier for one
+    simulation run, plus the attached cache's counters. render() turns any
+    number of these into one Prometheus text exposition."""
+
+    def __init__(self, run):
+        self.run = run
+        self.lock = threading.Lock()
+        self.templates = {}
+        self.tiers = {tier: LatencyHistogram() for tier in TIERS}
+        self.cache = None
+
+    def attach(self, cache):
+        self.cache = cache
+
+    def record(self, q_name, tier, ms):
+        with self.lock:
+            histogram = self.templates.get(q_name)
+            if histogram is None:
+                histogram = self.templates[q_name] = LatencyHistogram()
+            histogram.record(ms)
+            self.tiers[tier].record(ms)
+
+    def requests(self):
+        return sum(h.count for h in self.tiers.values())
+
+    def samples(self):
+        """(family, labels, value) for every sample of this run."""
+        run = {'run': self.run}
+        with self.lock:
+            for family, label, histograms in (('rlcache_query_latency_ms', 'template', self.templates),
+                                              ('rlcache_tier_latency_ms', 'tier', self.tiers)):
+                for value, h in histograms.items():
+                    labels = dict(run, **{label: value})
+                    for pct, ms in h.percentiles(QUANTILES).items():
+                        yield family, dict(labels, quantile=f'{pct / 100:g}'), ms
+                    yield family + '_sum', labels, h.total_ms
+                    yield family + '_count', labels, h.count
+            total = self.requests()
+            for tier, h in self.tiers.items():
+                yield 'rlcache_hit_ratio', dict(run, tier=tier), h.count / total if total else 0.0
+        if self.cache is None:
+            return
+        stats = cache_stats(self.cache)
+        for tier in ('memory', 'redis'):
+            yield 'rlcache_evictions_total', dict(run, tier=tier), stats[f'{tier}_evictions']
+            yield 'rlcache_admission_rejections_total', dict(run, tier=tier), stats[f'{tier}_rejections']
+        for family, name in (('rlcache_memory_tier_entries', 'memory_entries'),
+                             ('rlcache_memory_tier_bytes', 'memory_bytes'),
+                             ('rlcache_q_table_entries', 'q_table_entries'),
+                             ('rlcache_db_calls_saved_total', 'db_calls_saved'),
+                             ('rlcache_invalidated_entries_total', 'invalidated_entries'),
+                             ('rlcache_stale_misses_total', 'stale_misses'),
+                             ('rlcache_refreshes_total', 'refreshes')):
+            yield family, run, stats[name]
+
+FAMILIES = {
+    'rlcache_query_latency_ms': ('summary', 'Request latency by query template.'),
+    'rlcache_tier_latency_ms': ('summary', 'Request latency by the tier that served it.'),
+    'rlcache_hit_ratio': ('gauge', 'Fraction of requests served by each tier.'),
+    'rlcache_evictions_total': ('counter', 'Entries evicted per tier.'),
+    'rlcache_admission_rejections_total': ('counter', 'New entries turned away by admission control.'),
+    'rlcache_memory_tier_entries': ('gauge', 'Entries resident in the memory tier.'),
+    'rlcache_memory_tier_bytes': ('gauge', 'Encoded bytes resident in the memory tier.'),
+    'rlcache_q_table_entries': ('gauge', 'Keys with policy state (resident plus ghost records).'),
+    'rlcache_db_calls_saved_total': ('counter', "Misses answered by another caller's in-flight query."),
+    'rlcache_invalidated_entries_total': ('counter', 'Entries dropped by write invalidation.'),
+    'rlcache_stale_misses_total': ('counter', 'Lookups that missed because the entry outlived its staleness bound.'),
+    'rlcache_refreshes_total': ('counter', 'Entries recomputed ahead of their staleness bound.'),
+}
+
+def _family(sample_name):
+    for suffix in ('_sum', '_count'):
+        if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in FAMILIES:
+            return sample_name[:-len(suffix)]
+    return sample_name
+
+def render(*runs):
+    """Prometheus text exposition for the given SimulationMetrics."""
+    grouped = {}
+    for run in runs:
+        for name, labels, value in run.samples():
+            grouped.setdefault(_family(name), []).append((name, labels, value))
+    lines = []
+    for family, samples in grouped.items():
+        kind, help_text = FAMILIES[family]
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for name, labels, value in samples:
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value:.6g}' if isinstance(value, float)
+                         else f'{name}{{{label_text}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+def cache_stats(cache):
+    # Sums over shards for ShardedRLCache
+    totals = {}
+    for shard in getattr(cache, 'shards', [cache]):
+        for name, value in (
+            ('memory_evictions', shard.memory_evictions),
+            ('memory_rejections', shard.memory_rejections),
+            ('redis_evictions', shard.redis_tier.evictions),
+            ('redis_rejections', shard.redis_tier.rejections),
+            ('memory_entries', len(shard.memory_cache)),
+            ('memory_bytes', shard.memory_bytes),
+            ('q_table_entries', len(shard.entries) + len(shard.ghosts)),
+            ('db_calls_saved', shard.coalescing_stats()['db_calls_saved']),
+            ('invalidated_entries', shard.invalidated_entries),
+            ('stale_misses', shard.stale_misses),
+            ('refreshes', shard.refreshes),
+        ):
+            totals[name] = totals.get(name, 0) + value
+    return totals
@@ -0,0 +1,544 @@
+import argparse
+import itertools
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import redis_rl_cache_simulation as sim
+from feature_learner import LinearQLearner
+from redis_rl_cache_simulation import IndexedMinHeap, MultiLevelRLCache
+from workload import SkewedWorkload, read_trace
+
+# === Cost Model ===
+# Rough per-template DB time and encoded result size on the generated
+# dataset, for traces that only carry (q_name, params). Pass measured
+# numbers to compile_trace where they are available.
+TEMPLATE_COST_MS = {
+    "daily_sales_product": 2.0,
+    "avg_order_value_user": 3.0,
+    "users_also_bought": 15.0,
+    "running_total_sales_product": 2.5,
+    "top_rated_products_category": 1.5,
+    "reviewed_and_bought": 6.0,
+    "products_on_promotion_season": 4.0,
+    "orders_by_city_in_season": 40.0,
+}
+TEMPLATE_SIZE_BYTES = {
+    "daily_sales_product": 400,
+    "avg_order_value_user": 60,
+    "users_also_bought": 60,
+    "running_total_sales_product": 400,
+    "top_rated_products_category": 150,
+    "reviewed_and_bought": 250,
+    "products_on_promotion_season": 60_000,
+    "orders_by_city_in_season": 120_000,
+}
+MEMORY_HIT_MS = 0.005
+REDIS_HIT_MS = 0.3
+
+LEVEL_DB, LEVEL_MEMORY, LEVEL_REDIS = 0, 1, 2
+
+class Trace:
+    """A request trace as dense key ids plus per-key cost and size arrays."""
+
+    def __init__(self, ids, cost_ms, size_bytes, keys):
+        self.ids = ids
+        self.cost_ms = cost_ms
+        self.size_bytes = size_bytes
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.ids)
+
+def compile_trace(workload, cost_ms=None, size_bytes=None):
+    """Interns a (q_name, params) workload into a Trace. cost_ms and
+    size_bytes map a key to its DB time and result size; by default both
+    come from the per-template tables above."""
+    index = {}
+    ids = []
+    for q_name, params in workload:
+        key = (q_name,) + tuple(params)
+        ids.append(index.setdefault(key, len(index)))
+    keys = list(index)
+    cost_ms = cost_ms or (lambda key: TEMPLATE_COST_MS.get(key[0], 1.0))
+    size_bytes = size_bytes or (lambda key: TEMPLATE_SIZE_BYTES.get(key[0], 256))
+    return Trace(np.array(ids, dtype=np.int32),
+                 np.array([cost_ms(key) for key in keys], dtype=np.float64),
+                 np.array([max(1, size_bytes(key)) for key in keys], dtype=np.int64),
+                 keys)
+
+# === Baseline Policies ===
+# Each policy's access(key) returns whether key was resident and, on a
+# miss, admits it (subject to the policy's own admission rules).
+
+class LRU:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def access(self, key):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            return True
+        if self.capacity > 0:
+            entries[key] = None
+            if len(entries) > self.capacity:
+                entries.popitem(last=False)
+        return False
+
+class LFU:
+    """O(1) LFU: one insertion-ordered bucket per frequency, ties evicted
+    least recently used first."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.buckets = {}
+        self.min_count = 0
+
+    def access(self, key):
+        counts, buckets = self.counts, self.buckets
+        count = counts.get(key)
+        if count is not None:
+            bucket = buckets[count]
+            del bucket[key]
+            if not bucket:
+                del buckets[count]
+                if self.min_count == count:
+                    self.min_count = count + 1
+            counts[key] = count + 1
+            buckets.setdefault(count + 1, OrderedDict())[key] = None
+            return True
+        if self.capacity <= 0:
+            return False
+        if len(counts) >= self.capacity:
+            bucket = buckets[self.min_count]
+            victim, _ = bucket.popitem(last=False)
+            if not bucket:
+                del buckets[self.min_count]
+            del counts[victim]
+        counts[key] = 1
+        buckets.setdefault(1, OrderedDict())[key] = None
+        self.min_count = 1
+        return False
+
+class ARC:
+    """Adaptive Replacement Cache (Megiddo & Modha): recency list t1 and
+    frequency list t2, with ghost lists b1/b2 steering the target size p."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.p = 0
+        self.t1, self.t2 = OrderedDict(), OrderedDict()
+        self.b1, self.b2 = OrderedDict(), OrderedDict()
+
+    def _replace(self, in_b2):
+        t1 = self.t1
+        if t1 and (len(t1) > self.p or (in_b2 and len(t1) == self.p) or not self.t2):
+            old, _ = t1.popitem(last=False)
+            self.b1[old] = None
+        else:
+            old, _ = self.t2.popitem(last=False)
+            self.b2[old] = None
+
+    def access(self, key):
+        c = self.capacity
+        t1, t2, b1, b2 = self.t1, self.t2, self.b1, self.b2
+        if key in t1:
+            del t1[key]
+            t2[key] = None
+            return True
+        if key in t2:
+            t2.move_to_end(key)
+            return True
+        if c <= 0:
+            return False
+        if key in b1:
+            self.p = min(c, self.p + max(len(b2) // len(b1), 1))
+            self._replace(False)
+            del b1[key]
+            t2[key] = None
+            return False
+        if key in b2:
+            self.p = max(0, self.p - max(len(b1) // len(b2), 1))
+            self._replace(True)
+            del b2[key]
+            t2[key] = None
+            return False
+        l1 = len(t1) + len(b1)
+        if l1 == c:
+            if len(t1) < c:
+                b1.popitem(last=False)
+                self._replace(False)
+            else:
+                t1.popitem(last=False)
+        elif l1 < c:
+            total = l1 + len(t2) + len(b2)
+            if total >= c:
+                if total == 2 * c:
+                    b2.popitem(last=False)
+                self._replace(False)
+        t1[key] = None
+        return False
+
+class CountMinSketch:
+    """4-row count-min sketch of 4-bit counters, halved every sample_size
+    increments so old popularity fades (the TinyLFU "reset"). Rows are
+    indexed by double hashing one 64-bit mix of the key."""
+
+    _HALVE = bytes(v >> 1 for v in range(256))
+
+    def __init__(self, capacity):
+        width = 1 << max(4, (4 * max(capacity, 1) - 1).bit_length())
+        self.mask = width - 1
+        self.table = [bytearray(width) for _ in range(4)]
+        self.sample_size = 10 * max(capacity, 1)
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h ^= h >> 29
+        h1, h2, mask = h & 0xFFFFFFFF, (h >> 32) | 1, self.mask
+        return h1 & mask, (h1 + h2) & mask, (h1 + 2 * h2) & mask, (h1 + 3 * h2) & mask
+
+    def increment(self, key):
+        for row, i in zip(self.table, self._indexes(key)):
+            if row[i] < 15:
+                row[i] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.additions //= 2
+            for row in self.table:
+                row[:] = row.translate(self._HALVE)
+
+    def estimate(self, key):
+        a, b, c, d = self._indexes(key)
+        t = self.table
+        return min(t[0][a], t[1][b], t[2][c], t[3][d])
+
+class TinyLFU:
+    """W-TinyLFU: a 1% LRU window in front of a segmented-LRU main cache
+    (80% protected); a key leaving the window only enters the main cache if
+    the sketch says it is more popular than the main cache's next victim."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.window_capacity = max(1, capacity // 100) if capacity > 0 else 0
+        self.main_capacity = capacity - self.window_capacity
+        self.protected_capacity = int(self.main_capacity * 0.8)
+        self.window, self.probation, self.protected = OrderedDict(), OrderedDict(), OrderedDict()
+        self.sketch = CountMinSketch(capacity)
+
+    def access(self, key):
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+            return True
+        if key in self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_capacity:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+            return True
+        if key in self.protected:
+            self.protected.move_to_end(key)
+            return True
+        if self.capacity <= 0:
+            return False
+        self.window[key] = None
+        if len(self.window) > self.window_capacity:
+            candidate, _ = self.window.popitem(last=False)
+            if len(self.probation) + len(self.protected) < self.main_capacity:
+                self.probation[candidate] = None
+            elif self.main_capacity > 0:
+                segment = self.probation if self.probation else self.protected
+                victim = next(iter(segment))
+                if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+                    del segment[victim]
+                    self.probation[candidate] = None
+        return False
+
+POLICIES = {'lru': LRU, 'lfu': LFU, 'arc': ARC, 'tinylfu': TinyLFU}
+
+class TwoTier:
+    """Memory tier in front of a Redis tier, both run by one baseline
+    policy; the Redis tier sees the memory tier's misses, and a miss in
+    both is admitted to both, as MultiLevelRLCache does."""
+
+    def __init__(self, policy, mem_capacity, redis_capacity):
+        self.memory = POLICIES[policy](mem_capacity)
+        self.redis = POLICIES[policy](redis_capacity)
+
+    def access(self, key):
+        if self.memory.access(key):
+            return LEVEL_MEMORY
+        if self.redis.access(key):
+            return LEVEL_REDIS
+        return LEVEL_DB
+
+# === RL Policy Offline ===
+
+class _Sized:
+    __slots__ = ('size',)
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+class SizeCodec:
+    """Stands in for a result codec: values are result sizes, and a
+    "payload" only needs a length."""
+    name = 'size'
+
+    def encode(self, value):
+        return _Sized(value)
+
+    def decode(self, payload):
+        return payload.size
+
+class LocalTier:
+    """In-process replacement for RedisTier with the same eviction rules
+    (lowest score first, optional byte budget and admission check), so
+    MultiLevelRLCache's own policy code runs offline at memory speed.
+    expiry(key), as for RedisTier, bounds how long a value may be served."""
+
+    def __init__(self, capacity, budget_bytes=None, admission=False, expiry=None):
+        self.capacity = capacity
+        self.budget_bytes = budget_bytes
+        self.admission = admission
+        self.expiry = expiry
+        self.values = {}
+        self.sizes = {}
+        self.deadlines = {}
+        self.heap = IndexedMinHeap()
+        self.bytes = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.inflation = 0.0
+
+    def get(self, key):
+        deadline = self.deadlines.get(key)
+        if deadline is not None and time.time() >= deadline:
+            self.delete(key)
+        return self.values.get(key)
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def ttl_ms(self, key):
+        deadline = self.deadlines.get(key)
+        if deadline is None or key not in self.values:
+            return None
+        return max(int((deadline - time.time()) * 1000), 0)
+
+    def put(self, key, payload, score):
+        if self.capacity <= 0:
+            return False
+        size, budget, heap = len(payload), self.budget_bytes, self.heap
+        if budget is not None and size > budget:
+            self.rejections += 1
+            return False
+        resident = key in self.values
+        count = len(self.values) + (0 if resident else 1)
+        total = self.bytes - self.sizes.get(key, 0) + size
+        over = count > self.capacity or (budget is not None and total > budget)
+        if over and self.admission and not resident and heap and heap.priority[heap.peek()] > score:
+            self.rejections += 1
+            return False
+        if resident:
+            heap.remove(key)
+        while heap and (count > self.capacity or (budget is not None and total > budget)):
+            victim = heap.peek()
+            self.inflation = heap.priority[victim]
+            heap.pop()
+            total -= self.sizes.pop(victim)
+            del self.values[victim]
+            self.deadlines.pop(victim, None)
+            count -= 1
+            self.evictions += 1
+        self.values[key] = payload
+        self.sizes[key] = size
+        self.bytes = total
+        heap.push(key, score)
+        ttl = self.expiry(key) if self.expiry is not None else None
+        if ttl is None:
+            self.deadlines.pop(key, None)
+        else:
+            self.deadlines[key] = time.time() + ttl
+        return True
+
+    def update_score(self, key, score):
+        if key in self.heap:
+            self.heap.update(key, score)
+
+    def delete(self, key):
+        if key not in self.values:
+            return False
+        self.heap.remove(key)
+        del self.values[key]
+        self.bytes -= self.sizes.pop(key)
+        self.deadlines.pop(key, None)
+        return True
+
+    def invalidate(self, tags):
+        return 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def used_bytes(self):
+        return self.bytes
+
+    def clear(self):
+        self.__init__(self.capacity, self.budget_bytes, self.admission, self.expiry)
+
+def _run_rl(trace, mem_capacity, redis_capacity, params, seed, learner=None):
+    random.seed(seed)  # epsilon-greedy exploration draws from the global RNG
+    params = dict(params)
+    mem_budget = params.pop('mem_budget_bytes', None)
+    redis_budget = params.pop('redis_budget_bytes', None)
+    policy = params.get('eviction_policy', 'rl')
+    cache = MultiLevelRLCache(mem_capacity, redis_capacity, None, codec=SizeCodec(), mem_budget_bytes=mem_budget,
+                              redis_tier=LocalTier(redis_capacity, redis_budget, admission=policy == 'gdsf'),
+                              learner=learner, **params)
+    codes = {'memory': LEVEL_MEMORY, 'redis': LEVEL_REDIS}
+    levels = bytearray(len(trace))
+    costs, sizes = trace.cost_ms.tolist(), trace.size_bytes.tolist()
+    # The tabular policies only need key ids; the learner reads the
+    # template from the real key
+    keys = trace.keys if learner is not None else None
+    for i, key_id in enumerate(trace.ids.tolist()):
+        key = key_id if keys is None else keys[key_id]
+        value, level = cache.get(key)
+        if value:
+            levels[i] = codes[level]
+            cache.update_q_value(key, "cache", sim.LEVEL_REWARDS.get(level, 1))
+        else:
+            cache.put(key, sizes[key_id], cost=costs[key_id])
+            cache.update_q_value(key, "evict", sim.MISS_REWARD)
+        cache.decay_q_table()
+    return levels
+
+def _run_baseline(trace, policy, mem_capacity, redis_capacity):
+    access = TwoTier(policy, mem_capacity, redis_capacity).access
+    return bytearray(map(access, trace.ids.tolist()))
+
+def summarize_levels(trace, levels):
+    """Hit ratios per tier and estimated DB time saved, from the level
+    each request was served at."""
+    levels = np.frombuffer(bytes(levels), dtype=np.int8)
+    costs = trace.cost_ms[trace.ids]
+    hit_ms = np.array([0.0, MEMORY_HIT_MS, REDIS_HIT_MS])[levels]
+    saved = np.where(levels > 0, costs - hit_ms, 0.0).sum()
+    n = max(len(levels), 1)
+    mem_hits = int(np.count_nonzero(levels == LEVEL_MEMORY))
+    redis_hits = int(np.count_nonzero(levels == LEVEL_REDIS))
+    return {
+        'requests': len(levels),
+        'memory_hit_ratio': mem_hits / n,
+        'redis_hit_ratio': redis_hits / n,
+        'hit_ratio': (mem_hits + redis_hits) / n,
+        'saved_ms': float(saved),
+        'saved_fraction': float(saved / costs.sum()) if len(costs) else 0.0,
+    }
+
+def simulate(trace, policy, mem_capacity=sim.MEMORY_CACHE_SIZE, redis_capacity=sim.REDIS_CACHE_SIZE,
+             seed=0, **params):
+    """Runs one policy ('rl', 'gdsf', 'linear' or a POLICIES baseline)
+    over trace. params go to MultiLevelRLCache for the RL policies (alpha,
+    gamma, epsilon, decay_rate, byte budgets...). 'linear' is 'rl' with
+    the Q-table replaced by a LinearQLearner; learning_rate and
+    batch_size params go to the learner."""
+    start = time.perf_counter()
+    if policy == 'linear':
+        params = dict(params)
+        learner = LinearQLearner(**{name: params.pop(name) for name in ('learning_rate', 'batch_size')
+                                    if name in params})
+        levels = _run_rl(trace, mem_capacity, redis_capacity, dict(params, eviction_policy='rl'), seed, learner)
+    elif policy in ('rl', 'gdsf'):
+        levels = _run_rl(trace, mem_capacity, redis_capacity, dict(params, eviction_policy=policy), seed)
+    else:
+        levels = _run_baseline(trace, policy, mem_capacity, redis_capacity)
+    elapsed = time.perf_counter() - start
+    result = summarize_levels(trace, levels)
+    result.update(policy=policy, params=params, requests_per_sec=len(trace) / elapsed if elapsed else 0.0)
+    return result
+
+# === Parallel Parameter Sweeps ===
+
+_worker_trace = None
+
+def _init_worker(trace):
+    # The trace is shipped once per worker process, not once per task
+    global _worker_trace
+    _worker_trace = trace
+
+def _sweep_point(args):
+    policy, mem_capacity, redis_capacity, params, seed = args
+    return simulate(_worker_trace, policy, mem_capacity, redis_capacity, seed, **params)
+
+def sweep(trace, grid, policy='rl', mem_capacity=sim.MEMORY_CACHE_SIZE, redis_capacity=sim.REDIS_CACHE_SIZE,
+          seed=0, processes=None):
+    """Runs policy once per combination in grid ({param: [values...]}),
+    spread across processes, and returns the results best saved_ms first."""
+    points = [(policy, mem_capacity, redis_capacity, dict(zip(grid, values)), seed)
+              for values in itertools.product(*grid.values())]
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(trace,)) as pool:
+        results = list(pool.map(_sweep_point, points))
+    return sorted(results, key=lambda r: r['saved_ms'], reverse=True)
+
+# === CLI ===
+
+def _parse_grid(specs):
+    # ["alpha=0.1,0.3", "batch_size=16,64"] -> {'alpha': [0.1, 0.3], 'batch_size': [16, 64]}
+    grid = {}
+    for spec in specs:
+        name, values = spec.split('=', 1)
+        grid[name] = [int(v) if v.isdigit() else float(v) for v in values.split(',')]
+    return grid
+
+def _print_result(r):
+    params = ' '.join(f'{k}={v}' for k, v in r['params'].items())
+    print(f"  {r['policy']:<8} {params:<44} hit {r['hit_ratio']:6.2%} (mem {r['memory_hit_ratio']:6.2%},"
+          f" redis {r['redis_hit_ratio']:6.2%})  saved {r['saved_ms'] / 1000:9.1f} s"
+          f" ({r['saved_fraction']:6.2%})  {r['requests_per_sec'] / 1e6:5.2f}M req/s")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Offline cache-policy simulator',
+        epilog='rl, gdsf and linear replay the trace through MultiLevelRLCache itself and run at roughly '
+               '0.1M, 0.1M and 0.04M requests/s (the baselines at 0.3-3M); use --requests to size runs.')
+    parser.add_argument('--trace', help='trace file from workload.py (default: generate a skewed workload)')
+    parser.add_argument('--requests', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.0)
+    parser.add_argument('--mem', type=int, default=sim.MEMORY_CACHE_SIZE, help='memory tier entries')
+    parser.add_argument('--redis', type=int, default=sim.REDIS_CACHE_SIZE, help='Redis tier entries')
+    parser.add_argument('--policies', default='lru,lfu,arc,tinylfu,rl,gdsf,linear')
+    parser.add_argument('--sweep', nargs='*', metavar='PARAM=V1,V2',
+                        help='sweep RL parameters (alpha, gamma, epsilon, decay_rate) in parallel')
+    parser.add_argument('--sweep-policy', choices=['rl', 'gdsf', 'linear'], default='rl',
+                        help='policy to sweep (linear also takes learning_rate and batch_size)')
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args()
+
+    workload = read_trace(args.trace) if args.trace else SkewedWorkload(args.seed, args.zipf, requests=args.requests)
+    trace = compile_trace(workload)
+    print(f"--- {len(trace):,} requests, {len(trace.keys):,} keys, memory {args.mem} / Redis {args.redis} entries ---")
+    if args.sweep:
+        for r in sweep(trace, _parse_grid(args.sweep), args.sweep_policy, args.mem, args.redis, args.seed,
+                       args.processes):
+            _print_result(r)
+        return
+    for policy in args.policies.split(','):
+        _print_result(simulate(trace, policy, args.mem, args.redis, args.seed))
+
+if __name__ == '__main__':
+    main()
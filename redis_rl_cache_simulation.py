@@ -1,19 +1,41 @@
-import psycopg2
+import heapq
 import random
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+import uuid
+import zlib
 from datetime import datetime, timedelta
 import redis
 from decimal import Decimal
-import pickle
+from db_executor import QueryExecutor
+from invalidation import derive_dependencies, entry_tags, write_tags
+from metrics import LatencyHistogram, SimulationMetrics
+from result_codec import RowCodec
+from snapshot import Snapshotter, restore_snapshot
 
 # === Redis Setup ===
+# The cache only ever touches keys under its own namespace (see RedisTier),
+# so the database is shared with other tenants and never flushed here.
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
-redis_client.flushdb()
+REDIS_NAMESPACE = 'rlcache'
+REDIS_WRITE_BATCH_SIZE = 64
+REDIS_WRITE_FLUSH_INTERVAL = 0.05  # seconds
+REDIS_LEASE_TTL_MS = 5000  # how long a cross-process loader may hold a key's lease
+REFRESH_WORKERS = 4  # most refresh-ahead queries running at once
+REFRESH_INTERVAL = 0.25  # seconds between refresh-ahead scans
+REFRESH_AHEAD = 0.75  # refresh once an entry is this far into its staleness bound
+LEARNER_PENDING = 1024  # decision-time features kept for the learner until their reward arrives
+SNAPSHOT_PATH = 'rlcache.snapshot'  # policy state and memory-tier hot set, for warm restarts
 
 
 MEMORY_CACHE_SIZE = 50
 REDIS_CACHE_SIZE = 100
+MEMORY_CACHE_BYTES = 4 * 1024 * 1024    # encoded result bytes; None = entry count only
+REDIS_CACHE_BYTES = 16 * 1024 * 1024
+EVICTION_POLICY = 'rl'  # 'rl' (Q-values) or 'gdsf' (saved DB ms per byte)
 TOTAL_USERS = 5000
 TOTAL_PRODUCTS = 1000
 TOTAL_ORDERS = 50000
@@ -21,76 +43,1382 @@ TOTAL_REVIEWS = 10000
 TOTAL_QUERIES = 1000
 
 # === Local PostgreSQL Setup ===
+# Connection settings come from the PG* environment variables; see
+# db_executor.DB_CONFIG.
+
+# === Indexed Priority Queue for Memory-Tier Eviction ===
+
+class IndexedMinHeap:
+    """Binary min-heap of keys with a position index, so a key's priority
+    can be changed or the key removed in O(log n)."""
+
+    def __init__(self):
+        self.heap = []
+        self.priority = {}
+        self.position = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.position
+
+    def push(self, key, priority):
+        if key in self.position:
+            self.update(key, priority)
+            return
+        self.priority[key] = priority
+        self.position[key] = len(self.heap)
+        self.heap.append(key)
+        self._sift_up(len(self.heap) - 1)
+
+    def update(self, key, priority):
+        old = self.priority[key]
+        self.priority[key] = priority
+        i = self.position[key]
+        if priority < old:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def peek(self):
+        return self.heap[0]
+
+    def pop(self):
+        key = self.heap[0]
+        self.remove(key)
+        return key
+
+    def remove(self, key):
+        i = self.position.pop(key)
+        del self.priority[key]
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.position[last] = i
+            self._sift_up(i)
+            self._sift_down(self.position[last])
+
+    def _sift_up(self, i):
+        heap, priority, position = self.heap, self.priority, self.position
+        key = heap[i]
+        p = priority[key]
+        while i > 0:
+            parent = (i - 1) >> 1
+            parent_key = heap[parent]
+            if not p < priority[parent_key]:
+                break
+            heap[i] = parent_key
+            position[parent_key] = i
+            i = parent
+        heap[i] = key
+        position[key] = i
+
+    def _sift_down(self, i):
+        heap, priority, position = self.heap, self.priority, self.position
+        n = len(heap)
+        key = heap[i]
+        p = priority[key]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            right = child + 1
+            if right < n and priority[heap[right]] < priority[heap[child]]:
+                child = right
+            child_key = heap[child]
+            if not priority[child_key] < p:
+                break
+            heap[i] = child_key
+            position[child_key] = i
+            i = child
+        heap[i] = key
+        position[key] = i
+
+# === Namespaced Redis Tier ===
+
+# Invalidation tags: the tag hash maps each value key to its newline-joined
+# tags, and each tag has a set <tag hash>:<tag> of the value keys carrying
+# it. Entries leave their tag sets whenever they leave the tier, so the sets
+# only ever hold resident keys. Tag set names are built from the tag hash
+# key and share its {namespace} hash tag, so they stay in the same slot.
+_REDIS_UNTAG_LUA = """
+local function untag(tags_key, member)
+    local tags = redis.call('HGET', tags_key, member)
+    if tags then
+        for tag in string.gmatch(tags, '[^\\n]+') do
+            redis.call('SREM', tags_key .. ':' .. tag, member)
+        end
+        redis.call('HDEL', tags_key, member)
+    end
+end
+"""
+
+# Entries with a staleness bound are written with PX, so Redis itself stops
+# serving them once the bound runs out, and their deadlines go in an expiry
+# zset. Each put first drops up to 16 members whose deadline has passed,
+# so expired values stop counting against the tier's capacity and byte
+# budget.
+
+# Inserts or refreshes one entry and evicts the lowest-scored members until
+# the tier is back within its entry capacity and byte budget, all in one
+# atomic round trip. With admission checking on, a new entry that scores
+# below the current minimum is turned away instead of evicting anything.
+# KEYS[1] = score zset, KEYS[2] = value key, KEYS[3] = size hash,
+# KEYS[4] = byte total, KEYS[5] = tag hash, KEYS[6] = expiry zset
+# ARGV[1] = payload, ARGV[2] = score, ARGV[3] = capacity,
+# ARGV[4] = byte budget (-1 = none), ARGV[5] = admission check (0/1),
+# ARGV[6] = now (ms), ARGV[7] = time to live (ms, 0 = none),
+# ARGV[8...] = invalidation tags
+# Returns {evicted, score of the last victim or '', admitted}
+REDIS_PUT_SCRIPT = _REDIS_UNTAG_LUA + """
+local size = string.len(ARGV[1])
+local score = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local budget = tonumber(ARGV[4])
+local ttl = tonumber(ARGV[7])
+if budget >= 0 and size > budget then
+    return {0, '', 0}
+end
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[6], '-inf', ARGV[6], 'LIMIT', 0, 16)) do
+    redis.call('ZREM', KEYS[6], member)
+    if redis.call('ZREM', KEYS[1], member) == 1 then
+        redis.call('DECRBY', KEYS[4], tonumber(redis.call('HGET', KEYS[3], member) or '0'))
+        redis.call('HDEL', KEYS[3], member)
+        redis.call('DEL', member)
+        untag(KEYS[5], member)
+    end
+end
+local resident = redis.call('ZSCORE', KEYS[1], KEYS[2])
+local old = 0
+local count = redis.call('ZCARD', KEYS[1])
+if resident then
+    old = tonumber(redis.call('HGET', KEYS[3], KEYS[2]) or '0')
+else
+    count = count + 1
+end
+local total = tonumber(redis.call('GET', KEYS[4]) or '0') - old + size
+local function over()
+    return count > capacity or (budget >= 0 and total > budget)
+end
+if over() and ARGV[5] == '1' and not resident then
+    local lowest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if lowest[2] and tonumber(lowest[2]) > score then
+        return {0, '', 0}
+    end
+end
+if resident then
+    redis.call('ZREM', KEYS[1], KEYS[2])
+    untag(KEYS[5], KEYS[2])
+end
+local evicted = 0
+local inflation = ''
+while over() do
+    local victim = redis.call('ZPOPMIN', KEYS[1])
+    if #victim == 0 then
+        break
+    end
+    total = total - tonumber(redis.call('HGET', KEYS[3], victim[1]) or '0')
+    redis.call('HDEL', KEYS[3], victim[1])
+    redis.call('DEL', victim[1])
+    redis.call('ZREM', KEYS[6], victim[1])
+    untag(KEYS[5], victim[1])
+    count = count - 1
+    evicted = evicted + 1
+    inflation = victim[2]
+end
+if ttl > 0 then
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', ttl)
+    redis.call('ZADD', KEYS[6], tonumber(ARGV[6]) + ttl, KEYS[2])
+else
+    redis.call('SET', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[6], KEYS[2])
+end
+redis.call('ZADD', KEYS[1], ARGV[2], KEYS[2])
+redis.call('HSET', KEYS[3], KEYS[2], size)
+redis.call('SET', KEYS[4], total)
+if #ARGV > 7 then
+    local tags = {}
+    for i = 8, #ARGV do
+        redis.call('SADD', KEYS[5] .. ':' .. ARGV[i], KEYS[2])
+        tags[#tags + 1] = ARGV[i]
+    end
+    redis.call('HSET', KEYS[5], KEYS[2], table.concat(tags, '\\n'))
+end
+return {evicted, inflation, 1}
+"""
+
+# Deletes a lease only if it still holds the caller's token; with a TTL in
+# ARGV[2], also records that token as the one that published the value.
+# KEYS[1] = lease key, KEYS[2] = published-by key
+REDIS_RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    if ARGV[2] then
+        redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+    end
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Removes one entry and its byte accounting.
+# KEYS[1] = score zset, KEYS[2] = value key, KEYS[3] = size hash,
+# KEYS[4] = byte total, KEYS[5] = tag hash, KEYS[6] = expiry zset
+REDIS_DELETE_SCRIPT = _REDIS_UNTAG_LUA + """
+redis.call('ZREM', KEYS[6], KEYS[2])
+if redis.call('ZREM', KEYS[1], KEYS[2]) == 0 then
+    return 0
+end
+local size = tonumber(redis.call('HGET', KEYS[3], KEYS[2]) or '0')
+redis.call('HDEL', KEYS[3], KEYS[2])
+redis.call('DEL', KEYS[2])
+redis.call('DECRBY', KEYS[4], size)
+untag(KEYS[5], KEYS[2])
+return 1
+"""
+
+# Removes every entry carrying any of the given tags.
+# KEYS[1] = score zset, KEYS[2] = size hash, KEYS[3] = byte total, KEYS[4] = tag hash,
+# KEYS[5] = expiry zset
+# ARGV = tags; returns the number of entries removed
+REDIS_INVALIDATE_SCRIPT = _REDIS_UNTAG_LUA + """
+local removed = 0
+for _, tag in ipairs(ARGV) do
+    for _, member in ipairs(redis.call('SMEMBERS', KEYS[4] .. ':' .. tag)) do
+        if redis.call('ZREM', KEYS[1], member) == 1 then
+            local size = tonumber(redis.call('HGET', KEYS[2], member) or '0')
+            redis.call('HDEL', KEYS[2], member)
+            redis.call('DEL', member)
+            redis.call('DECRBY', KEYS[3], size)
+            removed = removed + 1
+        end
+        redis.call('ZREM', KEYS[5], member)
+        untag(KEYS[4], member)
+    end
+    redis.call('DEL', KEYS[4] .. ':' .. tag)
+end
+return removed
+"""
+
+class RedisTier:
+    """Redis-backed cache tier that tracks its own membership, scores and
+    payload sizes (a sorted set, a size hash and a byte counter), so
+    eviction never needs KEYS/DBSIZE and never touches another tenant's
+    keys. The tier is bounded by entry count and, optionally, by total
+    payload bytes. All keys share a {namespace} hash tag so the Lua scripts
+    stay single-slot on Redis Cluster. tagger(key), if given, returns the
+    invalidation tags stored with each entry; invalidate(tags) drops every
+    entry carrying one of them. expiry(key), if given, returns the seconds
+    an entry may still be served (None = no limit); Redis expires the
+    value after that."""
+
+    def __init__(self, client, capacity, namespace=REDIS_NAMESPACE, budget_bytes=None, admission=False,
+                 tagger=None, expiry=None):
+        self.client = client
+        self.capacity = capacity
+        self.budget_bytes = budget_bytes
+        self.admission = admission
+        self.namespace = namespace
+        self.scores_key = f'{{{namespace}}}:scores'
+        self.sizes_key = f'{{{namespace}}}:sizes'
+        self.bytes_key = f'{{{namespace}}}:bytes'
+        self.tags_key = f'{{{namespace}}}:tags'
+        self.expires_key = f'{{{namespace}}}:expires'
+        self.value_prefix = f'{{{namespace}}}:v:'
+        self.tagger = tagger
+        self.expiry = expiry
+        self.evictions = 0
+        self.rejections = 0
+        self.inflation = 0.0  # score of the most recent victim (GDSF "L")
+        self._put_script = client.register_script(REDIS_PUT_SCRIPT) if client is not None else None
+        self._delete_script = client.register_script(REDIS_DELETE_SCRIPT) if client is not None else None
+        self._release_script = client.register_script(REDIS_RELEASE_LEASE_SCRIPT) if client is not None else None
+        self._invalidate_script = client.register_script(REDIS_INVALIDATE_SCRIPT) if client is not None else None
+
+    def value_key(self, key):
+        return self.value_prefix + repr(key)
+
+    def _script_keys(self, key):
+        return [self.scores_key, self.value_key(key), self.sizes_key, self.bytes_key, self.tags_key,
+                self.expires_key]
+
+    def _put_args(self, key, payload, score):
+        budget = -1 if self.budget_bytes is None else self.budget_bytes
+        tags = self.tagger(key) if self.tagger is not None else ()
+        ttl = self.expiry(key) if self.expiry is not None else None
+        # An entry already past its bound still gets the shortest PX rather than none
+        ttl_ms = 0 if ttl is None else max(int(ttl * 1000), 1)
+        return [payload, score, self.capacity, budget, 1 if self.admission else 0, int(time.time() * 1000), ttl_ms,
+                *tags]
+
+    def _record_put(self, result):
+        evicted, inflation, admitted = result
+        self.evictions += evicted
+        if inflation:
+            self.inflation = float(inflation)
+        if not admitted:
+            self.rejections += 1
+        return bool(admitted)
+
+    def get(self, key):
+        if self.capacity <= 0:
+            return None
+        return self.client.get(self.value_key(key))
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        if self.capacity <= 0:
+            return [None] * len(keys)
+        if len(keys) == 1:
+            return [self.get(keys[0])]
+        return self.client.mget([self.value_key(k) for k in keys])
+
+    def put(self, key, payload, score):
+        if self.capacity <= 0:
+            return False
+        return self._record_put(self._put_script(keys=self._script_keys(key), args=self._put_args(key, payload, score)))
+
+    def update_score(self, key, score):
+        if self.capacity <= 0:
+            return
+        # XX: only rescore members that are still resident
+        self.client.zadd(self.scores_key, {self.value_key(key): score}, xx=True)
+
+    def write_batch(self, writes):
+        # writes: (key, payload, score) tuples applied in order in one
+        # pipelined round trip; payload None means rescore only.
+        if self.capacity <= 0 or not writes:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for key, payload, score in writes:
+            if payload is None:
+                pipe.zadd(self.scores_key, {self.value_key(key): score}, xx=True)
+            else:
+                self._put_script(keys=self._script_keys(key),
+                                 args=self._put_args(key, payload, score), client=pipe)
+        for (_, payload, _), result in zip(writes, pipe.execute()):
+            if payload is not None:
+                self._record_put(result)
+
+    def delete(self, key):
+        return bool(self._delete_script(keys=self._script_keys(key)))
+
+    def invalidate(self, tags):
+        if self.capacity <= 0 or not tags:
+            return 0
+        return self._invalidate_script(keys=[self.scores_key, self.sizes_key, self.bytes_key, self.tags_key,
+                                             self.expires_key], args=list(tags))
+
+    def ttl_ms(self, key):
+        # Milliseconds until the value expires; None without a bound or value
+        ttl = self.client.pttl(self.value_key(key))
+        return ttl if ttl >= 0 else None
+
+    def lease_key(self, key):
+        return f'{{{self.namespace}}}:lease:{key!r}'
+
+    def acquire_lease(self, key, token, ttl_ms=REDIS_LEASE_TTL_MS):
+        return bool(self.client.set(self.lease_key(key), token, nx=True, px=ttl_ms))
+
+    def published_key(self, key):
+        return f'{{{self.namespace}}}:published:{key!r}'
+
+    def release_lease(self, key, token, published=False, ttl_ms=REDIS_LEASE_TTL_MS):
+        # Only the holder may release; an expired lease may belong to someone else now.
+        # published=True marks the key's current value as this holder's load.
+        args = [token, ttl_ms] if published else [token]
+        return bool(self._release_script(keys=[self.lease_key(key), self.published_key(key)], args=args))
+
+    def lease_holder(self, key):
+        token = self.client.get(self.lease_key(key))
+        return None if token is None else token.decode()
+
+    def lease_publisher(self, key):
+        # Token of the last holder that released the lease after publishing
+        token = self.client.get(self.published_key(key))
+        return None if token is None else token.decode()
+
+    def __len__(self):
+        return self.client.zcard(self.scores_key)
+
+    def used_bytes(self):
+        return int(self.client.get(self.bytes_key) or 0)
+
+    def clear(self, batch=500):
+        # Drop only this namespace's entries, in bounded batches
+        while True:
+            members = self.client.zrange(self.scores_key, 0, batch - 1)
+            if not members:
+                break
+            tag_sets = {f'{self.tags_key}:{tag}'
+                        for tags in self.client.hmget(self.tags_key, members) if tags
+                        for tag in tags.decode().split('\n')}
+            pipe = self.client.pipeline()
+            pipe.delete(*members, *tag_sets)
+            pipe.zrem(self.scores_key, *members)
+            pipe.hdel(self.sizes_key, *members)
+            pipe.hdel(self.tags_key, *members)
+            pipe.zrem(self.expires_key, *members)
+            pipe.execute()
+        self.client.delete(self.sizes_key, self.bytes_key, self.tags_key, self.expires_key)
+
+# === Write-Behind Queue for the Redis Tier ===
+
+class WriteBehindQueue:
+    """Buffers Redis-tier writes and flushes them to RedisTier.write_batch in
+    pipelined batches on a background thread, off the request path. A flush
+    happens once batch_size writes are pending or flush_interval seconds
+    have passed, whichever comes first.
+
+    Guarantees:
+    - Read-your-writes: pending(key) returns a buffered value until it has
+      landed in Redis, so the cache never misses on its own recent put.
+    - Per-key ordering: writes to one key coalesce (last write wins) and
+      batches are applied strictly one after another, so an older value
+      never overwrites a newer one. Across keys, a batch is applied in the
+      order the keys were last written.
+    - Durability: none beyond the process. Writes still buffered when the
+      process dies are lost; close() drains them on shutdown. A batch that
+      fails is dropped and counted in failed_writes rather than retried,
+      since Postgres stays the source of truth and the key simply misses.
+    - Backpressure: once max_pending writes are buffered, the writer that
+      crosses the limit flushes synchronously.
+    """
+
+    def __init__(self, tier, batch_size=REDIS_WRITE_BATCH_SIZE, flush_interval=REDIS_WRITE_FLUSH_INTERVAL,
+                 max_pending=None):
+        self.tier = tier
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or batch_size * 4
+        self.buffer = {}  # key -> [payload, score]; dicts keep write order
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.closed = False
+        self.flushed_writes = 0
+        self.failed_writes = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key, payload, score):
+        with self.lock:
+            self.buffer.pop(key, None)
+            self.buffer[key] = [payload, score]
+            pending = len(self.buffer)
+            if pending >= self.batch_size:
+                self.wakeup.notify()
+        if pending >= self.max_pending:
+            self.flush()
+
+    def rescore(self, key, score):
+        with self.lock:
+            entry = self.buffer.get(key)
+            if entry is not None:
+                entry[1] = score
+                return
+            self.buffer[key] = [None, score]
+
+    def pending(self, key):
+        with self.lock:
+            entry = self.buffer.get(key)
+        return entry[0] if entry is not None else None
+
+    def flush(self):
+        # flush_lock serializes batches so they reach Redis in buffer order
+        with self.flush_lock:
+            with self.lock:
+                writes = [(k, payload, score) for k, (payload, score) in self.buffer.items()]
+                if not writes:
+                    return
+            try:
+                self.tier.write_batch(writes)
+                self.flushed_writes += len(writes)
+            except redis.RedisError:
+                self.failed_writes += len(writes)
+            with self.lock:
+                # Drop what was written unless it was re-buffered meanwhile
+                for key, payload, score in writes:
+                    entry = self.buffer.get(key)
+                    if entry is not None and entry[0] is payload and entry[1] == score:
+                        del self.buffer[key]
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.closed and len(self.buffer) < self.batch_size:
+                    self.wakeup.wait(self.flush_interval)
+                if self.closed:
+                    return
+            self.flush()
+
+# === Per-Key Cache Metadata ===
+
+class CacheEntry:
+    """Everything the cache knows about one key, in a single __slots__
+    record: the two Q-values and the decay epoch they were last rescaled at,
+    hit count, last access time, when the cached value was computed,
+    measured DB cost (ms) and encoded size."""
+
+    __slots__ = ('q_cache', 'q_evict', 'epoch', 'hits', 'freshness', 'loaded_at', 'cost', 'size')
+
+    def __init__(self, epoch):
+        self.q_cache = 0.0
+        self.q_evict = 0.0
+        self.epoch = epoch
+        self.hits = 0
+        self.freshness = 0.0
+        self.loaded_at = None
+        self.cost = None
+        self.size = None
+
+# === Single-Flight Miss Coalescing ===
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one: the first
+    caller runs fn, later callers block until it finishes and share its
+    result (or its exception). followers counts the calls that were saved."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """Returns (result, leader) where leader is True for the caller
+        that actually ran fn."""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+        try:
+            flight.result = fn()
+            return flight.result, True
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+# === Shared Decay Clock ===
+
+class DecayClock:
+    """Global Q-value decay epoch. Caches sharing one clock (the shards of a
+    ShardedRLCache) age in lockstep, and since stored scores do not depend
+    on the current epoch, a tick never needs to touch any shard."""
+
+    def __init__(self):
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    def tick(self):
+        with self.lock:
+            self.epoch += 1
 
 # === Multi-level RL-based Cache Simulation (with real Redis) ===
 
 class MultiLevelRLCache:
-    def __init__(self, mem_capacity, redis_capacity, redis_client, alpha=0.3, gamma=0.9, epsilon=0.05, decay_rate=0.75):
+    """Two-tier (process memory, then Redis) cache for query results.
+
+    Both tiers are bounded by entry count and, optionally, by payload bytes
+    (mem_budget_bytes / redis_budget_bytes, measured as encoded size).
+    eviction_policy picks what ranks entries for eviction:
+    - "rl": the decayed "cache" Q-value learned from hit/miss rewards.
+    - "gdsf": GreedyDual-Size-Frequency, inflation + hits * DB cost / bytes.
+      It maximizes saved DB milliseconds per cached byte, and also gates
+      admission: a new entry that ranks below everything it would displace
+      is not cached.
+
+    Metadata is bounded too. Keys resident in the memory tier keep their
+    CacheEntry in entries; every other key's record lives in ghosts, an
+    LRU history capped at ghost_capacity records, so one-hit wonders and
+    long-gone keys cannot grow the process without limit.
+
+    All public methods are thread-safe. In-process state is guarded by one
+    lock per cache, and Redis round trips and codec work happen outside
+    it. For many concurrent callers, ShardedRLCache stripes keys across
+    several of these caches so callers rarely contend on the same lock.
+
+    load() is the miss path. Concurrent misses on one key in this process
+    share a single DB call. With lease_coalescing on, processes sharing
+    the Redis tier coordinate through a per-key Redis lease too: the
+    holder queries Postgres and publishes the result to Redis, the others
+    wait for it there.
+
+    invalidate(table, row) keeps entries correct under writes. Each
+    template's table dependencies (QUERY_DEPENDENCIES by default, derived
+    from its SQL) become tags on its entries, and a write drops only the
+    entries whose tags it matches, from both tiers, through a reverse index
+    of tag to keys. A load whose query overlapped an invalidation of one
+    of its own tags is not left in the cache, since its result may predate
+    the write.
+
+    staleness_bounds maps template names to the seconds a result may be
+    served after it was computed; older entries miss. Redis values are
+    written with a matching expiry, so the bound holds for values other
+    processes wrote and for keys whose records this process has dropped.
+    refresh() recomputes an entry in place, and
+    RefreshAhead calls it for the hot, expensive entries that are about to
+    go stale (see refresh_candidates).
+
+    learner replaces the per-key Q-table with a model over key features,
+    e.g. feature_learner.LinearQLearner. Each access stores the model's
+    predictions in the key's q_cache / q_evict, so eviction ranking and
+    decay work unchanged. Keys the cache has never seen then start from
+    what it learned about similar keys instead of from zero.
+    """
+
+    def __init__(self, mem_capacity, redis_capacity, redis_client, alpha=0.3, gamma=0.9, epsilon=0.05, decay_rate=0.75,
+                 namespace=REDIS_NAMESPACE, write_behind=False, write_batch_size=REDIS_WRITE_BATCH_SIZE,
+                 write_flush_interval=REDIS_WRITE_FLUSH_INTERVAL, codec=None, mem_budget_bytes=None,
+                 redis_budget_bytes=None, eviction_policy="rl", ghost_capacity=None, clock=None,
+                 lease_coalescing=False, lease_ttl_ms=REDIS_LEASE_TTL_MS, dependencies=None, redis_tier=None,
+                 staleness_bounds=None, learner=None):
+        if eviction_policy not in ("rl", "gdsf"):
+            raise ValueError(f"unknown eviction_policy {eviction_policy!r}")
         self.mem_capacity = mem_capacity
         self.redis_capacity = redis_capacity
+        self.mem_budget_bytes = mem_budget_bytes
+        self.eviction_policy = eviction_policy
         self.memory_cache = {}
-        self.memory_queue = deque()
-        self.q_table = defaultdict(lambda: defaultdict(float))
+        self.memory_heap = IndexedMinHeap()
+        self.memory_bytes = 0
+        self.memory_inflation = 0.0
+        self.memory_rejections = 0
+        self.memory_evictions = 0
+        self.entries = {}
+        self.ghosts = OrderedDict()
+        self.ghost_capacity = 4 * (mem_capacity + redis_capacity) if ghost_capacity is None else ghost_capacity
+        self.clock = clock or DecayClock()
+        self.lock = threading.RLock()
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
         self.decay_rate = decay_rate
-        self.freshness = {}
-        self.costs = {}
-        self.values = defaultdict(int)
         self.redis_client = redis_client
+        self.dependencies = QUERY_DEPENDENCIES if dependencies is None else dependencies
+        self.memory_tags = {}  # invalidation tag -> memory-resident keys carrying it
+        self.invalidations = 0
+        self.tag_generations = {}  # tag of an in-flight load -> [loads carrying it, invalidations of it]
+        self.invalidated_entries = 0
+        self.staleness_bounds = staleness_bounds or {}
+        self.stale_misses = 0
+        self.refreshes = 0
+        self.learner = learner
+        self.learner_pending = OrderedDict()  # key -> features at its last decision
+        # redis_tier: any object with RedisTier's interface, e.g. the
+        # in-process policy_sim.LocalTier used for offline policy runs
+        self.redis_tier = redis_tier
+        if redis_tier is None:
+            self.redis_tier = RedisTier(redis_client, redis_capacity, namespace, redis_budget_bytes,
+                                        admission=eviction_policy == "gdsf", tagger=self._tags,
+                                        expiry=self._redis_ttl)
+        elif staleness_bounds and getattr(redis_tier, 'expiry', False) is None:
+            redis_tier.expiry = self._redis_ttl
+        self.codec = codec or RowCodec()
+        self.single_flight = SingleFlight()
+        self.lease_coalescing = lease_coalescing
+        self.lease_ttl_ms = lease_ttl_ms
+        self.lease_followers = 0
+        self.write_behind = None
+        if write_behind:
+            self.write_behind = WriteBehindQueue(self.redis_tier, write_batch_size, write_flush_interval)
+
+    @property
+    def decay_epoch(self):
+        return self.clock.epoch
 
     def decay_q_table(self):
-        for state in self.q_table:
-            for action in self.q_table[state]:
-                self.q_table[state][action] *= self.decay_rate
+        # Aging is lazy: bump a global epoch and let _aged rescale each
+        # record the next time it is touched, so a decay step is O(1)
+        # instead of a sweep over every key ever seen.
+        self.clock.tick()
+
+    def _meta(self, key):
+        meta = self.entries.get(key)
+        if meta is not None:
+            return meta
+        meta = self.ghosts.get(key)
+        if meta is not None:
+            self.ghosts.move_to_end(key)
+            return meta
+        meta = CacheEntry(self.decay_epoch)
+        self._remember(key, meta)
+        return meta
+
+    def _remember(self, key, meta):
+        self.ghosts[key] = meta
+        if len(self.ghosts) > self.ghost_capacity:
+            self.ghosts.popitem(last=False)
+
+    def metadata(self, key):
+        """The key's CacheEntry, or None if it is no longer tracked."""
+        with self.lock:
+            return self.entries.get(key) or self.ghosts.get(key)
+
+    def restore_entry(self, key, fields, value=None):
+        """Re-creates a key's record from its CacheEntry fields in slot
+        order (see snapshot.py): memory-resident with value if given and
+        the tier has room, else a ghost record. Records are expected
+        hottest first. Returns 'memory', 'ghost', or None when the key is
+        already tracked or there is no room left."""
+        with self.lock:
+            if key in self.entries or key in self.ghosts:
+                return None
+            meta = CacheEntry(0)
+            (meta.q_cache, meta.q_evict, meta.epoch, meta.hits, meta.freshness,
+             meta.loaded_at, meta.cost, meta.size) = fields
+            if value is not None and not self._memory_full(meta.size):
+                self._memory_admit(key, meta, value)
+                if key in self.entries:
+                    return 'memory'
+            if len(self.ghosts) >= self.ghost_capacity:
+                return None
+            self.ghosts[key] = meta
+            self.ghosts.move_to_end(key, last=False)  # colder than everything restored so far
+            return 'ghost'
+
+    def _aged(self, meta):
+        elapsed = self.decay_epoch - meta.epoch
+        if elapsed:
+            factor = self.decay_rate ** elapsed
+            meta.q_cache *= factor
+            meta.q_evict *= factor
+            meta.epoch = self.decay_epoch
+        return meta
+
+    def _cache_score(self, meta):
+        # Ranks keys by their decayed "cache" Q-value without depending on
+        # the current epoch: q * decay_rate**-stamp taken in log space and
+        # mapped to sign * (offset + magnitude), so a global decay step never
+        # reorders stored scores and nothing overflows. The offset keeps the
+        # magnitude positive down to the smallest subnormal float.
+        q = meta.q_cache
+        if q == 0:
+            return 0.0
+        magnitude = 1000.0 + math.log(abs(q)) - meta.epoch * math.log(self.decay_rate)
+        return magnitude if q > 0 else -magnitude
+
+    def _gdsf_score(self, meta, inflation):
+        # Saved DB milliseconds per cached byte, aged by the tier's inflation
+        cost = 1.0 if meta.cost is None else meta.cost
+        return inflation + meta.hits * cost / max(meta.size or 1, 1)
+
+    def _memory_priority(self, meta):
+        if self.eviction_policy == "gdsf":
+            return (self._gdsf_score(meta, self.memory_inflation), meta.freshness)
+        return (self._cache_score(meta), meta.freshness)
+
+    def _redis_score(self, meta):
+        if self.eviction_policy == "gdsf":
+            return self._gdsf_score(meta, self.redis_tier.inflation)
+        return self._cache_score(meta)
+
+    def _predict(self, key, meta):
+        # Learner path: refresh the key's Q-values from the model, stamped
+        # at the current epoch so _aged decays them like learned ones
+        x = self.learner.features(key, meta, self.decay_epoch)
+        meta.q_cache, meta.q_evict = self.learner.predict(x)
+        meta.epoch = self.decay_epoch
+        return x
+
+    def _choose_action(self, key, meta):
+        meta.hits += 1
+        meta.freshness = time.time()
+        if self.learner is not None:
+            # Features are taken before the access resets the recency gap;
+            # update_q_value trains on these rather than recomputing them
+            x = self._predict(key, meta)
+            self.learner_pending.pop(key, None)
+            self.learner_pending[key] = x
+            if len(self.learner_pending) > LEARNER_PENDING:
+                self.learner_pending.popitem(last=False)
+        if key in self.memory_heap:
+            self.memory_heap.update(key, self._memory_priority(meta))
 
-    def get(self, key):
-        now = time.time()
-        self.values[key] += 1
-        self.freshness[key] = now
-        
         if random.uniform(0, 1) < self.epsilon:
-            action = random.choice(["evict", "cache"])
-        else:
-            action = "evict" if self.q_table[key]["evict"] > self.q_table[key]["cache"] else "cache"
-        
-        # Check memory cache first
-        if action == "cache" and key in self.memory_cache:
-            return self.memory_cache[key], 'memory'
-        
+            return random.choice(["evict", "cache"])
+        self._aged(meta)
+        return "evict" if meta.q_evict > meta.q_cache else "cache"
+
+    def _staleness_bound(self, key):
+        return self.staleness_bounds.get(key[0]) if type(key) is tuple and key else None
+
+    def _past_bound(self, key, meta):
+        bound = self._staleness_bound(key)
+        return bound is not None and meta.loaded_at is not None and time.time() - meta.loaded_at > bound
+
+    def _stale(self, key, meta):
+        # Covers the memory tier, and Redis as long as this process still
+        # knows the load time; Redis also expires values itself (_redis_ttl)
+        if not self._past_bound(key, meta):
+            return False
+        self.stale_misses += 1
+        return True
+
+    def _redis_ttl(self, key):
+        # Seconds the value being written to Redis for key may still be
+        # served. Runs on the write-behind thread too, so it reads the
+        # record without the lock.
+        bound = self._staleness_bound(key)
+        if bound is None:
+            return None
+        meta = self.entries.get(key) or self.ghosts.get(key)
+        if meta is None or meta.loaded_at is None:
+            return bound
+        return bound - (time.time() - meta.loaded_at)
+
+    def _redis_payloads(self, keys):
+        # Buffered write-behind values first, then one MGET for the rest
+        payloads = [None] * len(keys)
+        remote = []
+        for i, key in enumerate(keys):
+            if self.write_behind is not None:
+                payloads[i] = self.write_behind.pending(key)
+            if payloads[i] is None:
+                remote.append(i)
+        fetched = self.redis_tier.get_many([keys[i] for i in remote])
+        for i, payload in zip(remote, fetched):
+            payloads[i] = payload
+        return payloads
+
+    def _redis_hit(self, key, payload):
+        value = self.codec.decode(payload)
+        rescore = None
+        with self.lock:
+            meta = self._meta(key)
+            meta.size = len(payload)
+            if self.eviction_policy == "gdsf":
+                rescore = self._redis_score(meta)
+            promote = meta.hits > 5  # Only promote if it's frequently accessed
+            bound = self._staleness_bound(key) if meta.loaded_at is None else None
+        if rescore is not None:
+            self._redis_rescore(key, rescore)
+        if promote:
+            if bound is not None:
+                # Written by another process, or this one has forgotten
+                # when: recover the load time from the value's Redis TTL
+                ttl = self.redis_tier.ttl_ms(key)
+                with self.lock:
+                    meta.loaded_at = time.time() - bound + (ttl or 0) / 1000
+            self.put(key, value, promote_from_redis=True, size=len(payload))
+        return value, 'redis'
+
+    def get(self, key):
+        with self.lock:
+            meta = self._meta(key)
+            action = self._choose_action(key, meta)
+            if action != "cache" or self._stale(key, meta):
+                return None, None
+            # Check memory cache first
+            if key in self.memory_cache:
+                return self.memory_cache[key], 'memory'
+
         # Check Redis cache
-        if action == "cache":
-            redis_key = repr(key)
-            value = self.redis_client.get(redis_key)
-            if value is not None:
-                value = pickle.loads(value)
-                # Only promote to memory if it's frequently accessed
-                if self.values[key] > 5:  # Example threshold
-                    self.put(key, value, promote_from_redis=True)
-                return value, 'redis'
-        
+        payload = self._redis_payloads([key])[0]
+        if payload is not None:
+            return self._redis_hit(key, payload)
         return None, None
 
-    def put(self, key, value, promote_from_redis=False):
+    def get_many(self, keys):
+        """Batched get: same per-key policy as get(), but every key that
+        falls through to Redis is fetched in a single MGET round trip."""
+        results = [(None, None)] * len(keys)
+        to_fetch = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                meta = self._meta(key)
+                if self._choose_action(key, meta) != "cache" or self._stale(key, meta):
+                    continue
+                if key in self.memory_cache:
+                    results[i] = (self.memory_cache[key], 'memory')
+                else:
+                    to_fetch.append(i)
+        payloads = self._redis_payloads([keys[i] for i in to_fetch])
+        for i, payload in zip(to_fetch, payloads):
+            if payload is not None:
+                results[i] = self._redis_hit(keys[i], payload)
+        return results
+
+    def _redis_put(self, key, payload, score):
+        if self.write_behind is not None:
+            self.write_behind.submit(key, payload, score)
+        else:
+            self.redis_tier.put(key, payload, score)
+
+    def _redis_rescore(self, key, score):
+        if self.write_behind is not None:
+            self.write_behind.rescore(key, score)
+        else:
+            self.redis_tier.update_score(key, score)
+
+    def close(self):
+        # Drain buffered Redis writes
+        if self.write_behind is not None:
+            self.write_behind.close()
+
+    def load(self, key, loader):
+        """Miss path: run loader() (the DB query) and cache its result,
+        coalescing concurrent misses on key. Returns (result, leader);
+        leader is False when the result came from another caller's load."""
+        if self.lease_coalescing and self.redis_tier.capacity > 0:
+            (result, leader), local_leader = self.single_flight.do(key, lambda: self._load_with_lease(key, loader))
+            return result, leader and local_leader
+        return self.single_flight.do(key, lambda: self._load_and_put(key, loader))
+
+    def _load_and_put(self, key, loader, admit=True):
+        tags = self._tags(key)
+        with self.lock:
+            generations = []
+            for tag in tags:
+                counts = self.tag_generations.setdefault(tag, [0, 0])
+                counts[0] += 1
+                generations.append(counts[1])
+        try:
+            start = time.perf_counter()
+            result = loader()
+            self.put(key, result, cost=(time.perf_counter() - start) * 1000, admit=admit)
+        finally:
+            with self.lock:
+                overlapped = False
+                for tag, generation in zip(tags, generations):
+                    counts = self.tag_generations[tag]
+                    overlapped |= counts[1] != generation
+                    counts[0] -= 1
+                    if not counts[0]:
+                        del self.tag_generations[tag]
+        if overlapped:
+            # A write this entry depends on was invalidated while the query
+            # ran; its result may predate it
+            self._discard(key)
+        return result
+
+    def _load_with_lease(self, key, loader):
+        # Returns (result, leader) for the whole process
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lease_ttl_ms / 1000
+        delay = 0.002
+        with self.lock:
+            meta = self.entries.get(key) or self.ghosts.get(key)
+            stale = meta is not None and self._past_bound(key, meta)
+        # A value that missed for being stale can linger in Redis until its
+        # PX runs out; followers must not take it for the holder's result
+        stale_payload = self.redis_tier.get(key) if stale else None
+        while True:
+            if self.redis_tier.acquire_lease(key, token, self.lease_ttl_ms):
+                published = False
+                try:
+                    result = self._load_and_put(key, loader)
+                    if self.write_behind is not None:
+                        self.write_behind.flush()  # publish before waking other processes
+                    published = True
+                    return result, True
+                finally:
+                    self.redis_tier.release_lease(key, token, published, self.lease_ttl_ms)
+            holder = self.redis_tier.lease_holder(key)
+            if holder is None:
+                continue  # released in between; try the lease again
+            # Another process holds the lease: wait for that holder to
+            # publish, so a value already in Redis is never mistaken for its
+            # load. Retry the lease if it gives up without publishing, or
+            # only the stale bytes are there, in which case this process reloads
+            while time.monotonic() < deadline:
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                if self.redis_tier.lease_publisher(key) == holder:
+                    payload = self.redis_tier.get(key)
+                    if payload is not None and payload != stale_payload:
+                        with self.lock:
+                            self.lease_followers += 1
+                        return self.codec.decode(payload), False
+                    break
+                if self.redis_tier.lease_holder(key) != holder:
+                    break
+            else:
+                # The holder is stuck; load it ourselves
+                return self._load_and_put(key, loader), True
+
+    def coalescing_stats(self):
+        return {
+            'loads': self.single_flight.leaders - self.lease_followers,
+            'coalesced': self.single_flight.followers,
+            'lease_coalesced': self.lease_followers,
+            'db_calls_saved': self.single_flight.followers + self.lease_followers,
+        }
+
+    # === Refresh-Ahead ===
+
+    def refresh(self, key, loader):
+        """Recompute key with loader() and rewrite it wherever it lives,
+        without promoting it to the memory tier. Runs through the same
+        single flight as load(), so a foreground miss on key meanwhile
+        waits for this query instead of issuing its own."""
+        result, _ = self.single_flight.do(key, lambda: self._load_and_put(key, loader, admit=False))
+        with self.lock:
+            self.refreshes += 1
+        return result
+
+    def _refresh_due(self, ahead, exclude):
+        # (rank, key) for every entry due for a refresh
+        now = time.time()
+        due = []
+        with self.lock:
+            for records in (self.entries, self.ghosts):
+                for key, meta in records.items():
+                    bound = self._staleness_bound(key)
+                    if bound is None or meta.loaded_at is None or key in exclude:
+                        continue
+                    # Not yet due, or nobody has read it since the last load
+                    if now - meta.loaded_at < ahead * bound or meta.freshness <= meta.loaded_at:
+                        continue
+                    # Decay shrinks q_cache but never flips its sign, so
+                    # a hot key whose value has decayed still qualifies
+                    if meta.q_cache > 0:
+                        due.append((meta.hits * (1.0 if meta.cost is None else meta.cost), key))
+        return due
+
+    def refresh_candidates(self, ahead=REFRESH_AHEAD, limit=REFRESH_WORKERS, exclude=()):
+        """Up to limit keys, best first, that are at least `ahead` (a
+        fraction) into their staleness bound and were read since they were
+        last computed. Only keys the policy has learned to cache (positive
+        cache Q-value) qualify, ranked by hit count times measured DB
+        cost."""
+        if not self.staleness_bounds:
+            return []
+        return [key for _, key in heapq.nlargest(limit, self._refresh_due(ahead, exclude), key=lambda d: d[0])]
+
+    # === Invalidation ===
+
+    def _tags(self, key):
+        return entry_tags(key, self.dependencies)
+
+    def _memory_tag(self, key):
+        for tag in self._tags(key):
+            self.memory_tags.setdefault(tag, set()).add(key)
+
+    def _memory_untag(self, key):
+        for tag in self._tags(key):
+            keys = self.memory_tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.memory_tags[tag]
+
+    def _memory_drop(self, key):
+        # Drops the value but keeps the key's policy record, as a ghost
         if key not in self.memory_cache:
-            if len(self.memory_cache) >= self.mem_capacity:
-                min_key = min(self.memory_cache, key=lambda k: (self.q_table[k]["cache"], self.freshness.get(k, 0)))
-                self.memory_cache.pop(min_key)
-                self.memory_queue.remove(min_key)
-            self.memory_cache[key] = value
-            self.memory_queue.append(key)
+            return False
+        del self.memory_cache[key]
+        self.memory_heap.remove(key)
+        meta = self.entries.pop(key)
+        self.memory_bytes -= meta.size
+        self._remember(key, meta)
+        self._memory_untag(key)
+        return True
+
+    def _discard(self, key):
+        with self.lock:
+            self._memory_drop(key)
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        self.redis_tier.delete(key)
+
+    def invalidate(self, table, row=None):
+        """Drop every cached entry a write to table may have changed. row
+        maps column names to the written row's values; with it, only
+        entries filtered on those values go, and without it every entry
+        that reads table does. Returns the number of entries removed
+        across both tiers."""
+        tags = write_tags(table, row, self.dependencies)
+        with self.lock:
+            self.invalidations += 1
+            for tag in tags:
+                counts = self.tag_generations.get(tag)
+                if counts is not None:
+                    counts[1] += 1
+            keys = set().union(*(self.memory_tags.get(tag, ()) for tag in tags))
+            removed = sum(self._memory_drop(key) for key in keys)
+        # Buffered writes reach Redis first so none lands after the delete
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        removed += self.redis_tier.invalidate(tags)
+        with self.lock:
+            self.invalidated_entries += removed
+        return removed
+
+    def _memory_full(self, size):
+        if len(self.memory_cache) >= self.mem_capacity:
+            return True
+        return self.mem_budget_bytes is not None and self.memory_bytes + size > self.mem_budget_bytes
+
+    def _memory_admit(self, key, meta, value):
+        # Returns (key, score) Redis rescores for the caller to issue once
+        # the lock is released.
+        rescores = []
+        size = meta.size
+        if self.mem_capacity <= 0 or (self.mem_budget_bytes is not None and size > self.mem_budget_bytes):
+            return rescores
+        priority = self._memory_priority(meta)
+        if (self.eviction_policy == "gdsf" and self.memory_heap and self._memory_full(size)
+                and priority < self.memory_heap.priority[self.memory_heap.peek()]):
+            self.memory_rejections += 1
+            return rescores
+        while self.memory_heap and self._memory_full(size):
+            min_key = self.memory_heap.peek()
+            if self.eviction_policy == "gdsf":
+                self.memory_inflation = self.memory_heap.priority[min_key][0]
+            self.memory_heap.pop()
+            self.memory_cache.pop(min_key)
+            min_meta = self.entries.pop(min_key)
+            self.memory_bytes -= min_meta.size
+            self._remember(min_key, min_meta)
+            self._memory_untag(min_key)
+            self.memory_evictions += 1
+            # Its Redis copy was not rescored while it was served from memory
+            rescores.append((min_key, self._redis_score(min_meta)))
+        self.ghosts.pop(key, None)
+        self.entries[key] = meta
+        self.memory_cache[key] = value
+        self.memory_bytes += size
+        self.memory_heap.push(key, self._memory_priority(meta))
+        self._memory_tag(key)
+        return rescores
+
+    def put(self, key, value, promote_from_redis=False, cost=None, size=None, admit=True):
+        # cost: milliseconds the DB took to produce value, if just measured.
+        # admit=False updates a memory-resident value but never adds one.
+        payload = None
+        if size is None or not promote_from_redis:
+            payload = self.codec.encode(value)
+            size = len(payload)
+        with self.lock:
+            meta = self._meta(key)
+            if cost is not None:
+                meta.cost = cost
+            if not promote_from_redis:
+                meta.loaded_at = time.time()
+            rescores = []
+            if key in self.memory_cache:
+                self.memory_cache[key] = value
+                self.memory_bytes += size - meta.size
+                if size != meta.size:
+                    meta.size = size
+                    # GDSF ranks by cost per byte, so a resize moves the key
+                    self.memory_heap.update(key, self._memory_priority(meta))
+            else:
+                meta.size = size
+                if admit:
+                    rescores = self._memory_admit(key, meta, value)
+            score = self._redis_score(meta)
+        for evicted_key, evicted_score in rescores:
+            self._redis_rescore(evicted_key, evicted_score)
         if not promote_from_redis:
-            redis_key = repr(key)
-            if self.redis_client.dbsize() >= self.redis_capacity:
-                all_keys = list(self.redis_client.keys())
-                if all_keys:
-                    self.redis_client.delete(all_keys[0])
-            self.redis_client.set(redis_key, pickle.dumps(value))
+            self._redis_put(key, payload, score)
 
     def update_q_value(self, key, action, reward):
         # More aggressive RL: higher reward for memory/redis, penalty for DB
-        self.q_table[key][action] += self.alpha * (reward - self.q_table[key][action])
+        with self.lock:
+            if self.learner is not None:
+                meta = self._meta(key)
+                x = self.learner_pending.pop(key, None)
+                if x is None:
+                    x = self.learner.features(key, meta, self.decay_epoch)
+                self.learner.observe(x, action, reward)
+                self._predict(key, meta)
+            else:
+                meta = self._aged(self._meta(key))
+                if action == "cache":
+                    meta.q_cache += self.alpha * (reward - meta.q_cache)
+                else:
+                    meta.q_evict += self.alpha * (reward - meta.q_evict)
+            if action != "cache" or self.eviction_policy != "rl":
+                return
+            if key in self.memory_heap:
+                self.memory_heap.update(key, self._memory_priority(meta))
+                return
+            score = self._redis_score(meta)
+        self._redis_rescore(key, score)
+
+# === Striped Cache for Concurrent Callers ===
+
+def _split(total, parts):
+    if total is None or total <= 0:
+        return total
+    return max(1, total // parts)
+
+class ShardedRLCache:
+    """Stripes keys across `shards` independent MultiLevelRLCache instances,
+    each with its own lock, slice of the memory tier and Redis namespace
+    ({namespace}:<i>), so concurrent callers only contend when their keys
+    land on the same shard. Keys map to shards by CRC32 of repr(key), which
+    is stable across processes, so every process sharing the Redis instance
+    agrees on where a key lives. Capacities and byte budgets are split
+    evenly and eviction runs per shard. All shards share one DecayClock."""
+
+    def __init__(self, mem_capacity, redis_capacity, redis_client, shards=16, namespace=REDIS_NAMESPACE,
+                 mem_budget_bytes=None, redis_budget_bytes=None, ghost_capacity=None, **kwargs):
+        self.clock = DecayClock()
+        self.shards = [
+            MultiLevelRLCache(_split(mem_capacity, shards), _split(redis_capacity, shards), redis_client,
+                              namespace=f'{namespace}:{i}', mem_budget_bytes=_split(mem_budget_bytes, shards),
+                              redis_budget_bytes=_split(redis_budget_bytes, shards),
+                              ghost_capacity=_split(ghost_capacity, shards), clock=self.clock, **kwargs)
+            for i in range(shards)
+        ]
+
+    def shard_for(self, key):
+        return self.shards[zlib.crc32(repr(key).encode()) % len(self.shards)]
+
+    @property
+    def decay_epoch(self):
+        return self.clock.epoch
+
+    def get(self, key):
+        return self.shard_for(key).get(key)
+
+    def get_many(self, keys):
+        # One batched lookup per shard touched; results keep input order
+        by_shard = {}
+        for i, key in enumerate(keys):
+            by_shard.setdefault(id(self.shard_for(key)), []).append(i)
+        results = [None] * len(keys)
+        for indexes in by_shard.values():
+            shard = self.shard_for(keys[indexes[0]])
+            for i, result in zip(indexes, shard.get_many([keys[i] for i in indexes])):
+                results[i] = result
+        return results
+
+    def put(self, key, value, promote_from_redis=False, cost=None, size=None):
+        self.shard_for(key).put(key, value, promote_from_redis, cost, size)
+
+    def load(self, key, loader):
+        return self.shard_for(key).load(key, loader)
+
+    def coalescing_stats(self):
+        totals = {}
+        for shard in self.shards:
+            for name, count in shard.coalescing_stats().items():
+                totals[name] = totals.get(name, 0) + count
+        return totals
+
+    def invalidate(self, table, row=None):
+        # Tags do not map to shards, so every shard checks its own index
+        return sum(shard.invalidate(table, row) for shard in self.shards)
+
+    def refresh(self, key, loader):
+        return self.shard_for(key).refresh(key, loader)
+
+    def refresh_candidates(self, ahead=REFRESH_AHEAD, limit=REFRESH_WORKERS, exclude=()):
+        if not self.shards[0].staleness_bounds:
+            return []
+        due = [d for shard in self.shards for d in shard._refresh_due(ahead, exclude)]
+        return [key for _, key in heapq.nlargest(limit, due, key=lambda d: d[0])]
+
+    def update_q_value(self, key, action, reward):
+        self.shard_for(key).update_q_value(key, action, reward)
+
+    def decay_q_table(self):
+        self.clock.tick()
+
+    def metadata(self, key):
+        return self.shard_for(key).metadata(key)
+
+    def restore_entry(self, key, fields, value=None):
+        return self.shard_for(key).restore_entry(key, fields, value)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+# === Refresh-Ahead ===
+
+class RefreshAhead:
+    """Background thread that keeps hot entries from going stale: every
+    interval seconds it asks the cache for refresh_candidates() and
+    recomputes them with compute(key) on a pool of at most `workers`
+    threads, so a refresh never needs more than `workers` DB connections.
+    A failed refresh is counted and left to the next scan; the entry
+    misses normally if it goes stale first."""
+
+    def __init__(self, cache, compute, workers=REFRESH_WORKERS, interval=REFRESH_INTERVAL, ahead=REFRESH_AHEAD):
+        self.cache = cache
+        self.compute = compute
+        self.workers = workers
+        self.interval = interval
+        self.ahead = ahead
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='refresh')
+        self.lock = threading.Lock()
+        self.inflight = set()
+        self.refreshed = 0
+        self.failed = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def scan(self):
+        """Queues the most valuable due keys that fit in the free workers;
+        returns how many were queued."""
+        with self.lock:
+            room = self.workers - len(self.inflight)
+            exclude = set(self.inflight)
+        if room <= 0:
+            return 0
+        keys = self.cache.refresh_candidates(self.ahead, room, exclude)
+        with self.lock:
+            self.inflight.update(keys)
+        for key in keys:
+            self.pool.submit(self._refresh, key)
+        return len(keys)
+
+    def _refresh(self, key):
+        try:
+            self.cache.refresh(key, lambda: self.compute(key))
+            refreshed = True
+        except Exception:
+            refreshed = False
+        with self.lock:
+            self.inflight.discard(key)
+            if refreshed:
+                self.refreshed += 1
+            else:
+                self.failed += 1
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.scan()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
 
 # === Query Definitions ===
 queries = [
@@ -98,7 +1426,7 @@ queries = [
         SELECT order_date, SUM(quantity) FROM orders
         WHERE product_id = %s AND order_date > CURRENT_DATE - INTERVAL '30 days'
         GROUP BY order_date ORDER BY order_date;
-    """, lambda: (random.randint(1, 20),)),
+    """, lambda rng=random: (rng.randint(1, 20),)),
     # Real-world: Daily sales tracking for specific products
     # Skew: Temporal skew - recent 30 days get more queries
     # Use case: Product managers monitoring daily sales trends
@@ -107,7 +1435,7 @@ queries = [
         SELECT AVG(p.price * o.quantity) FROM orders o
         JOIN products p ON o.product_id = p.id
         WHERE o.user_id = %s;
-    """, lambda: (random.randint(1, 100),)),
+    """, lambda rng=random: (rng.randint(1, 100),)),
     # Real-world: Customer value analysis
     # Skew: User skew - frequent customers get more queries
     # Use case: Marketing team analyzing customer spending patterns
@@ -116,7 +1444,7 @@ queries = [
         SELECT DISTINCT o2.product_id FROM orders o1
         JOIN orders o2 ON o1.user_id = o2.user_id AND o1.product_id != o2.product_id
         WHERE o1.product_id = %s LIMIT 5;
-    """, lambda: (random.randint(1, 20),)),
+    """, lambda rng=random: (rng.randint(1, 20),)),
     # Real-world: Product recommendation system
     # Skew: Product skew - popular products get more queries
     # Use case: "Customers who bought this also bought..." feature
@@ -125,7 +1453,7 @@ queries = [
         SELECT order_date, SUM(quantity) OVER (ORDER BY order_date) FROM orders
         WHERE product_id = %s AND order_date > CURRENT_DATE - INTERVAL '30 days'
         ORDER BY order_date;
-    """, lambda: (random.randint(1, 20),)),
+    """, lambda rng=random: (rng.randint(1, 20),)),
     # Real-world: Cumulative sales tracking
     # Skew: Temporal skew - recent dates get more queries
     # Use case: Sales team monitoring product performance trends
@@ -133,7 +1461,7 @@ queries = [
     ("top_rated_products_category", """
         SELECT name, rating FROM products
         WHERE category = %s ORDER BY rating DESC LIMIT 5;
-    """, lambda: (random.choice(['Laptops', 'Mobiles', 'Tablets', 'Accessories', 'Desktops', 'Wearables']),)),
+    """, lambda rng=random: (rng.choice(['Laptops', 'Mobiles', 'Tablets', 'Accessories', 'Desktops', 'Wearables']),)),
     # Real-world: Category performance analysis
     # Skew: Category skew - popular categories get more queries
     # Use case: Product discovery and category pages
@@ -142,7 +1470,7 @@ queries = [
         SELECT DISTINCT u.id, u.name FROM users u
         WHERE u.id IN (SELECT user_id FROM reviews WHERE product_id = %s)
         AND u.id IN (SELECT user_id FROM orders WHERE product_id = %s);
-    """, lambda: (pid := random.randint(1, 20), pid)),
+    """, lambda rng=random: (pid := rng.randint(1, 20), pid)),
     # Real-world: Customer engagement analysis
     # Skew: Product skew - popular products get more queries
     # Use case: Identifying engaged customers for marketing
@@ -152,7 +1480,7 @@ queries = [
         JOIN promotions pr ON p.id = pr.product_id
         JOIN seasons s ON pr.season_id = s.id
         WHERE s.name = %s;
-    """, lambda: (random.choice(['College Start', 'Holiday Sale', 'Back to School', 'Summer Sale', 'New Year']),)),
+    """, lambda rng=random: (rng.choice(['College Start', 'Holiday Sale', 'Back to School', 'Summer Sale', 'New Year']),)),
     # Real-world: Seasonal promotion management
     # Skew: Temporal skew - current season gets more queries
     # Use case: Marketing team managing seasonal promotions
@@ -162,18 +1490,68 @@ queries = [
         JOIN users u ON o.user_id = u.id
         JOIN seasons s ON o.order_date BETWEEN s.start_date AND s.end_date
         WHERE u.city = %s AND s.name = %s;
-    """, lambda: (random.choice(['New York', 'London', 'Tokyo', 'Delhi', 'Berlin']), random.choice(['College Start', 'Holiday Sale', 'Back to School', 'Summer Sale', 'New Year']))),
+    """, lambda rng=random: (rng.choice(['New York', 'London', 'Tokyo', 'Delhi', 'Berlin']), rng.choice(['College Start', 'Holiday Sale', 'Back to School', 'Summer Sale', 'New Year']))),
     # Real-world: Geographic sales analysis
     # Skew: Geographic skew - major cities get more queries
     # Use case: Regional sales analysis during specific seasons
 ]
 
-def synthetic_query_distribution():
+# === Derived Templates ===
+# Some templates are cheap Python transformations of a shared base query,
+# so one DB fetch (and one cache entry) serves all of them. Base templates
+# are never requested directly; the executor just needs to know them.
+base_queries = [
+    ("daily_sales_base", """
+        SELECT order_date, SUM(quantity), COUNT(*) FROM orders
+        WHERE product_id = %s AND order_date > CURRENT_DATE - INTERVAL '30 days'
+        GROUP BY order_date ORDER BY order_date;
+    """, lambda rng=random: (rng.randint(1, 20),)),
+    # One row per day of the 30-day window: units sold and order count
+]
+
+def daily_sales_from_base(rows, params):
+    return [(day, units) for day, units, _ in rows]
+
+def running_total_from_base(rows, params):
+    # SUM() OVER (ORDER BY order_date) ranges over peers, so every order
+    # row of a day carries the running total through the end of that day
+    result = []
+    running = 0
+    for day, units, orders in rows:
+        running += units
+        result.extend([(day, running)] * orders)
+    return result
+
+# template -> (base template, derive(base_rows, params) -> rows)
+DERIVED_TEMPLATES = {
+    "daily_sales_product": ("daily_sales_base", daily_sales_from_base),
+    "running_total_sales_product": ("daily_sales_base", running_total_from_base),
+}
+
+# Tables (and filter columns) each template reads, for invalidation
+QUERY_DEPENDENCIES = {q_name: derive_dependencies(q_text) for q_name, q_text, _ in queries + base_queries}
+
+# Seconds each template's results may be served after they were computed:
+# tight for the per-product sales windows that move with every order,
+# loose for catalogue and promotion lookups
+STALENESS_BOUNDS_S = {
+    "daily_sales_base": 10,
+    "daily_sales_product": 10,
+    "running_total_sales_product": 10,
+    "avg_order_value_user": 30,
+    "users_also_bought": 60,
+    "reviewed_and_bought": 60,
+    "orders_by_city_in_season": 60,
+    "top_rated_products_category": 120,
+    "products_on_promotion_season": 300,
+}
+
+def synthetic_query_distribution(rng=random):
     # 1. Burst Detection (10% chance)
-    burst = random.random() < 0.1
+    burst = rng.random() < 0.1
     if burst:
         # Simulate different types of bursts
-        burst_type = random.choice([
+        burst_type = rng.choice([
             "product_burst",    # Multiple products
             "category_burst",   # All products in a category
             "seasonal_burst"    # Products in a season
@@ -181,132 +1559,194 @@ def synthetic_query_distribution():
         
         if burst_type == "product_burst":
             # Simulate burst affecting multiple products
-            burst_products = random.sample(range(1, 21), 3)  # Random 3 products
-            return queries[0], (random.choice(burst_products),)  # daily_sales_product
+            burst_products = rng.sample(range(1, 21), 3)  # Random 3 products
+            return queries[0], (rng.choice(burst_products),)  # daily_sales_product
         elif burst_type == "category_burst":
             # Simulate burst in a popular category
-            return queries[4], (random.choice(['Laptops', 'Mobiles', 'Tablets']),)  # top_rated_products_category
+            return queries[4], (rng.choice(['Laptops', 'Mobiles', 'Tablets']),)  # top_rated_products_category
         else:  # seasonal_burst
             # Simulate burst during a major sale
-            return queries[6], (random.choice(['Holiday Sale', 'Back to School']),)  # products_on_promotion_season
+            return queries[6], (rng.choice(['Holiday Sale', 'Back to School']),)  # products_on_promotion_season
     
     # 2. Hot Query Detection (60% chance)
-    hot = random.random() < 0.6
+    hot = rng.random() < 0.6
     if hot:
         # Weighted random choice of queries
-        q = random.choices(queries, weights=[0.4,0.1,0.1,0.1,0.1,0.05,0.1,0.05])[0]
+        q = rng.choices(queries, weights=[0.4,0.1,0.1,0.1,0.1,0.05,0.1,0.05])[0]
         
         # Special handling for specific queries
         if q[0] == "daily_sales_product":
-            return q, (random.choice([1,2,3]),)  # Only products 1,2,3
+            return q, (rng.choice([1,2,3]),)  # Only products 1,2,3
         if q[0] == "products_on_promotion_season":
             return q, ("College Start",)  # Only College Start season
         if q[0] == "orders_by_city_in_season":
             return q, ("Delhi", "College Start")  # Only Delhi in College Start
-        return q, q[2]()  # Use default parameter generator
+        return q, q[2](rng)  # Use default parameter generator
     
     # 3. Cold Query (30% chance)
-    q = random.choice(queries)  # Equal probability for all queries
-    return q, q[2]()  # Use default parameter generator
-
-def run_simulation(with_cache=True, log_queue=None, plot_queue=None):
-    conn = psycopg2.connect(
-        dbname='postgres',
-        user='*******,
-        password='*****',
-        host='***********',
-        port=5432
-    )
-    cur = conn.cursor()
-    query_stats = {q[0]: [] for q in queries}
+    q = rng.choice(queries)  # Equal probability for all queries
+    return q, q[2](rng)  # Use default parameter generator
+
+def synthetic_workload(requests=None, seed=None):
+    """The default query mix as a stream of (q_name, params); the same
+    seed always yields the same stream. requests=None streams forever."""
+    rng = random.Random(seed)
+    count = 0
+    while requests is None or count < requests:
+        q, param = synthetic_query_distribution(rng)
+        yield q[0], param
+        count += 1
+
+LEVEL_REWARDS = {'memory': 7, 'redis': 4}
+MISS_REWARD = -3
+
+def serve_query(cache, executor, q_name, param, derivations=None):
+    """One request through the cache: look it up, fall back to the DB and
+    populate on a miss, then feed the reward back to the RL policy.
+    Returns (result, level) with level 'memory', 'redis', 'db', or
+    'coalesced' when another caller's in-flight DB query answered it.
+
+    With derivations (e.g. DERIVED_TEMPLATES), a template that declares
+    one is served through its base template's entry instead of its own:
+    level 'derived' when the base was cached, and the base's own level
+    when it had to be fetched. Only the base is cached and rewarded."""
+    derivation = derivations.get(q_name) if derivations else None
+    if derivation is not None:
+        base_name, derive = derivation
+        base, level = serve_query(cache, executor, base_name, param)
+        return derive(base, param), 'derived' if level in LEVEL_REWARDS else level
+    cache_key = (q_name,) + tuple(param)
+    cached_result, cache_level = cache.get(cache_key)
+    if cached_result:
+        result, level = cached_result, cache_level
+        cache.update_q_value(cache_key, "cache", LEVEL_REWARDS.get(cache_level, 1))
+    else:
+        result, leader = cache.load(cache_key, lambda: executor.execute(q_name, param))
+        level = 'db' if leader else 'coalesced'
+        cache.update_q_value(cache_key, "evict", MISS_REWARD)
+    cache.decay_q_table()
+    return result, level
+
+def run_simulation(with_cache=True, log_queue=None, plot_queue=None, workload=None, seed=None, metrics=None,
+                   snapshot_path=None):
+    """Serve a workload of (q_name, params) requests, by default
+    TOTAL_QUERIES from synthetic_workload(seed). Runs given the same seed,
+    or the same recorded trace (workload.read_trace), see identical
+    request streams. Latencies go into metrics (a SimulationMetrics),
+    whose histograms stay the same size however long the run is.
+    Progress goes to log_queue and plot_queue as JSON-ready dicts tagged
+    'log', 'plot', 'summary' and 'done'; anything with a non-blocking
+    put() works, e.g. a broadcast.BroadcastHub.
+
+    With snapshot_path, the cached run starts warm: it restores the
+    policy state and memory tier saved there (see snapshot.py), keeps
+    the Redis tier as the last run left it, and snapshots periodically
+    and once more at the end."""
+    if workload is None:
+        workload = synthetic_workload(TOTAL_QUERIES, seed)
+    if metrics is None:
+        metrics = SimulationMetrics('cache' if with_cache else 'nocache')
+    executor = QueryExecutor(queries + base_queries)
+    recent = deque(maxlen=10)
     mem_hits = 0
     redis_hits = 0
+    derived_hits = 0
     db_hits = 0
     if with_cache:
-        cache = MultiLevelRLCache(MEMORY_CACHE_SIZE, REDIS_CACHE_SIZE, redis_client)
+        cache = MultiLevelRLCache(MEMORY_CACHE_SIZE, REDIS_CACHE_SIZE, redis_client, write_behind=True,
+                                  mem_budget_bytes=MEMORY_CACHE_BYTES, redis_budget_bytes=REDIS_CACHE_BYTES,
+                                  eviction_policy=EVICTION_POLICY, staleness_bounds=STALENESS_BOUNDS_S)
+        snapshotter = None
+        if snapshot_path is None:
+            cache.redis_tier.clear()  # start each run cold, without touching other tenants
+        else:
+            restore_snapshot(cache, snapshot_path)
+            snapshotter = Snapshotter(cache, snapshot_path)
+        refresher = RefreshAhead(cache, lambda key: executor.execute(key[0], key[1:]))
+        metrics.attach(cache)
         sim_label = 'With RL-based Multi-level Cache (Supabase PostgreSQL + Redis)'
     else:
         sim_label = 'Without Cache (Baseline, Supabase PostgreSQL)'
-    for i in range(TOTAL_QUERIES):
-        q, param = synthetic_query_distribution()
-        q_name, q_text, _ = q
-        cache_key = (q_name,) + tuple(param)
-        start = time.time()
+    total_queries = 0
+    for i, (q_name, param) in enumerate(workload):
+        total_queries += 1
+        start = time.perf_counter()
         if with_cache:
-            cached_result, cache_level = cache.get(cache_key)
-            if cached_result:
-                result = cached_result
-                if cache_level == 'memory':
-                    mem_hits += 1
-                    reward = 7
-                elif cache_level == 'redis':
-                    redis_hits += 1
-                    reward = 4
-                else:
-                    reward = 1
+            result, level = serve_query(cache, executor, q_name, param, DERIVED_TEMPLATES)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if level == 'memory':
+                mem_hits += 1
+            elif level == 'redis':
+                redis_hits += 1
+            elif level == 'derived':
+                derived_hits += 1
             else:
-                cur.execute(q_text, param)
-                result = cur.fetchall()
-                cache.put(cache_key, result)
                 db_hits += 1
-                reward = -3
-            elapsed_ms = (time.time() - start) * 1000
-            cache.costs[cache_key] = elapsed_ms
-            cache.update_q_value(cache_key, "cache" if cached_result else "evict", reward)
-            cache.decay_q_table()
         else:
-            cur.execute(q_text, param)
-            result = cur.fetchall()
-            elapsed_ms = (time.time() - start) * 1000
+            result = executor.execute(q_name, param)
+            level = 'db'
+            elapsed_ms = (time.perf_counter() - start) * 1000
             db_hits += 1
-        query_stats[q_name].append(elapsed_ms)
+        metrics.record(q_name, level, elapsed_ms)
+        recent.append(elapsed_ms)
         if (i + 1) % 10 == 0:
-            last_10 = []
-            for ql in query_stats.values():
-                last_10.extend(ql[-10:])
-            avg_last_10 = sum(last_10) / len(last_10) if last_10 else 0
+            avg_last_10 = sum(recent) / len(recent)
             log_msg = {
+                'type': 'log',
                 'step': i+1,
                 'avg_time': avg_last_10,
                 'mem_hits': mem_hits,
                 'redis_hits': redis_hits,
+                'derived_hits': derived_hits,
                 'db_hits': db_hits,
                 'label': sim_label
             }
             if log_queue:
                 log_queue.put(log_msg)
             if plot_queue:
-                plot_queue.put({'step': i+1, 'avg_time': avg_last_10, 'label': sim_label})
+                plot_queue.put({'type': 'plot', 'step': i+1, 'avg_time': avg_last_10, 'label': sim_label})
         time.sleep(0.001)
     # Summary
-    all_times = sum([sum(times) for times in query_stats.values()])
-    avg_time = all_times / TOTAL_QUERIES
+    all_times = sum(h.total_ms for h in metrics.tiers.values())
+    avg_time = all_times / total_queries if total_queries else 0
+    overall = LatencyHistogram()
+    for h in metrics.tiers.values():
+        overall.merge(h)
+    per_query = {}
+    for q_name in dict.fromkeys([q[0] for q in queries] + list(metrics.templates)):
+        h = metrics.templates.get(q_name) or LatencyHistogram()
+        per_query[q_name] = {'count': h.count, 'avg_time': h.mean_ms,
+                             'p50': h.percentile(50), 'p99': h.percentile(99)}
     summary = {
         'label': sim_label,
-        'total_queries': TOTAL_QUERIES,
+        'total_queries': total_queries,
         'total_time': all_times,
         'avg_time': avg_time,
+        'p50_time': overall.percentile(50),
+        'p99_time': overall.percentile(99),
         'mem_hits': mem_hits,
         'redis_hits': redis_hits,
+        'derived_hits': derived_hits,
         'db_hits': db_hits,
-        'per_query': {q_name: {
-            'count': len(query_stats[q_name]),
-            'avg_time': sum(query_stats[q_name]) / len(query_stats[q_name]) if query_stats[q_name] else 0
-        } for q_name in query_stats}
+        'per_query': per_query,
     }
     if log_queue:
-        log_queue.put('__done__')
         # Send summary as a string
         summary_str = (
             f"--- {sim_label} ---\n"
-            f"Total queries: {TOTAL_QUERIES}\n"
+            f"Total queries: {total_queries}\n"
             f"Total time: {all_times:.2f} ms\n"
-            f"Average query time: {avg_time:.2f} ms\n"
-            f"Memory hits: {mem_hits} | Redis hits: {redis_hits} | DB hits: {db_hits}\n"
+            f"Average query time: {avg_time:.2f} ms (p50 {summary['p50_time']:.2f} ms, p99 {summary['p99_time']:.2f} ms)\n"
+            f"Memory hits: {mem_hits} | Redis hits: {redis_hits} | Derived hits: {derived_hits} | DB hits: {db_hits}\n"
         )
-        log_queue.put(f'__summary__{summary_str}')
-    cur.close()
-    conn.close()
+        log_queue.put({'type': 'summary', 'text': summary_str})
+        log_queue.put({'type': 'done'})
+    if with_cache:
+        refresher.close()
+        if snapshotter is not None:
+            snapshotter.close()
+        cache.close()
+    executor.close()
     return summary
 
 def format_simulation_summary(summary_cache, summary_nocache):
@@ -316,17 +1756,21 @@ def format_simulation_summary(summary_cache, summary_nocache):
     lines.append(f"{summary_cache['label']}")
     lines.append(f"  Total queries run: {summary_cache['total_queries']}")
     lines.append(f"  Total time taken: {summary_cache['total_time']:.2f} ms")
-    lines.append(f"  Average query time: {summary_cache['avg_time']:.2f} ms\n")
+    lines.append(f"  Average query time: {summary_cache['avg_time']:.2f} ms"
+                 f" (p50 {summary_cache['p50_time']:.2f} ms, p99 {summary_cache['p99_time']:.2f} ms)\n")
     for q_name, stats in summary_cache['per_query'].items():
-        lines.append(f"  - {q_name}: {stats['count']} queries, avg time {stats['avg_time']:.2f} ms")
+        lines.append(f"  - {q_name}: {stats['count']} queries, avg time {stats['avg_time']:.2f} ms,"
+                     f" p50 {stats['p50']:.2f} ms, p99 {stats['p99']:.2f} ms")
     lines.append("")
     # Without cache
     lines.append(f"{summary_nocache['label']}")
     lines.append(f"  Total queries run: {summary_nocache['total_queries']}")
     lines.append(f"  Total time taken: {summary_nocache['total_time']:.2f} ms")
-    lines.append(f"  Average query time: {summary_nocache['avg_time']:.2f} ms\n")
+    lines.append(f"  Average query time: {summary_nocache['avg_time']:.2f} ms"
+                 f" (p50 {summary_nocache['p50_time']:.2f} ms, p99 {summary_nocache['p99_time']:.2f} ms)\n")
     for q_name, stats in summary_nocache['per_query'].items():
-        lines.append(f"  - {q_name}: {stats['count']} queries, avg time {stats['avg_time']:.2f} ms")
+        lines.append(f"  - {q_name}: {stats['count']} queries, avg time {stats['avg_time']:.2f} ms,"
+                     f" p50 {stats['p50']:.2f} ms, p99 {stats['p99']:.2f} ms")
     lines.append("")
     # Performance comparison
     time_saved = summary_nocache['total_time'] - summary_cache['total_time']
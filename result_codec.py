@@ -0,0 +1,275 @@
+import pickle
+import struct
+import zlib
+from itertools import accumulate
+from array import array
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# === Result Codecs for the Redis Tier ===
+#
+# Every payload starts with a one-byte tag so values written by any codec can
+# be read back by decode():
+#   b'P'  pickle (fallback for anything the row format cannot represent)
+#   b'R'  columnar row format
+#   b'Z'  zlib-compressed columnar row format
+
+COMPRESS_THRESHOLD = 4096  # bytes of encoded body before zlib kicks in
+COMPRESS_LEVEL = 1
+MIN_ROWS = 16  # smaller results pickle just as compactly and faster
+
+TAG_PICKLE = b'P'
+TAG_ROWS = b'R'
+TAG_ROWS_ZLIB = b'Z'
+
+# Column kinds
+COL_NULL = b'n'
+COL_INT = b'q'
+COL_FLOAT = b'd'
+COL_BOOL = b'b'
+COL_DECIMAL = b'D'
+COL_TEXT = b's'
+COL_TEXT_DICT = b'S'
+COL_DATE = b't'
+COL_DATETIME = b'T'
+
+_HEADER = struct.Struct('<II')   # nrows, ncols
+_COLUMN = struct.Struct('<ccI')  # kind, has_nulls, payload length
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+_DATETIME_BASE = datetime(1970, 1, 1)
+# What a NULL slot holds in a Decimal or date column (the null mask says it
+# is NULL). Payloads written before these existed hold '' and ordinal 0,
+# which decoding also maps to None.
+_NULL_DECIMAL = '0'
+_NULL_ORDINAL = 1
+
+class UnsupportedColumn(Exception):
+    pass
+
+class PickleCodec:
+    name = 'pickle'
+
+    def encode(self, value):
+        return TAG_PICKLE + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, payload):
+        return decode(payload)
+
+class RowCodec:
+    """Compact columnar encoding for cursor.fetchall() results: a list of
+    equal-length tuples whose columns hold int, float, bool, Decimal, str,
+    date, naive datetime or None. Fixed-width columns are packed with
+    array, text and Decimal columns as one UTF-8 blob plus lengths. Bodies
+    above compress_threshold bytes are zlib-compressed. Results under
+    min_rows rows, and anything the format cannot represent, fall back to
+    pickle, so encode() accepts any value."""
+
+    name = 'rows'
+
+    def __init__(self, compress_threshold=COMPRESS_THRESHOLD, compress_level=COMPRESS_LEVEL, min_rows=MIN_ROWS):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.min_rows = min_rows
+
+    def encode(self, value):
+        if type(value) is LazyRows:
+            # Decoded from a row payload: reuse its body while still packed
+            view = value._view
+            if view is None:
+                value = value._rows
+            else:
+                return self._frame(bytes(view))
+        if type(value) is list and len(value) < self.min_rows:
+            return _PICKLE.encode(value)
+        try:
+            body = _encode_rows(value)
+        except UnsupportedColumn:
+            return _PICKLE.encode(value)
+        return self._frame(body)
+
+    def _frame(self, body):
+        if self.compress_threshold is not None and len(body) > self.compress_threshold:
+            return TAG_ROWS_ZLIB + zlib.compress(body, self.compress_level)
+        return TAG_ROWS + body
+
+    def decode(self, payload):
+        return decode(payload)
+
+def decode(payload):
+    """Decode a payload produced by any codec in this module. Row payloads
+    come back as LazyRows over a memoryview of the payload; columns are
+    only unpacked on first row access."""
+    view = memoryview(payload)
+    tag = bytes(view[:1])
+    if tag == TAG_ROWS:
+        return LazyRows(view[1:])
+    if tag == TAG_ROWS_ZLIB:
+        return LazyRows(memoryview(zlib.decompress(view[1:])))
+    if tag == TAG_PICKLE:
+        return pickle.loads(view[1:])
+    raise ValueError(f'unknown payload tag {tag!r}')
+
+_PICKLE = PickleCodec()
+CODECS = {codec.name: codec for codec in (_PICKLE, RowCodec())}
+
+# === Encoding ===
+
+_KINDS = {bool: COL_BOOL, int: COL_INT, float: COL_FLOAT, Decimal: COL_DECIMAL,
+          str: COL_TEXT, date: COL_DATE, datetime: COL_DATETIME}
+
+def _column_kind(values):
+    types = set(map(type, values))
+    types.discard(type(None))
+    if not types:
+        return COL_NULL
+    if len(types) > 1 or next(iter(types)) not in _KINDS:
+        raise UnsupportedColumn
+    kind = _KINDS[types.pop()]
+    present = [v for v in values if v is not None] if None in values else values
+    if kind == COL_INT and not (_INT64_MIN <= min(present) and max(present) <= _INT64_MAX):
+        raise UnsupportedColumn
+    if kind == COL_DATETIME and any(v.tzinfo is not None for v in present):
+        raise UnsupportedColumn
+    return kind
+
+def _encode_column(kind, values):
+    if kind == COL_NULL:
+        return b''
+    if kind == COL_INT:
+        return array('q', [0 if v is None else v for v in values]).tobytes()
+    if kind == COL_FLOAT:
+        return array('d', [0.0 if v is None else v for v in values]).tobytes()
+    if kind == COL_BOOL:
+        return bytes(bool(v) for v in values)
+    if kind == COL_DATE:
+        return array('i', [_NULL_ORDINAL if v is None else v.toordinal() for v in values]).tobytes()
+    if kind == COL_DATETIME:
+        return array('q', [0 if v is None else (v - _DATETIME_BASE) // timedelta(microseconds=1)
+                           for v in values]).tobytes()
+    if kind == COL_TEXT_DICT:
+        # Distinct values as a text column, then one uint16 index per row
+        index = {}
+        codes = array('H', [index.setdefault('' if v is None else v, len(index)) for v in values])
+        return _text_payload(list(index)) + codes.tobytes()
+    if kind == COL_DECIMAL:
+        return _text_payload([_NULL_DECIMAL if v is None else str(v) for v in values])
+    return _text_payload(['' if v is None else v for v in values])
+
+def _text_payload(texts):
+    # Count and blob size, character lengths, then one UTF-8 blob
+    blob = ''.join(texts).encode('utf-8')
+    return _HEADER.pack(len(texts), len(blob)) + array('I', map(len, texts)).tobytes() + blob
+
+def _encode_rows(rows):
+    if type(rows) is not list or not set(map(type, rows)) <= {tuple} or len(set(map(len, rows))) > 1:
+        raise UnsupportedColumn
+    ncols = len(rows[0]) if rows else 0
+    parts = [_HEADER.pack(len(rows), ncols)]
+    for values in zip(*rows):
+        kind = _column_kind(values)
+        # Low-cardinality text (status, category, city...) is dictionary-coded
+        if kind == COL_TEXT and len(values) >= 16 and len(set(values)) <= min(len(values) // 4, 0xFFFF):
+            kind = COL_TEXT_DICT
+        has_nulls = kind != COL_NULL and None in values
+        payload = _encode_column(kind, values)
+        parts.append(_COLUMN.pack(kind, b'\x01' if has_nulls else b'\x00', len(payload)))
+        if has_nulls:
+            parts.append(bytes(v is None for v in values))
+        parts.append(payload)
+    return b''.join(parts)
+
+# === Decoding ===
+
+def _decode_column(kind, view, nrows):
+    if kind == COL_NULL:
+        return [None] * nrows
+    if kind in (COL_INT, COL_FLOAT, COL_DATE, COL_DATETIME):
+        values = array({COL_INT: 'q', COL_FLOAT: 'd', COL_DATE: 'i', COL_DATETIME: 'q'}[kind])
+        values.frombytes(view)
+        if kind == COL_DATE:
+            distinct = set(values)
+            if len(distinct) * 2 > len(values) and 0 not in distinct:
+                return list(map(date.fromordinal, values))
+            # Large result sets repeat a handful of days; build each once
+            days = {o: date.fromordinal(o) if o else None for o in distinct}
+            return list(map(days.__getitem__, values))
+        if kind == COL_DATETIME:
+            return [_DATETIME_BASE + timedelta(microseconds=v) for v in values]
+        return values.tolist()
+    if kind == COL_BOOL:
+        return [b != 0 for b in view]
+    texts, end = _decode_text(view)
+    if kind == COL_TEXT_DICT:
+        codes = array('H')
+        codes.frombytes(view[end:])
+        return list(map(texts.__getitem__, codes))
+    if kind == COL_DECIMAL:
+        return [Decimal(t) if t else None for t in texts]
+    return texts
+
+def _decode_text(view):
+    count, blob_size = _HEADER.unpack_from(view)
+    start = _HEADER.size + 4 * count
+    end = start + blob_size
+    lengths = array('I')
+    lengths.frombytes(view[_HEADER.size:start])
+    ends = list(accumulate(lengths))
+    text = str(view[start:end], 'utf-8')
+    return [text[a:b] for a, b in zip([0] + ends, ends)], end
+
+class LazyRows:
+    """Read-only list of row tuples backed by an encoded row payload. len()
+    is answered from the header; the columns are unpacked (zero-copy from
+    the underlying memoryview where the type allows) on first row access."""
+
+    __slots__ = ('_view', '_len', '_rows')
+
+    def __init__(self, view):
+        self._view = view
+        self._len = _HEADER.unpack_from(view)[0]
+        self._rows = None
+
+    def _materialize(self):
+        if self._rows is None:
+            view = self._view
+            nrows, ncols = _HEADER.unpack_from(view)
+            offset = _HEADER.size
+            columns = []
+            for _ in range(ncols):
+                kind, has_nulls, size = _COLUMN.unpack_from(view, offset)
+                offset += _COLUMN.size
+                nulls = None
+                if has_nulls == b'\x01':
+                    nulls = view[offset:offset + nrows]
+                    offset += nrows
+                column = _decode_column(kind, view[offset:offset + size], nrows)
+                offset += size
+                if nulls is not None:
+                    column = [None if null else v for v, null in zip(column, nulls)]
+                columns.append(column)
+            self._rows = list(zip(*columns)) if ncols else [()] * nrows
+            self._view = None
+        return self._rows
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __eq__(self, other):
+        if isinstance(other, LazyRows):
+            other = other._materialize()
+        return self._materialize() == other
+
+    def __repr__(self):
+        return repr(self._materialize())
+
+    def __reduce__(self):
+        return (list, (self._materialize(),))
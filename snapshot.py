@@ -0,0 +1,173 @@
+import json
+import math
+import mmap
+import os
+import pickle
+import struct
+import threading
+
+# === Snapshot File Format ===
+#
+# A snapshot is the policy state of a cache plus its memory-tier hot set:
+#   magic    b'RLSNAP\x01\x00'
+#   header   <QQqQ  record count, blob offset, decay epoch, learner weights
+#   weights  float64 x learner weights (a LinearQLearner's, if any)
+#   records  fixed-width, one per key, hottest first: memory-resident keys
+#            by eviction priority, then ghost records by recency
+#   blob     JSON keys and codec-encoded values the records point into
+# Fixed-width records let restore mmap the file and read only the first
+# `limit` of them, so a partial (or fast) restore never touches the rest.
+
+SNAPSHOT_MAGIC = b'RLSNAP\x01\x00'
+SNAPSHOT_INTERVAL = 30.0  # seconds between periodic snapshots
+_HEADER = struct.Struct('<QQqQ')
+# q_cache, q_evict, epoch, hits, freshness, loaded_at, cost, size,
+# key offset, key length, value offset, value length, resident
+_RECORD = struct.Struct('<ddqqdddqQIQIB')
+_NONE = float('nan')
+
+def _shards(cache):
+    return getattr(cache, 'shards', [cache])
+
+def _fields(meta):
+    return (meta.q_cache, meta.q_evict, meta.epoch, meta.hits, meta.freshness,
+            _NONE if meta.loaded_at is None else meta.loaded_at,
+            _NONE if meta.cost is None else meta.cost,
+            -1 if meta.size is None else meta.size)
+
+def capture(cache):
+    """Copies each shard's records and memory-resident values under its
+    lock (no encoding or I/O there) and returns them hottest first as
+    (key, fields, value, codec), value None for ghost records."""
+    resident, ghosts = [], []
+    for shard in _shards(cache):
+        with shard.lock:
+            priority = shard.memory_heap.priority
+            resident.extend((priority[key], key, _fields(meta), shard.memory_cache[key], shard.codec)
+                            for key, meta in shard.entries.items())
+            # Ghosts by LRU position, most recent first, interleaved across shards
+            ghosts.extend((-rank, key, _fields(meta), None, None)
+                          for rank, (key, meta) in enumerate(reversed(shard.ghosts.items())))
+    resident.sort(key=lambda item: item[0], reverse=True)
+    ghosts.sort(key=lambda item: item[0], reverse=True)
+    return [item[1:] for item in resident + ghosts]
+
+# A key JSON cannot represent, or a value the codec cannot encode
+_UNENCODABLE = (TypeError, ValueError, AttributeError, pickle.PickleError)
+
+def write_snapshot(cache, path):
+    """Writes a snapshot of cache to path atomically (a temporary file
+    renamed over it). Records whose key is not JSON-serialisable, or whose
+    value the codec cannot encode, are left out. Returns the number of
+    records written."""
+    items = capture(cache)
+    learner = getattr(_shards(cache)[0], 'learner', None)
+    weights = learner.weights.tobytes() if learner is not None else b''
+    blob = bytearray()
+    records = bytearray()
+    count = 0
+    for key, fields, value, codec in items:
+        try:
+            key_bytes = json.dumps(key).encode()
+            payload = codec.encode(value) if value is not None else b''
+        except _UNENCODABLE:
+            continue
+        key_offset = len(blob)
+        blob += key_bytes
+        value_offset = len(blob)
+        blob += payload
+        records += _RECORD.pack(*fields, key_offset, len(key_bytes), value_offset, len(payload), value is not None)
+        count += 1
+    blob_offset = len(SNAPSHOT_MAGIC) + _HEADER.size + len(weights) + len(records)
+    epoch = cache.decay_epoch
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + _HEADER.pack(count, blob_offset, epoch, len(weights) // 8))
+        f.write(weights)
+        f.write(records)
+        f.write(blob)
+    os.replace(tmp, path)
+    return count
+
+def _key(data):
+    key = json.loads(data)
+    return tuple(key) if type(key) is list else key
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+def restore_snapshot(cache, path, limit=None):
+    """Loads the first limit records (all by default) of the snapshot at
+    path into a freshly built cache: the decay clock, learner weights,
+    every key's policy record, and memory-tier values for the keys that
+    were resident, as far as the current capacity and byte budget allow.
+    Returns (records, resident values) restored, or (0, 0) without a
+    snapshot file. Values are trusted as they were saved; staleness bounds
+    still apply through the saved load times."""
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a cache snapshot')
+        offset = len(SNAPSHOT_MAGIC)
+        count, blob_offset, epoch, n_weights = _HEADER.unpack_from(mm, offset)
+        offset += _HEADER.size
+        learner = getattr(_shards(cache)[0], 'learner', None)
+        if learner is not None and n_weights == learner.weights.size:
+            learner.weights.flat[:] = struct.unpack_from(f'<{n_weights}d', mm, offset)
+        offset += 8 * n_weights
+        # Saved Q-values are aged relative to the saved epoch
+        cache.clock.epoch = max(cache.clock.epoch, epoch)
+        if limit is not None:
+            count = min(count, limit)
+        restored = resident = 0
+        for record in _RECORD.iter_unpack(mm[offset:offset + count * _RECORD.size]):
+            (q_cache, q_evict, meta_epoch, hits, freshness, loaded_at, cost, size,
+             key_offset, key_length, value_offset, value_length, is_resident) = record
+            start = blob_offset + key_offset
+            key = _key(mm[start:start + key_length])
+            value = None
+            if is_resident:
+                start = blob_offset + value_offset
+                value = _shards(cache)[0].codec.decode(mm[start:start + value_length])
+            fields = (q_cache, q_evict, meta_epoch, hits, freshness, _optional(loaded_at), _optional(cost),
+                      None if size < 0 else size)
+            tier = cache.restore_entry(key, fields, value)
+            restored += tier is not None
+            resident += tier == 'memory'
+        return restored, resident
+
+class Snapshotter:
+    """Background thread writing a snapshot of cache to path every
+    interval seconds, and once more on close(). Requests only wait for
+    the in-memory copy taken under each shard's lock; encoding and file
+    I/O run on this thread. A failed snapshot is counted in failures (the
+    exception kept in last_error) and the thread carries on."""
+
+    def __init__(self, cache, path, interval=SNAPSHOT_INTERVAL):
+        self.cache = cache
+        self.path = path
+        self.interval = interval
+        self.snapshots = 0
+        self.failures = 0
+        self.last_error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def snapshot(self):
+        try:
+            write_snapshot(self.cache, self.path)
+            self.snapshots += 1
+        except Exception as exc:
+            self.failures += 1
+            self.last_error = exc
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.snapshot()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.snapshot()
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def redis_client():
+    client = fakeredis.FakeStrictRedis()
+    yield client
+    client.flushall()
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces time.time() with a counter that advances one second per
+    call, so freshness stamps are distinct and reproducible."""
+    now = [1_000_000.0]
+
+    def tick():
+        now[0] += 1.0
+        return now[0]
+    monkeypatch.setattr('time.time', tick)
+    return now
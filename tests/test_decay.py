@@ -0,0 +1,92 @@
+import random
+import time
+from collections import defaultdict
+
+from policy_sim import LocalTier, SizeCodec
+from redis_rl_cache_simulation import MultiLevelRLCache
+
+DECAY_RATE = 0.9
+MEM_CAPACITY = 8
+MISS_REWARD = -3
+
+def hit_reward(key):
+    # Some keys are penalised for hits, so the policy also learns to evict
+    return (7, 1, -2)[key[1] % 3]
+
+class EagerReference:
+    """The original scheme: a nested-dict Q-table swept on every decay
+    step, and a linear scan for the memory-tier victim."""
+
+    def __init__(self, capacity, alpha=0.3, decay_rate=DECAY_RATE):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.decay_rate = decay_rate
+        self.q_table = defaultdict(lambda: defaultdict(float))
+        self.freshness = {}
+        self.memory = set()
+
+    def update_q_value(self, key, action, reward):
+        self.q_table[key][action] += self.alpha * (reward - self.q_table[key][action])
+
+    def decay_q_table(self):
+        for state in self.q_table:
+            for action in self.q_table[state]:
+                self.q_table[state][action] *= self.decay_rate
+
+    def serve(self, key):
+        self.freshness[key] = time.time()
+        action = "evict" if self.q_table[key]["evict"] > self.q_table[key]["cache"] else "cache"
+        victim = None
+        if action == "cache" and key in self.memory:
+            self.update_q_value(key, "cache", hit_reward(key))
+        else:
+            if key not in self.memory:
+                if len(self.memory) >= self.capacity:
+                    victim = min(self.memory, key=lambda k: (self.q_table[k]["cache"], self.freshness[k]))
+                    self.memory.remove(victim)
+                self.memory.add(key)
+            self.update_q_value(key, "evict", MISS_REWARD)
+        self.decay_q_table()
+        return action, victim
+
+class RecordingCache(MultiLevelRLCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.actions = []
+
+    def _choose_action(self, key, meta):
+        action = super()._choose_action(key, meta)
+        self.actions.append(action)
+        return action
+
+def serve(cache, key):
+    value, _ = cache.get(key)
+    if value:
+        cache.update_q_value(key, "cache", hit_reward(key))
+    else:
+        cache.load(key, lambda: 1)  # a one-byte result under SizeCodec
+        cache.update_q_value(key, "evict", MISS_REWARD)
+    cache.decay_q_table()
+
+def _trace(n, seed=7, keys=40):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, keys + 1)]
+    return [rng.choices(range(keys), weights)[0] for _ in range(n)]
+
+def test_lazy_decay_matches_eager_sweep(clock):
+    reference = EagerReference(MEM_CAPACITY)
+    cache = RecordingCache(MEM_CAPACITY, 0, None, epsilon=0, decay_rate=DECAY_RATE, codec=SizeCodec(),
+                           redis_tier=LocalTier(0), ghost_capacity=10 ** 6)
+    expected_actions, expected_victims, victims = [], [], []
+    for key_id in _trace(3000):
+        action, victim = reference.serve(('q', key_id))
+        expected_actions.append(action)
+        expected_victims.append(victim)
+        before = set(cache.memory_cache)
+        serve(cache, ('q', key_id))
+        evicted = before - set(cache.memory_cache)
+        victims.append(evicted.pop() if evicted else None)
+    assert cache.actions == expected_actions
+    assert victims == expected_victims
+    assert set(cache.memory_cache) == reference.memory
+    assert any(victims) and 'evict' in expected_actions
@@ -0,0 +1,53 @@
+from datetime import date
+
+import pytest
+
+from redis_rl_cache_simulation import (DERIVED_TEMPLATES, MultiLevelRLCache, daily_sales_from_base,
+                                       running_total_from_base, serve_query)
+
+# (order_date, quantity) rows of one product; most days have several
+# orders, so the running total has peer rows sharing a day
+ORDERS = [(date(2024, 5, 1 + i % 20), 1 + i % 7) for i in range(75)]
+
+def _daily_sales_base(orders):
+    # SELECT order_date, SUM(quantity), COUNT(*) ... GROUP BY order_date ORDER BY order_date
+    days = {}
+    for day, quantity in orders:
+        units, count = days.get(day, (0, 0))
+        days[day] = (units + quantity, count + 1)
+    return [(day, units, count) for day, (units, count) in sorted(days.items())]
+
+def _daily_sales(orders):
+    # SELECT order_date, SUM(quantity) ... GROUP BY order_date ORDER BY order_date
+    return [(day, units) for day, units, _ in _daily_sales_base(orders)]
+
+def _running_total(orders):
+    # SELECT order_date, SUM(quantity) OVER (ORDER BY order_date) ... ORDER BY order_date:
+    # the default RANGE frame runs through the last peer of each row's day
+    return [(day, sum(q for d, q in orders if d <= day)) for day, _ in sorted(orders)]
+
+class StubExecutor:
+    def __init__(self, orders):
+        self.orders = orders
+        self.calls = []
+
+    def execute(self, q_name, params):
+        self.calls.append(q_name)
+        return {'daily_sales_base': _daily_sales_base, 'daily_sales_product': _daily_sales,
+                'running_total_sales_product': _running_total}[q_name](self.orders)
+
+@pytest.mark.parametrize('orders', [ORDERS, ORDERS[:1], [ORDERS[0]] * 3, []],
+                         ids=['month', 'one order', 'one day', 'empty'])
+def test_derivations_match_the_sql(orders):
+    base = _daily_sales_base(orders)
+    assert daily_sales_from_base(base, (1,)) == _daily_sales(orders)
+    assert running_total_from_base(base, (1,)) == _running_total(orders)
+
+def test_serve_query_derives_from_the_cached_base(redis_client):
+    cache = MultiLevelRLCache(10, 50, redis_client, epsilon=0, namespace='test')
+    executor = StubExecutor(ORDERS)
+    for q_name in ('daily_sales_product', 'running_total_sales_product', 'daily_sales_product'):
+        result, level = serve_query(cache, executor, q_name, (1,), DERIVED_TEMPLATES)
+        assert result == executor.execute(q_name, (1,))
+    assert executor.calls.count('daily_sales_base') == 1
+    assert level == 'derived'
@@ -0,0 +1,32 @@
+import threading
+
+import numpy as np
+
+from feature_learner import N_FEATURES, TEMPLATE_SLOTS, LinearQLearner
+from redis_rl_cache_simulation import CacheEntry
+
+def test_concurrent_new_templates_get_distinct_slots():
+    learner = LinearQLearner()
+    templates = [f't{i}' for i in range(TEMPLATE_SLOTS - 1)]
+    start = threading.Barrier(len(templates))
+    slots = {}
+
+    def claim(template):
+        start.wait()
+        x = learner.features((template, 1), CacheEntry(0), 0)
+        slots[template] = int(np.argmax(x[:TEMPLATE_SLOTS]))
+    threads = [threading.Thread(target=claim, args=(t,)) for t in templates]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(slots.values()) == list(range(TEMPLATE_SLOTS - 1))
+    assert learner.templates == slots
+
+def test_templates_beyond_the_slots_share_the_last_one():
+    learner = LinearQLearner()
+    for i in range(TEMPLATE_SLOTS + 4):
+        x = learner.features((f't{i}', 1), CacheEntry(0), 0)
+        assert x.shape == (N_FEATURES,)
+        assert int(np.argmax(x[:TEMPLATE_SLOTS])) == min(i, TEMPLATE_SLOTS - 1)
+    assert len(learner.templates) == TEMPLATE_SLOTS - 1
@@ -0,0 +1,51 @@
+from redis_rl_cache_simulation import MultiLevelRLCache
+
+def _cache(redis_client, capacity=2, **kwargs):
+    return MultiLevelRLCache(capacity, 10, redis_client, epsilon=0, eviction_policy='gdsf', namespace='test',
+                             **kwargs)
+
+def _assert_consistent(cache):
+    assert set(cache.memory_cache) == set(cache.entries) == set(cache.memory_heap.priority)
+    assert cache.memory_bytes == sum(meta.size for meta in cache.entries.values())
+
+def test_resize_reprioritises_the_key(redis_client, clock):
+    cache = _cache(redis_client)
+    cache.put('a', 'x' * 10)
+    cache.put('b', 'x' * 10)
+    cache.get('b')
+    cache.get('a')  # same hits and size: b, touched first, would go first
+    cache.put('a', 'x' * 1000)  # now a saves far less per byte
+    assert cache.memory_heap.priority['a'] == cache._memory_priority(cache.entries['a'])
+    _assert_consistent(cache)
+    cache.get('c')
+    cache.put('c', 'x' * 10)
+    assert set(cache.memory_cache) == {'b', 'c'}
+    _assert_consistent(cache)
+
+def test_admission_rejects_below_the_cheapest_resident(redis_client, clock):
+    cache = _cache(redis_client)
+    for key in ('a', 'b'):
+        cache.put(key, 'x' * 10)
+        cache.get(key)
+    cache.put('c', 'x' * 10)  # never requested: scores below both residents
+    assert cache.memory_rejections == 1
+    assert set(cache.memory_cache) == {'a', 'b'}
+    assert cache.redis_tier.get('c') is not None
+    _assert_consistent(cache)
+
+def test_byte_budget_accounting(redis_client, clock):
+    cache = _cache(redis_client, capacity=10, mem_budget_bytes=200)
+    for key in 'abc':
+        cache.get(key)
+        cache.put(key, 'x' * 40)
+    _assert_consistent(cache)
+    cache.put('a', 'x' * 10)
+    _assert_consistent(cache)
+    cache.put('big', 'x' * 500)  # larger than the whole budget
+    assert 'big' not in cache.memory_cache
+    for _ in range(4):
+        cache.get('d')
+    cache.put('d', 'x' * 120)  # only fits once something is evicted
+    assert 'd' in cache.memory_cache
+    assert cache.memory_bytes <= 200
+    _assert_consistent(cache)
@@ -0,0 +1,37 @@
+from redis_rl_cache_simulation import MultiLevelRLCache
+
+KEY = ('top_rated_products_category', 'Laptops')  # reads products, filtered on category
+
+def _cache(redis_client):
+    return MultiLevelRLCache(10, 10, redis_client, epsilon=0, namespace='test')
+
+def _loader(cache, table, row):
+    def load():
+        cache.invalidate(table, row)  # a write lands while the query runs
+        return [('ThinkPad', 4.8)]
+    return load
+
+def test_unrelated_invalidation_keeps_the_load(redis_client):
+    cache = _cache(redis_client)
+    cache.load(KEY, _loader(cache, 'orders', {'product_id': 3, 'user_id': 1}))
+    assert KEY in cache.memory_cache
+    assert cache.redis_tier.get(KEY) is not None
+    assert not cache.tag_generations
+
+def test_other_row_of_the_same_table_keeps_the_load(redis_client):
+    cache = _cache(redis_client)
+    cache.load(KEY, _loader(cache, 'products', {'category': 'Mobiles'}))
+    assert KEY in cache.memory_cache
+
+def test_overlapping_invalidation_discards_the_load(redis_client):
+    cache = _cache(redis_client)
+    result, _ = cache.load(KEY, _loader(cache, 'products', {'category': 'Laptops'}))
+    assert result == [('ThinkPad', 4.8)]  # the caller still gets its answer
+    assert KEY not in cache.memory_cache
+    assert cache.redis_tier.get(KEY) is None
+    assert not cache.tag_generations
+
+def test_table_wide_invalidation_discards_the_load(redis_client):
+    cache = _cache(redis_client)
+    cache.load(KEY, _loader(cache, 'products', None))
+    assert KEY not in cache.memory_cache
@@ -0,0 +1,68 @@
+from redis_rl_cache_simulation import RedisTier
+
+def _members(tier):
+    return {m.decode()[len(tier.value_prefix):] for m in tier.client.zrange(tier.scores_key, 0, -1)}
+
+def _assert_consistent(tier):
+    members = tier.client.zrange(tier.scores_key, 0, -1)
+    sizes = {k: int(v) for k, v in tier.client.hgetall(tier.sizes_key).items()}
+    assert set(sizes) == set(members)
+    assert tier.used_bytes() == sum(sizes.values())
+    assert all(tier.client.strlen(m) == sizes[m] for m in members)
+
+def test_evicts_lowest_scores_first(redis_client):
+    tier = RedisTier(redis_client, capacity=4, namespace='test')
+    for i, score in enumerate([5, 1, 9, 3, 7, 2, 8]):
+        tier.put(i, b'x' * (i + 1), score)
+    # Scores 9, 8, 7, 5 survive; 1, 3 and 2 went in that order as each put overflowed
+    assert _members(tier) == {'2', '6', '4', '0'}
+    assert tier.evictions == 3
+    assert len(tier) == 4
+    _assert_consistent(tier)
+
+def test_rescore_changes_the_victim(redis_client):
+    tier = RedisTier(redis_client, capacity=2, namespace='test')
+    tier.put('a', b'1', 1)
+    tier.put('b', b'2', 2)
+    tier.update_score('a', 10)
+    tier.put('c', b'3', 3)
+    assert _members(tier) == {"'a'", "'c'"}
+    _assert_consistent(tier)
+
+def test_byte_budget_evicts_until_it_fits(redis_client):
+    tier = RedisTier(redis_client, capacity=100, namespace='test', budget_bytes=10)
+    tier.put('a', b'x' * 4, 1)
+    tier.put('b', b'x' * 4, 2)
+    tier.put('a', b'x' * 2, 5)  # a resize keeps the entry and fixes the byte total
+    _assert_consistent(tier)
+    assert tier.used_bytes() == 6
+    tier.put('c', b'x' * 7, 3)  # 13 bytes: dropping b (the lowest score) is enough
+    assert _members(tier) == {"'a'", "'c'"}
+    assert tier.used_bytes() == 9
+    tier.put('d', b'x' * 9, 4)  # drops c (score 3), then a (score 5)
+    assert _members(tier) == {"'d'"}
+    assert tier.evictions == 3
+    _assert_consistent(tier)
+    assert not tier.put('e', b'x' * 11, 100)  # bigger than the whole budget
+    _assert_consistent(tier)
+
+def test_admission_turns_away_low_scores_when_full(redis_client):
+    tier = RedisTier(redis_client, capacity=2, namespace='test', admission=True)
+    tier.put('a', b'1', 5)
+    tier.put('b', b'2', 6)
+    assert not tier.put('c', b'3', 1)
+    assert tier.rejections == 1
+    assert tier.put('d', b'4', 9)
+    assert _members(tier) == {"'b'", "'d'"}
+    _assert_consistent(tier)
+
+def test_delete_and_clear_keep_accounting(redis_client):
+    tier = RedisTier(redis_client, capacity=10, namespace='test')
+    for i in range(5):
+        tier.put(i, b'x' * 3, i)
+    assert tier.delete(2) and not tier.delete(2)
+    _assert_consistent(tier)
+    assert tier.used_bytes() == 12
+    tier.clear()
+    assert len(tier) == 0 and tier.used_bytes() == 0
+    assert not redis_client.keys('{test}:*')
@@ -0,0 +1,40 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import result_codec
+from result_codec import TAG_PICKLE, TAG_ROWS, TAG_ROWS_ZLIB, CODECS, RowCodec
+
+def _row(i):
+    # Every column kind, each NULL on every third row; column 5 is
+    # low-cardinality text (dictionary-coded), the last one is all NULL
+    values = (i, i * 0.5, i % 2 == 0, Decimal(f'{i}.25'), f'name {i}', f'city {i % 3}',
+              date(2024, 1, 1 + i % 28), datetime(2024, 1, 1, i % 24, i % 60, 0, i), None)
+    return tuple(None if (i + col) % 3 == 0 else v for col, v in enumerate(values[:-1])) + (None,)
+
+ROWS = [_row(i) for i in range(40)]
+
+@pytest.mark.parametrize('rows', [ROWS, ROWS[:5]], ids=['columnar', 'pickled'])
+@pytest.mark.parametrize('codec', sorted(CODECS))
+def test_nulls_round_trip_in_every_column_kind(codec, rows):
+    payload = CODECS[codec].encode(rows)
+    if codec == 'rows' and len(rows) >= result_codec.MIN_ROWS:
+        assert payload[:1] in (TAG_ROWS, TAG_ROWS_ZLIB)
+    else:
+        assert payload[:1] == TAG_PICKLE
+    assert list(result_codec.decode(payload)) == rows
+
+def test_compressed_payloads_keep_nulls():
+    codec = RowCodec(compress_threshold=0)
+    payload = codec.encode(ROWS)
+    assert payload[:1] == TAG_ROWS_ZLIB
+    assert list(codec.decode(payload)) == ROWS
+
+def test_payloads_with_the_old_null_placeholders_still_decode(monkeypatch):
+    # Earlier versions wrote '' and ordinal 0 under NULL Decimals and dates
+    monkeypatch.setattr(result_codec, '_NULL_DECIMAL', '')
+    monkeypatch.setattr(result_codec, '_NULL_ORDINAL', 0)
+    payload = RowCodec().encode(ROWS)
+    monkeypatch.undo()
+    assert list(result_codec.decode(payload)) == ROWS
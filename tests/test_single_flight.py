@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from redis_rl_cache_simulation import MultiLevelRLCache, SingleFlight
+
+CALLERS = 8
+
+def _run_together(call):
+    results = [None] * CALLERS
+
+    def run(i):
+        try:
+            results[i] = call()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        _wait_for(lambda: flight.followers == CALLERS - 1)  # everyone else has joined
+        return 'rows'
+    results = _run_together(lambda: flight.do('k', fn))
+    assert len(calls) == 1
+    assert sorted(leader for _, leader in results) == [False] * (CALLERS - 1) + [True]
+    assert all(result == 'rows' for result, _ in results)
+    assert (flight.leaders, flight.followers, flight.flights) == (1, CALLERS - 1, {})
+
+def test_loader_errors_reach_every_follower():
+    flight = SingleFlight()
+    error = RuntimeError('db down')
+
+    def fn():
+        _wait_for(lambda: flight.followers == CALLERS - 1)
+        raise error
+    assert all(result is error for result in _run_together(lambda: flight.do('k', fn)))
+    assert flight.flights == {}
+    assert flight.do('k', lambda: 'rows') == ('rows', True)  # a later miss runs again
+
+def _lease_cache(client):
+    # One cache per simulated process, sharing one Redis namespace
+    return MultiLevelRLCache(4, 50, client, epsilon=0, namespace='test', lease_coalescing=True, lease_ttl_ms=500)
+
+def test_lease_follower_takes_the_leaders_value(redis_client):
+    leader, follower = _lease_cache(redis_client), _lease_cache(redis_client)
+    started = threading.Event()
+
+    def slow_query():
+        started.set()
+        time.sleep(0.05)
+        return [('rows',)]
+    thread = threading.Thread(target=leader.load, args=(('t', 1), slow_query))
+    thread.start()
+    started.wait()
+    result, is_leader = follower.load(('t', 1), pytest.fail)
+    thread.join()
+    assert (list(result), is_leader) == ([('rows',)], False)
+    assert follower.coalescing_stats()['lease_coalesced'] == 1
+    assert leader.coalescing_stats() == {'loads': 1, 'coalesced': 0, 'lease_coalesced': 0, 'db_calls_saved': 0}
+
+def test_lease_follower_does_not_count_a_value_the_leader_never_wrote(redis_client):
+    cache = _lease_cache(redis_client)
+    cache.put(('t', 1), [('earlier',)])
+    cache.redis_tier.acquire_lease(('t', 1), 'holder', 500)
+    # The holder's query fails: it releases without publishing
+    threading.Timer(0.05, cache.redis_tier.release_lease, (('t', 1), 'holder')).start()
+    assert cache.load(('t', 1), lambda: [('own',)]) == ([('own',)], True)
+    assert cache.coalescing_stats()['lease_coalesced'] == 0
+
+def test_lease_leader_errors_release_the_lease(redis_client):
+    cache = _lease_cache(redis_client)
+
+    def failing_query():
+        raise RuntimeError('db down')
+    with pytest.raises(RuntimeError):
+        cache.load(('t', 1), failing_query)
+    assert cache.redis_tier.lease_holder(('t', 1)) is None
+    assert cache.redis_tier.lease_publisher(('t', 1)) is None
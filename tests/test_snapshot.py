@@ -0,0 +1,97 @@
+import time
+
+import snapshot
+from redis_rl_cache_simulation import MultiLevelRLCache, ShardedRLCache
+from result_codec import TAG_ROWS, LazyRows, RowCodec
+
+ROWS = [(day, day * 3, f'city {day % 4}') for day in range(40)]
+
+def _fill(cache, keys=30):
+    for i in range(keys):
+        key = ('t', i)
+        cache.put(key, ROWS, cost=float(i))
+        for _ in range(i % 5):
+            cache.get(key)
+            cache.update_q_value(key, 'cache', 7)
+            cache.decay_q_table()
+
+def test_round_trip(redis_client, tmp_path):
+    path = str(tmp_path / 'cache.snapshot')
+    source = ShardedRLCache(8, 40, redis_client, shards=4, epsilon=0, namespace='a')
+    _fill(source)
+    assert snapshot.write_snapshot(source, path) == 30
+    target = ShardedRLCache(8, 40, redis_client, shards=4, epsilon=0, namespace='b')
+    assert snapshot.restore_snapshot(target, path) == (30, 8)
+    assert target.decay_epoch == source.decay_epoch
+    for old, new in zip(source.shards, target.shards):
+        assert set(new.memory_cache) == set(old.memory_cache)
+        assert list(new.ghosts) == list(old.ghosts)
+        for key in old.memory_cache:
+            assert list(new.memory_cache[key]) == ROWS
+
+def test_partial_restore_takes_the_hottest_keys(redis_client, tmp_path):
+    path = str(tmp_path / 'cache.snapshot')
+    source = MultiLevelRLCache(8, 40, redis_client, epsilon=0, namespace='a')
+    _fill(source)
+    snapshot.write_snapshot(source, path)
+    target = MultiLevelRLCache(8, 40, redis_client, epsilon=0, namespace='b')
+    assert snapshot.restore_snapshot(target, path, limit=3) == (3, 3)
+    hottest = sorted(source.memory_cache, key=source.memory_heap.priority.get, reverse=True)[:3]
+    assert set(target.memory_cache) == set(hottest)
+
+def test_lazy_rows_keep_the_row_encoding():
+    codec = RowCodec()
+    payload = codec.encode(ROWS)
+    lazy = codec.decode(payload)
+    assert type(lazy) is LazyRows
+    assert codec.encode(lazy) == payload
+    assert lazy[0] == ROWS[0]  # unpacked rows encode the same too
+    assert codec.encode(lazy) == payload
+
+def test_promoted_values_are_saved_as_rows(redis_client, tmp_path):
+    path = str(tmp_path / 'cache.snapshot')
+    writer = MultiLevelRLCache(8, 40, redis_client, epsilon=0, namespace='a')
+    writer.put(('t', 1), ROWS)
+    reader = MultiLevelRLCache(8, 40, redis_client, epsilon=0, namespace='a')
+    for _ in range(6):
+        reader.get(('t', 1))  # the sixth hit promotes the Redis value
+    assert type(reader.memory_cache[('t', 1)]) is LazyRows
+    written = []
+    reader.codec = RecordingCodec(written)
+    snapshot.write_snapshot(reader, path)
+    assert written and all(payload[:1] == TAG_ROWS for payload in written)
+
+class RecordingCodec(RowCodec):
+    def __init__(self, written):
+        super().__init__()
+        self.written = written
+
+    def encode(self, value):
+        payload = super().encode(value)
+        self.written.append(payload)
+        return payload
+
+def test_unencodable_records_are_skipped(redis_client, tmp_path):
+    path = str(tmp_path / 'cache.snapshot')
+    cache = MultiLevelRLCache(8, 40, redis_client, epsilon=0, namespace='a')
+    cache.put(('t', 1), ROWS)
+    cache.put(('t', frozenset({2})), ROWS)  # JSON has no sets
+    assert snapshot.write_snapshot(cache, path) == 1
+    target = MultiLevelRLCache(8, 40, redis_client, epsilon=0, namespace='b')
+    assert snapshot.restore_snapshot(target, path) == (1, 1)
+
+def test_snapshotter_counts_failures_and_keeps_running(monkeypatch, tmp_path):
+    results = iter([TypeError('not JSON'), OSError('disk full')])
+
+    def write(cache, path):
+        error = next(results, None)
+        if error is not None:
+            raise error
+    monkeypatch.setattr(snapshot, 'write_snapshot', write)
+    snapshotter = snapshot.Snapshotter(None, str(tmp_path / 'cache.snapshot'), interval=0.01)
+    while snapshotter.snapshots == 0:
+        time.sleep(0.01)
+    snapshotter.close()
+    assert snapshotter.failures == 2
+    assert isinstance(snapshotter.last_error, OSError)
+    assert not snapshotter.thread.is_alive()
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from policy_sim import LocalTier
+from redis_rl_cache_simulation import MultiLevelRLCache
+
+BOUNDS = {'t': 0.05}
+
+def _cache(client, **kwargs):
+    return MultiLevelRLCache(1, 50, client, epsilon=0, namespace='test', staleness_bounds=BOUNDS, **kwargs)
+
+def test_redis_value_expires_after_its_record_is_forgotten(redis_client):
+    cache = _cache(redis_client, ghost_capacity=3)
+    cache.put(('t', 1), [('old',)])
+    for i in range(6):
+        cache.put(('u', i), [(i,)])  # pushes ('t', 1) out of memory and out of the ghost records
+    assert cache.metadata(('t', 1)) is None
+    time.sleep(0.1)
+    assert cache.get(('t', 1)) == (None, None)
+    assert cache.redis_tier.get(('t', 1)) is None
+
+def test_value_written_by_another_process_expires(redis_client):
+    writer, reader = _cache(redis_client), _cache(redis_client)
+    writer.put(('t', 1), [('old',)])
+    assert reader.get(('t', 1)) == ([('old',)], 'redis')
+    time.sleep(0.1)
+    assert reader.get(('t', 1)) == (None, None)
+
+def test_unbounded_templates_do_not_expire(redis_client):
+    cache = _cache(redis_client)
+    cache.put(('u', 1), [(1,)])
+    assert cache.redis_tier.ttl_ms(('u', 1)) is None
+
+def test_expired_values_leave_the_tier_accounting(redis_client):
+    cache = _cache(redis_client)
+    cache.put(('t', 1), [('old',)])
+    time.sleep(0.1)
+    cache.put(('u', 1), [(1,)])
+    assert len(cache.redis_tier) == 1
+    assert cache.redis_tier.used_bytes() == len(cache.codec.encode([(1,)]))
+
+def test_promoted_value_keeps_its_redis_deadline(redis_client):
+    writer, reader = _cache(redis_client), _cache(redis_client)
+    writer.put(('t', 1), [('old',)])
+    for _ in range(6):
+        value, level = reader.get(('t', 1))  # the sixth hit promotes it to memory
+    assert ('t', 1) in reader.memory_cache
+    time.sleep(0.1)
+    assert reader.get(('t', 1)) == (None, None)
+    assert reader.stale_misses == 1
+
+def test_local_tier_expires_values():
+    cache = MultiLevelRLCache(1, 50, None, epsilon=0, staleness_bounds=BOUNDS, redis_tier=LocalTier(50),
+                              ghost_capacity=3)
+    cache.put(('t', 1), [('old',)])
+    for i in range(6):
+        cache.put(('u', i), [(i,)])
+    time.sleep(0.1)
+    assert cache.get(('t', 1)) == (None, None)
+    assert len(cache.redis_tier) == 6
+
+def _lease_cache(client):
+    return MultiLevelRLCache(1, 50, client, epsilon=0, namespace='test', staleness_bounds={'t': 10},
+                             lease_coalescing=True, lease_ttl_ms=200)
+
+def _make_stale(cache, key):
+    cache.put(key, [('old',)])
+    cache.metadata(key).loaded_at -= 60
+
+def test_lease_follower_ignores_the_stale_value(redis_client):
+    cache = _lease_cache(redis_client)
+    _make_stale(cache, ('t', 1))
+    cache.redis_tier.acquire_lease(('t', 1), 'other process', 200)
+    assert cache.load(('t', 1), lambda: [('new',)]) == ([('new',)], True)
+
+def test_lease_follower_takes_the_holders_new_value(redis_client):
+    cache, holder = _lease_cache(redis_client), _lease_cache(redis_client)
+    _make_stale(cache, ('t', 1))
+    holder.redis_tier.acquire_lease(('t', 1), 'holder', 200)
+
+    def publish():
+        holder.put(('t', 1), [('new',)])
+        holder.redis_tier.release_lease(('t', 1), 'holder', published=True)
+    threading.Timer(0.05, publish).start()
+    assert cache.load(('t', 1), lambda: [('db',)]) == ([('new',)], False)
+
+def test_refresh_candidates_rank_by_hits_times_cost(redis_client):
+    cache = MultiLevelRLCache(10, 50, redis_client, epsilon=0, namespace='test', staleness_bounds={'t': 1.0})
+    now = time.time()
+    for key, q_cache, hits, cost in ((('t', 'decayed'), 1e-30, 50, 10.0), (('t', 'recent'), 5.0, 2, 10.0),
+                                     (('t', 'evicted'), -1.0, 90, 10.0)):
+        cache.put(key, [(1,)], cost=cost)
+        meta = cache.metadata(key)
+        meta.q_cache, meta.hits, meta.loaded_at, meta.freshness = q_cache, hits, now - 0.9, now
+    assert cache.refresh_candidates(limit=3) == [('t', 'decayed'), ('t', 'recent')]
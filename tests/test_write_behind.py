@@ -0,0 +1,84 @@
+import pytest
+import redis
+
+from redis_rl_cache_simulation import RedisTier, WriteBehindQueue
+
+@pytest.fixture
+def tier(redis_client):
+    return RedisTier(redis_client, capacity=100, namespace='test')
+
+@pytest.fixture
+def queue(tier):
+    # Nothing flushes on its own: no batch fills and the interval never passes
+    queue = WriteBehindQueue(tier, batch_size=100, flush_interval=60)
+    yield queue
+    queue.close()
+
+def test_read_your_writes_through_pending(tier, queue):
+    queue.submit('k', b'v1', 1.0)
+    assert queue.pending('k') == b'v1'
+    assert tier.get('k') is None
+    queue.flush()
+    assert queue.pending('k') is None
+    assert tier.get('k') == b'v1'
+
+def test_last_write_wins(tier, queue):
+    queue.submit('k', b'v1', 1.0)
+    queue.submit('k', b'v2', 2.0)
+    assert queue.pending('k') == b'v2'
+    queue.flush()
+    assert tier.get('k') == b'v2'
+    assert tier.client.zscore(tier.scores_key, tier.value_key('k')) == 2.0
+    assert queue.flushed_writes == 1
+
+def test_rescore_after_buffered_put_keeps_payload(tier, queue):
+    queue.submit('k', b'v1', 1.0)
+    queue.rescore('k', 5.0)
+    assert queue.pending('k') == b'v1'
+    queue.flush()
+    assert tier.get('k') == b'v1'
+    assert tier.client.zscore(tier.scores_key, tier.value_key('k')) == 5.0
+
+def test_rescore_only_never_adds_a_member(tier, queue):
+    queue.rescore('k', 5.0)
+    assert queue.pending('k') is None
+    queue.flush()
+    assert tier.get('k') is None
+    assert len(tier) == 0
+
+def test_synchronous_flush_at_max_pending(tier):
+    queue = WriteBehindQueue(tier, batch_size=100, flush_interval=60, max_pending=3)
+    try:
+        queue.submit('a', b'1', 1.0)
+        queue.submit('b', b'2', 1.0)
+        assert len(tier) == 0
+        queue.submit('c', b'3', 1.0)  # crosses the limit and flushes before returning
+        assert [tier.get(k) for k in 'abc'] == [b'1', b'2', b'3']
+        assert queue.pending('c') is None
+    finally:
+        queue.close()
+
+class FailingTier:
+    def write_batch(self, writes):
+        raise redis.ConnectionError('down')
+
+def test_failed_batch_is_counted_and_dropped():
+    queue = WriteBehindQueue(FailingTier(), batch_size=100, flush_interval=60)
+    try:
+        queue.submit('a', b'1', 1.0)
+        queue.submit('b', b'2', 1.0)
+        queue.flush()
+        assert queue.failed_writes == 2
+        assert queue.flushed_writes == 0
+        assert queue.pending('a') is None
+    finally:
+        queue.close()
+
+def test_close_drains_the_buffer(tier):
+    queue = WriteBehindQueue(tier, batch_size=100, flush_interval=60)
+    for i in range(10):
+        queue.submit(i, str(i).encode(), float(i))
+    queue.close()
+    assert [tier.get(i) for i in range(10)] == [str(i).encode() for i in range(10)]
+    assert queue.flushed_writes == 10
+    assert not queue.thread.is_alive()
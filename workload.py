@@ -0,0 +1,254 @@
+import argparse
+import bisect
+import itertools
+import random
+import struct
+import zlib
+
+import redis_rl_cache_simulation as sim
+
+# === Binary Trace Format ===
+#
+# A trace is a stream of (q_name, params) requests:
+#   magic  b'RLTRACE\x01'
+#   chunks <II record count, compressed length> + zlib(records)
+# Records are varint-coded:
+#   0, len, utf-8          defines the next string id
+#   1, len, utf-8          defines the next template id
+#   2 + template id, nparams, params...
+# with each param a varint: zigzag(int) << 1, or string id << 1 | 1.
+# Templates and repeated string params cost one definition per trace, so
+# a typical request is 3-5 bytes before compression. Chunks are decoded
+# one at a time, so replay memory does not grow with the trace length.
+
+TRACE_MAGIC = b'RLTRACE\x01'
+TRACE_CHUNK_RECORDS = 65536
+_CHUNK = struct.Struct('<II')
+
+_OP_STRING = 0
+_OP_TEMPLATE = 1
+_OP_REQUEST = 2
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _get_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+class TraceWriter:
+    """Appends requests to a trace file. Params may be ints or strings."""
+
+    def __init__(self, path, chunk_records=TRACE_CHUNK_RECORDS, compress_level=6):
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_MAGIC)
+        self.chunk_records = chunk_records
+        self.compress_level = compress_level
+        self.strings = {}
+        self.templates = {}
+        self.body = bytearray()
+        self.pending = 0
+        self.count = 0
+
+    def _define(self, op, table, text):
+        data = text.encode('utf-8')
+        _put_varint(self.body, op)
+        _put_varint(self.body, len(data))
+        self.body += data
+        table[text] = len(table)
+
+    def write(self, q_name, params):
+        template = self.templates.get(q_name)
+        if template is None:
+            self._define(_OP_TEMPLATE, self.templates, q_name)
+            template = self.templates[q_name]
+        codes = []
+        for param in params:
+            if type(param) is int:
+                codes.append((param << 1 if param >= 0 else (~param << 1) | 1) << 1)
+            elif type(param) is str:
+                if param not in self.strings:
+                    self._define(_OP_STRING, self.strings, param)
+                codes.append(self.strings[param] << 1 | 1)
+            else:
+                raise TypeError(f'cannot record a {type(param).__name__} parameter')
+        _put_varint(self.body, _OP_REQUEST + template)
+        _put_varint(self.body, len(codes))
+        for code in codes:
+            _put_varint(self.body, code)
+        self.pending += 1
+        self.count += 1
+        if self.pending >= self.chunk_records:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            data = zlib.compress(bytes(self.body), self.compress_level)
+            self.file.write(_CHUNK.pack(self.pending, len(data)) + data)
+            self.body.clear()
+            self.pending = 0
+
+    def close(self):
+        self._flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def record_trace(workload, path, **kwargs):
+    """Writes every (q_name, params) request of workload to path and
+    returns how many were written."""
+    with TraceWriter(path, **kwargs) as writer:
+        for q_name, params in workload:
+            writer.write(q_name, params)
+    return writer.count
+
+def read_trace(path):
+    """Streams (q_name, params) requests back from a trace file, in order."""
+    strings, templates = [], []
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f'{path} is not a trace file')
+        while True:
+            header = f.read(_CHUNK.size)
+            if not header:
+                return
+            records, length = _CHUNK.unpack(header)
+            body = zlib.decompress(f.read(length))
+            pos = 0
+            while records:
+                op, pos = _get_varint(body, pos)
+                if op < _OP_REQUEST:
+                    size, pos = _get_varint(body, pos)
+                    (strings if op == _OP_STRING else templates).append(str(body[pos:pos + size], 'utf-8'))
+                    pos += size
+                    continue
+                nparams, pos = _get_varint(body, pos)
+                params = []
+                for _ in range(nparams):
+                    code, pos = _get_varint(body, pos)
+                    if code & 1:
+                        params.append(strings[code >> 1])
+                    else:
+                        n = code >> 1
+                        params.append(n >> 1 if not n & 1 else ~(n >> 1))
+                yield templates[op - _OP_REQUEST], tuple(params)
+                records -= 1
+
+# === Parameterized Skew Generator ===
+
+PRODUCTS = 1000
+USERS = 5000
+CATEGORIES = ['Laptops', 'Mobiles', 'Tablets', 'Accessories', 'Desktops', 'Wearables']
+CITIES = ['New York', 'London', 'Tokyo', 'Delhi', 'Berlin']
+SEASONS = ['College Start', 'Holiday Sale', 'Back to School', 'Summer Sale', 'New Year']
+
+def key_universe(products=PRODUCTS, users=USERS):
+    """Every distinct request the templates can make against a database
+    generated with these table sizes."""
+    product_ids = range(1, products + 1)
+    return list(itertools.chain(
+        (("daily_sales_product", (p,)) for p in product_ids),
+        (("avg_order_value_user", (u,)) for u in range(1, users + 1)),
+        (("users_also_bought", (p,)) for p in product_ids),
+        (("running_total_sales_product", (p,)) for p in product_ids),
+        (("top_rated_products_category", (c,)) for c in CATEGORIES),
+        (("reviewed_and_bought", (p, p)) for p in product_ids),
+        (("products_on_promotion_season", (s,)) for s in SEASONS),
+        (("orders_by_city_in_season", (c, s)) for c in CITIES for s in SEASONS),
+    ))
+
+class SkewedWorkload:
+    """Seeded request stream over key_universe() with tunable skew:
+    - zipf_s: popularity of the rank-r key is proportional to 1 / r**zipf_s.
+    - burst_rate: fraction of requests that go to a short-lived burst set
+      of burst_width uniformly chosen keys, replaced every burst_length
+      requests.
+    - drift_every / drift_step: every drift_every requests the popularity
+      ranking rotates by drift_step keys, so the working set moves over
+      time (0 disables drift).
+    Iterating yields (q_name, params) forever, or `requests` of them."""
+
+    def __init__(self, seed=0, zipf_s=1.0, burst_rate=0.1, burst_width=3, burst_length=200,
+                 drift_every=0, drift_step=100, requests=None, universe=None):
+        self.seed = seed
+        self.zipf_s = zipf_s
+        self.burst_rate = burst_rate
+        self.burst_width = burst_width
+        self.burst_length = burst_length
+        self.drift_every = drift_every
+        self.drift_step = drift_step
+        self.requests = requests
+        self.universe = list(universe or key_universe())
+        random.Random(seed).shuffle(self.universe)
+        self.cumulative = list(itertools.accumulate(1 / r ** zipf_s for r in range(1, len(self.universe) + 1)))
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        universe, cumulative = self.universe, self.cumulative
+        n, total = len(universe), cumulative[-1]
+        burst = []
+        offset = 0
+        for i in itertools.count() if self.requests is None else range(self.requests):
+            if self.drift_every and i and i % self.drift_every == 0:
+                offset = (offset + self.drift_step) % n
+            if i % self.burst_length == 0:
+                burst = [rng.randrange(n) for _ in range(self.burst_width)]
+            if burst and rng.random() < self.burst_rate:
+                yield universe[rng.choice(burst)]
+                continue
+            rank = bisect.bisect_left(cumulative, rng.random() * total)
+            yield universe[(min(rank, n - 1) + offset) % n]
+
+# === CLI ===
+
+def main():
+    parser = argparse.ArgumentParser(description='Record, inspect and replay workload traces')
+    sub = parser.add_subparsers(dest='command', required=True)
+    rec = sub.add_parser('record', help='write a generated workload to a trace file')
+    rec.add_argument('path')
+    rec.add_argument('--requests', type=int, default=1_000_000)
+    rec.add_argument('--seed', type=int, default=0)
+    rec.add_argument('--generator', choices=['synthetic', 'skewed'], default='skewed')
+    rec.add_argument('--zipf', type=float, default=1.0, help='Zipf exponent')
+    rec.add_argument('--burst-rate', type=float, default=0.1)
+    rec.add_argument('--drift-every', type=int, default=0, help='requests between working-set shifts (0 = none)')
+    info = sub.add_parser('info', help='count the requests and distinct keys in a trace')
+    info.add_argument('path')
+    replay = sub.add_parser('replay', help='run the cached simulation over a trace (needs Postgres and Redis)')
+    replay.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        if args.generator == 'synthetic':
+            workload = sim.synthetic_workload(args.requests, args.seed)
+        else:
+            workload = SkewedWorkload(args.seed, args.zipf, args.burst_rate, drift_every=args.drift_every,
+                                      requests=args.requests)
+        print(f"wrote {record_trace(workload, args.path):,} requests to {args.path}")
+    elif args.command == 'info':
+        requests, keys = 0, set()
+        for request in read_trace(args.path):
+            requests += 1
+            keys.add(request)
+        print(f"{requests:,} requests, {len(keys):,} distinct keys")
+    else:
+        summary = sim.run_simulation(with_cache=True, workload=read_trace(args.path))
+        print(f"{summary['total_queries']} queries, avg {summary['avg_time']:.2f} ms, "
+              f"memory {summary['mem_hits']} / redis {summary['redis_hits']} / derived {summary['derived_hits']} "
+              f"/ db {summary['db_hits']}")
+
+if __name__ == '__main__':
+    main()